@@ -0,0 +1,3 @@
+# Helpers shared by the FastAPI backend and the Streamlit app: the agent turn loop and its
+# budget, the fast path router, the model cascade, per-user client pools, task digests,
+# the background job queue and the JSON serializer.
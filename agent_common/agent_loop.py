@@ -0,0 +1,95 @@
+import contextvars
+import threading
+import time
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~ Turn Budget ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Bounds one agent turn by a wall-clock deadline and a number of LLM steps.
+# The budget of the turn running on the current thread is kept in a context
+# variable so the HTTP layer (LLM streams, tool API calls) can cap its own
+# timeouts by the time left and stop as soon as the turn is cancelled.
+
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+PARTIAL_ANSWER = "I couldn't finish this request in time, so this answer may be incomplete."
+
+
+class TurnBudget:
+    """
+    Example call:
+
+    budget = TurnBudget(deadline_seconds=60, max_steps=6)
+    while budget.take_step():
+        ...  # one LLM call plus the tools it asked for
+    """
+
+    def __init__(self, deadline_seconds=60.0, max_steps=6):
+        self.deadline = time.monotonic() + deadline_seconds
+        self.max_steps = max_steps
+        self.steps = 0
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self):
+        """Cancels the turn, e.g. when the user leaves or a new message supersedes it."""
+        self._cancelled.set()
+
+    def expired(self):
+        return self._cancelled.is_set() or self.remaining() <= 0
+
+    def take_step(self):
+        """
+        Returns:
+            bool: True if another LLM step may start, False once the deadline or step budget is used up.
+        """
+        if self.expired() or self.steps >= self.max_steps:
+            return False
+        self.steps += 1
+        return True
+
+    def timeout(self, default):
+        """The timeout to give an HTTP call: the default, capped by the time left in the turn."""
+        return max(0.1, min(default, self.remaining()))
+
+
+def stream_with_budget(stream, budget):
+    """
+    Yields chunks from an LLM stream until it ends or the turn runs out of time. On
+    expiry the stream is closed, which closes the underlying HTTP response.
+    """
+    try:
+        for chunk in stream:
+            yield chunk
+            if budget.expired():
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+def timeout_session(default_timeout=30.0, rate_limiter=None):
+    """
+    Returns a requests.Session whose requests time out by the end of the current
+    turn (or after `default_timeout` seconds outside of a turn), and fail straight
+    away once the turn is cancelled. With a rate limiter, each request first waits
+    for a token, for no longer than the time left in the turn.
+    """
+    import requests
+
+    class TimeoutSession(requests.Session):
+        def request(self, *args, **kwargs):
+            budget = current_budget.get()
+            if budget is not None:
+                if budget.expired():
+                    raise requests.Timeout("The agent turn ran out of time.")
+                kwargs["timeout"] = budget.timeout(kwargs.get("timeout") or default_timeout)
+            else:
+                kwargs.setdefault("timeout", default_timeout)
+            if rate_limiter is not None:
+                rate_limiter.acquire(budget.remaining() if budget is not None else default_timeout)
+            return super().request(*args, **kwargs)
+
+    return TimeoutSession()
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import contextvars
+import threading
+import hashlib
+import time
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Tenant Client Pool ~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# One API client per user (tenant), each with its own keep-alive connections,
+# rate limiter and caches, so a single process can serve many users without
+# sharing state between them or rebuilding clients on every request. Tenants are
+# kept in an LRU: idle ones are evicted, and so is the least recently used one
+# once the pool is full, which keeps memory bounded.
+
+# The API token of the user the current request or script run is for
+current_tenant_token = contextvars.ContextVar("current_tenant_token", default=None)
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second on average, in bursts of up to `burst`.
+    """
+
+    def __init__(self, rate=5.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=30.0):
+        """
+        Waits for a token. Raises RateLimitExceeded if none frees up within max_wait seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > max_wait:
+                raise RateLimitExceeded(f"Rate limit exceeded, retry in {wait:.1f}s.")
+            # Reserve the token now, so concurrent callers queue up behind this one
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+
+class Tenant:
+    def __init__(self, key, client, rate_limiter):
+        self.key = key
+        self.client = client
+        self.rate_limiter = rate_limiter
+        # Per-tenant caches (project indexes, digests, ...), never shared between tenants
+        self.cache = {}
+        self.last_used = time.monotonic()
+
+
+def tenant_key(token):
+    # Tokens are never kept as keys or shown in metrics, only their hash
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+class TenantClientPool:
+    """
+    Example call:
+
+    pool = TenantClientPool(lambda token, rate_limiter: TodoistAPI(token))
+    tenant = pool.get("user-api-token")
+    tenant.client.get_projects()
+
+    Args:
+        factory (callable): Builds the client of a tenant from its token and rate limiter.
+        close (callable, optional): Releases an evicted client's connections.
+        max_tenants (int): Most tenants kept at once.
+        idle_seconds (float): Tenants unused for this long are evicted.
+        rate (float): Calls per second allowed per tenant.
+        burst (int): Burst size of the per-tenant rate limiter.
+    """
+
+    def __init__(self, factory, close=None, max_tenants=1000, idle_seconds=900.0, rate=5.0, burst=10):
+        self.factory = factory
+        self.close = close
+        self.max_tenants = max_tenants
+        self.idle_seconds = idle_seconds
+        self.rate = rate
+        self.burst = burst
+        self.created = 0
+        self.evicted = 0
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        key = tenant_key(token)
+        with self._lock:
+            tenant = self._tenants.get(key)
+            if tenant is not None:
+                self._tenants.move_to_end(key)
+            self._evict(keep=key)
+        if tenant is None:
+            rate_limiter = RateLimiter(self.rate, self.burst)
+            tenant = Tenant(key, self.factory(token, rate_limiter), rate_limiter)
+            with self._lock:
+                # Another thread may have created it meanwhile; keep the first one
+                existing = self._tenants.get(key)
+                if existing is not None:
+                    self._release(tenant)
+                    tenant = existing
+                else:
+                    self._tenants[key] = tenant
+                    self.created += 1
+                    self._evict(keep=key)
+        tenant.last_used = time.monotonic()
+        return tenant
+
+    def peek(self, token):
+        """The tenant of a token if it is in the pool, without creating it or counting as use."""
+        with self._lock:
+            return self._tenants.get(tenant_key(token))
+
+    def _evict(self, keep):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._tenants:
+            key, oldest = next(iter(self._tenants.items()))
+            if key == keep:
+                break
+            if len(self._tenants) <= self.max_tenants and oldest.last_used >= cutoff:
+                break
+            del self._tenants[key]
+            self.evicted += 1
+            self._release(oldest)
+
+    def _release(self, tenant):
+        if self.close is not None:
+            self.close(tenant.client)
+
+    def tenants(self):
+        """A snapshot of the tenants in the pool, for background jobs. Does not count as use."""
+        with self._lock:
+            return list(self._tenants.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tenants": len(self._tenants),
+                "max_tenants": self.max_tenants,
+                "created": self.created,
+                "evicted": self.evicted,
+            }
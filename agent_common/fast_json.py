@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import time
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~ Fast JSON ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# One serializer for HTTP responses, tool outputs and what is persisted to disk.
+# Uses orjson when it is installed, then msgspec, then the standard library, and
+# writes compact JSON (no indentation or spaces) unless asked to pretty-print.
+# JSON_BACKEND=orjson|msgspec|json forces one of them.
+#
+# Example calls:
+#
+#   dumps({"message": "Done"})   # -> b'{"message":"Done"}'
+#   dumps_str(tasks)             # -> '[{"id":"1",...}]'
+#   loads(b'{"message":"Done"}') # -> {"message": "Done"}
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=str, option=option)
+
+    return "orjson", dumps, orjson.loads
+
+
+def _msgspec():
+    import msgspec
+
+    encoder = msgspec.json.Encoder(enc_hook=str)
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj, pretty=False):
+        data = encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+
+    return "msgspec", dumps, decoder.decode
+
+
+def _stdlib():
+    def dumps(obj, pretty=False):
+        if pretty:
+            return json.dumps(obj, indent=2, ensure_ascii=False, default=str).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+    return "json", dumps, json.loads
+
+
+def _select_backend(name):
+    backends = {"orjson": _orjson, "msgspec": _msgspec, "json": _stdlib}
+    candidates = [backends[name]] if name in backends else [_orjson, _msgspec]
+    for backend in candidates:
+        try:
+            return backend()
+        except ImportError:
+            pass
+    return _stdlib()
+
+
+BACKEND, _dumps, _loads = _select_backend(os.getenv("JSON_BACKEND", "auto"))
+
+
+def dumps(obj, pretty=False):
+    """
+    Serializes to UTF-8 JSON bytes. Values JSON has no type for (dates, ...) are written as strings.
+    """
+    return _dumps(obj, pretty)
+
+
+def dumps_str(obj, pretty=False):
+    return _dumps(obj, pretty).decode("utf-8")
+
+
+def loads(data):
+    return _loads(data)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Benchmark ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def sample_tasks(count):
+    """A task list shaped like the Todoist/Asana task dictionaries the tools return."""
+    return [
+        {
+            "id": str(8_000_000_000 + i),
+            "content": f"Follow up on action item {i} from the weekly sync",
+            "description": "Check the meeting notes for the details and owners.",
+            "is_completed": False,
+            "labels": ["meeting", "follow-up"],
+            "priority": i % 4 + 1,
+            "project_id": str(2_300_000_000 + i % 12),
+            "due": {"date": f"2024-07-{i % 28 + 1:02d}", "is_recurring": False, "string": "Jul 20"},
+            "url": f"https://todoist.com/showTask?id={8_000_000_000 + i}",
+            "created_at": "2024-07-18T09:30:00.000000Z",
+        }
+        for i in range(count)
+    ]
+
+
+def benchmark(task_counts, repeat):
+    """
+    Compares the time to serialize one turn's task list the old way (indented stdlib
+    json) with compact stdlib json and with the selected backend.
+    """
+    print(f"backend: {BACKEND}")
+    ways = {
+        "json, indent=2": lambda tasks: json.dumps(tasks, indent=2),
+        "json, compact": lambda tasks: json.dumps(tasks, separators=(",", ":")),
+        f"{BACKEND} (dumps)": dumps,
+    }
+    for count in task_counts:
+        tasks = sample_tasks(count)
+        print(f"\n{count} tasks:")
+        timings = {}
+        for name, serialize in ways.items():
+            start = time.process_time()
+            for _ in range(repeat):
+                output = serialize(tasks)
+            timings[name] = (time.process_time() - start) / repeat
+            print(f"  {name:<18} {timings[name] * 1000:8.3f} ms CPU  {len(output) / 1024:8.1f} KiB")
+        saved = timings["json, indent=2"] - timings[f"{BACKEND} (dumps)"]
+        print(f"  CPU saved per serialization: {saved * 1000:.3f} ms ({timings['json, indent=2'] / max(timings[f'{BACKEND} (dumps)'], 1e-9):.1f}x faster)")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the JSON serializer on task lists.")
+    arg_parser.add_argument("--tasks", type=int, nargs="+", default=[100, 1000, 10000])
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+    benchmark(args.tasks, args.repeat)
@@ -0,0 +1,149 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Intent Router ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Fast path for formulaic requests ("what's due today", "list my projects").
+# A request is routed straight to a tool when one of a route's compiled patterns
+# matches the whole message, or, for routes without arguments, when a small
+# bag-of-words nearest-neighbour classifier is confident about it. Everything else
+# falls back to the LLM, as do messages with a condition or a restriction ("... but
+# only in Work", "... if it's urgent") that a pattern would silently drop.
+#
+# Routes must be read-only. A misparsed write ("Complete sign up in Work please" read
+# as project "Work please") would be applied without the LLM ever seeing it.
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"a", "an", "the", "is", "s", "are", "my", "me", "i", "do", "please", "can", "you", "all", "of"}
+_NEGATIONS = {"not", "no", "never", "don", "doesn", "isn", "aren", "without", "except"}
+_QUALIFIERS = re.compile(r"\b(?:if|but|unless|only|except|instead|then)\b", re.IGNORECASE)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def cosine(a, b):
+    dot = sum(count * b.get(token, 0) for token, count in a.items())
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+class Route:
+    """
+    A tool the router may dispatch to without the LLM.
+
+    Args:
+        name (str): The name of the route, used in the metrics.
+        handler (callable): Called with the named groups of the matching pattern. Returns the
+            templated answer, or None to fall back to the LLM (e.g. when the tool needs clarification).
+        patterns (list): Regular expressions that must match the whole message.
+        examples (list): Example utterances for the classifier. Only used for routes whose
+            handler takes no arguments.
+    """
+
+    def __init__(self, name, handler, patterns=(), examples=()):
+        self.name = name
+        self.handler = handler
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        self.examples = [Counter(tokenize(example)) for example in examples]
+
+
+class IntentRouter:
+    def __init__(self, routes, min_similarity=0.8, min_margin=0.15):
+        self.routes = routes
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.routed = Counter()
+        self.fallbacks = 0
+        self.route_seconds = 0.0
+        # Exponential moving average of a full LLM turn, used to estimate the time saved
+        self.llm_turn_seconds = None
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        """
+        Returns:
+            tuple: (route, similarity) of the closest example, or (None, 0.0) if not confident.
+        """
+        tokens = Counter(tokenize(text))
+        if not tokens or _NEGATIONS.intersection(tokens):
+            return None, 0.0
+
+        scores = sorted(
+            ((max(cosine(tokens, example) for example in route.examples), route)
+             for route in self.routes if route.examples),
+            key=lambda score: -score[0],
+        )
+        if not scores or scores[0][0] < self.min_similarity:
+            return None, 0.0
+        if len(scores) > 1 and scores[0][0] - scores[1][0] < self.min_margin:
+            return None, 0.0
+        return scores[0][1], scores[0][0]
+
+    def match(self, text):
+        """
+        Returns:
+            tuple: (route, arguments) for a high-confidence match, otherwise (None, None).
+        """
+        text = text.strip().rstrip("?.! ")
+        if _QUALIFIERS.search(text):
+            return None, None
+        for route in self.routes:
+            for pattern in route.patterns:
+                match = pattern.fullmatch(text)
+                if match:
+                    return route, {name: value.strip() for name, value in match.groupdict().items() if value}
+
+        route, _ = self.classify(text)
+        if route is not None:
+            return route, {}
+        return None, None
+
+    def route(self, text):
+        """
+        Answers the message through the fast path if possible.
+
+        Returns:
+            str: The templated answer, or None if the message should go to the LLM.
+        """
+        start = time.perf_counter()
+        route, arguments = self.match(text)
+        answer = route.handler(**arguments) if route is not None else None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            if answer is None:
+                self.fallbacks += 1
+            else:
+                self.routed[route.name] += 1
+                self.route_seconds += elapsed
+        return answer
+
+    def record_llm_latency(self, seconds):
+        with self._lock:
+            if self.llm_turn_seconds is None:
+                self.llm_turn_seconds = seconds
+            else:
+                self.llm_turn_seconds = 0.8 * self.llm_turn_seconds + 0.2 * seconds
+
+    def stats(self):
+        """
+        Returns:
+            dict: Routing hit rate, hits per route and the estimated LLM latency saved.
+        """
+        with self._lock:
+            routed = sum(self.routed.values())
+            total = routed + self.fallbacks
+            saved = routed * (self.llm_turn_seconds or 0.0) - self.route_seconds
+            return {
+                "routed": routed,
+                "fallbacks": self.fallbacks,
+                "hit_rate": routed / total if total else 0.0,
+                "routes": dict(self.routed),
+                "estimated_seconds_saved": round(max(saved, 0.0), 3),
+            }
@@ -0,0 +1,400 @@
+import threading
+import sqlite3
+import uuid
+import time
+
+from agent_common import fast_json
+from agent_common.client_pool import current_tenant_token, tenant_key
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Job Queue ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Optional durable queue for write operations, so a chat turn can acknowledge a
+# write straight away instead of waiting on the provider. Jobs are stored in a
+# local SQLite database and run by a pool of worker threads, with the tenant token
+# of the user who enqueued them. Finished jobs are kept until their owner has been
+# told about them (at the start of their next turn) and for `retention_seconds` after that.
+#
+# A failed write is only retried (with exponential backoff) when running it again
+# cannot duplicate it: when the error proves the request never reached the provider
+# (connection refused, 429, client-side rate limit), or for jobs registered as
+# idempotent. Otherwise, a timeout or server error leaves the outcome unknown, and
+# the job fails with a message saying so rather than risk creating a second task.
+# Running jobs hold a lease that their worker renews; a job whose lease expired
+# (its process stopped mid-write) is handled the same way.
+#
+# API tokens are never written to the database, only their hash. The tokens are
+# kept in memory while their tenant has pending jobs, so after a restart only the
+# jobs of the default token (or of users seen again since) can still run; the
+# others fail with an explanation.
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    description TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    tenant TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    reported INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    worker TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, reported);
+"""
+
+UNKNOWN_OUTCOME = "Unknown outcome, the write may or may not have been applied ({error}). Check before trying again."
+INTERRUPTED = "the app stopped while the job was running"
+
+# Errors raised before a request was sent (urllib3/requests and httpx names), or by the
+# client-side rate limiter: nothing can have been written
+_NOT_SENT_ERRORS = {
+    "NewConnectionError", "NameResolutionError", "ConnectTimeoutError",
+    "ConnectError", "ConnectTimeout", "RateLimitExceeded",
+}
+# Errors after which the request may or may not have been processed
+_TRANSIENT_ERRORS = {
+    "Timeout", "TimeoutError", "TimeoutException", "ConnectionError",
+    "ProtocolError", "RemoteDisconnected", "ReadTimeoutError", "NetworkError",
+}
+
+
+def _error_chain(error):
+    # The error and what it wraps: requests and urllib3 nest the root cause in args and `reason`
+    seen = set()
+    pending = [error]
+    while pending:
+        error = pending.pop()
+        if error is None or id(error) in seen:
+            continue
+        seen.add(id(error))
+        yield error
+        pending.extend([error.__cause__, error.__context__, getattr(error, "reason", None)])
+        pending.extend(arg for arg in error.args if isinstance(arg, BaseException))
+
+
+def _error_names(error):
+    return {cls.__name__ for nested in _error_chain(error) for cls in type(nested).__mro__}
+
+
+def status_code(error):
+    """The HTTP status of an API error (Asana's ApiException, requests or httpx), or None."""
+    for nested in _error_chain(error):
+        status = getattr(nested, "status", None) or getattr(getattr(nested, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def not_sent(error):
+    """True when the error proves the request never reached the provider, so nothing was written."""
+    return status_code(error) == 429 or bool(_error_names(error) & _NOT_SENT_ERRORS)
+
+
+def transient(error):
+    """True when trying again may succeed: errors that were not sent, server errors and network errors."""
+    if not_sent(error):
+        return True
+    status = status_code(error)
+    if status is not None:
+        return status >= 500
+    return bool(_error_names(error) & _TRANSIENT_ERRORS)
+
+
+class JobQueue:
+    """
+    Example call:
+
+    job_queue = JobQueue("./jobs.sqlite3", {"add_task": add_task, "close_task": close_task}, idempotent={"close_task"})
+    job_id = job_queue.enqueue("add_task", {"content": "Buy milk", ...}, "Create task 'Buy milk'", owner="session-1")
+    job_queue.get(job_id)["status"]          # -> "queued", "running", "succeeded" or "failed"
+    job_queue.take_finished("session-1")     # -> the jobs finished since the last call
+
+    Args:
+        path (str): The SQLite database file.
+        handlers (dict): Maps job names to the functions that run them. A handler raises to
+            fail an attempt and returns a JSON-serializable result.
+        workers (int): Number of worker threads.
+        max_attempts (int): Attempts before a job is marked as failed.
+        retry_seconds (float): Delay before the first retry, doubled on each further one.
+        retention_seconds (float): How long reported jobs are kept.
+        idempotent (iterable): Names of the handlers that can safely run twice (closing a task,
+            deleting a project), which are retried after any transient error.
+        lease_seconds (float): How long a running job's worker can go without renewing its
+            lease before the job counts as interrupted.
+    """
+
+    def __init__(self, path, handlers, workers=2, max_attempts=3, retry_seconds=2.0, retention_seconds=86400.0,
+                 idempotent=(), lease_seconds=30.0):
+        self.path = path
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.retention_seconds = retention_seconds
+        self.idempotent = set(idempotent)
+        self.lease_seconds = lease_seconds
+        self.worker_id = uuid.uuid4().hex
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+            # Databases created before jobs had leases
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            for column, kind in [("worker", "TEXT"), ("lease_expires", "REAL")]:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def _connect(self):
+        # One short-lived connection per operation, so worker threads never share one
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        return _Connection(connection)
+
+    def start(self):
+        """Starts the worker threads and the lease heartbeat. Only the first call starts them."""
+        with self._lock:
+            if self._threads or self._stopped.is_set():
+                return
+            targets = [(self._run, f"job-worker-{number}") for number in range(self.workers)]
+            targets.append((self._heartbeat, "job-heartbeat"))
+            for target, name in targets:
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stops the workers once they finish their current job. Jobs left queued run on the next start."""
+        self._stopped.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Jobs ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def enqueue(self, name, args, description, owner):
+        """
+        Stores a job for the current tenant and returns its ID straight away.
+
+        Args:
+            name (str): The handler to run.
+            args (dict): The handler's keyword arguments.
+            description (str): What the job does, in words the user will recognize.
+            owner (str): Who to report the result to (a session or user ID).
+        """
+        self.start()
+        token = current_tenant_token.get()
+        tenant = tenant_key(token) if token else None
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        # The token and the job are stored together, so the token is never dropped between the two
+        with self._tokens_lock, self._connect() as connection:
+            if token:
+                self._tokens[tenant] = token
+            connection.execute(
+                "INSERT INTO jobs (id, name, args, description, owner, tenant, status, created_at, updated_at, run_after) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, name, fast_json.dumps_str(args), description, owner, tenant, QUEUED, now, now, now),
+            )
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict: The job's status, attempts, result or error and timestamps, or None if there is no such job.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def take_finished(self, owner):
+        """Returns the owner's jobs that finished since the last call, and marks them as reported."""
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE owner = ? AND reported = 0 AND status IN (?, ?) ORDER BY updated_at",
+                (owner, SUCCEEDED, FAILED),
+            ).fetchall()
+            connection.executemany("UPDATE jobs SET reported = 1 WHERE id = ?", [(row["id"],) for row in rows])
+            connection.execute("COMMIT")
+        return [self._to_dict(row) for row in rows]
+
+    def _to_dict(self, row):
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "description": row["description"],
+            "owner": row["owner"],
+            "tenant": row["tenant"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "result": fast_json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Workers ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._recover_interrupted(connection, now)
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND run_after <= ? ORDER BY run_after LIMIT 1",
+                (QUEUED, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, worker = ?, lease_expires = ? WHERE id = ?",
+                    (RUNNING, now, self.worker_id, now + self.lease_seconds, row["id"]),
+                )
+            connection.execute("COMMIT")
+        return row
+
+    def _recover_interrupted(self, connection, now):
+        # Jobs whose worker stopped renewing their lease: the process died mid-write
+        rows = connection.execute(
+            "SELECT * FROM jobs WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)", (RUNNING, now)
+        ).fetchall()
+        for row in rows:
+            if row["name"] in self.idempotent and row["attempts"] < self.max_attempts:
+                status, error = QUEUED, f"Interrupted: {INTERRUPTED}."
+            else:
+                status, error = FAILED, UNKNOWN_OUTCOME.format(error=INTERRUPTED)
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, run_after = ?, worker = NULL, lease_expires = NULL WHERE id = ?",
+                (status, error, now, now, row["id"]),
+            )
+
+    def _finish(self, row, status, result=None, error=None, run_after=None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, run_after = COALESCE(?, run_after), "
+                "worker = NULL, lease_expires = NULL WHERE id = ?",
+                (status, fast_json.dumps_str(result) if result is not None else None, error, time.time(), run_after, row["id"]),
+            )
+            if status != QUEUED:
+                self._release_token(connection, row["tenant"])
+
+    def _release_token(self, connection, tenant):
+        # Tokens are only kept while their tenant has jobs waiting to run
+        if tenant is None:
+            return
+        with self._tokens_lock:
+            pending = connection.execute(
+                "SELECT 1 FROM jobs WHERE tenant = ? AND status IN (?, ?) LIMIT 1", (tenant, QUEUED, RUNNING)
+            ).fetchone()
+            if pending is None:
+                self._tokens.pop(tenant, None)
+
+    def _execute(self, row):
+        attempts = row["attempts"] + 1
+        with self._tokens_lock:
+            token = self._tokens.get(row["tenant"])
+        if row["tenant"] is not None and token is None:
+            self._finish(row, FAILED, error="The job's API token is no longer available (the app restarted). Please try again.")
+            return
+        try:
+            # The handler runs with the token of the user who enqueued the job
+            current_tenant_token.set(token)
+            result = self.handlers[row["name"]](**fast_json.loads(row["args"]))
+        except Exception as e:
+            if not_sent(e) or (row["name"] in self.idempotent and transient(e)):
+                if attempts < self.max_attempts:
+                    retry_at = time.time() + self.retry_seconds * 2 ** (attempts - 1)
+                    self._finish(row, QUEUED, error=str(e), run_after=retry_at)
+                else:
+                    self._finish(row, FAILED, error=str(e))
+            elif transient(e):
+                # The provider may have applied the write before failing: running it again could duplicate it
+                self._finish(row, FAILED, error=UNKNOWN_OUTCOME.format(error=e))
+            else:
+                self._finish(row, FAILED, error=str(e))
+            return
+        finally:
+            current_tenant_token.set(None)
+        self._finish(row, SUCCEEDED, result=result)
+
+    def _heartbeat(self):
+        # Renews the leases of the jobs this queue's workers are running
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._connect() as connection:
+                connection.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE status = ? AND worker = ?",
+                    (time.time() + self.lease_seconds, RUNNING, self.worker_id),
+                )
+
+    def _purge(self):
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE reported = 1 AND updated_at < ?", (time.time() - self.retention_seconds,)
+            )
+
+    def _run(self):
+        last_purge = 0.0
+        while not self._stopped.is_set():
+            row = self._claim()
+            if row is not None:
+                self._execute(row)
+                continue
+            if time.monotonic() - last_purge > 60:
+                self._purge()
+                last_purge = time.monotonic()
+            # Nothing due: sleep until a job is enqueued or the next retry might be due
+            self._wake.wait(min(1.0, self.retry_seconds))
+            self._wake.clear()
+
+    def stats(self):
+        with self._connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        counts.update({row["status"]: row["count"] for row in rows})
+        with self._tokens_lock:
+            counts["tokens_held"] = len(self._tokens)
+        return counts
+
+
+class _Connection:
+    # Closes the connection on exit (sqlite3's own context manager only ends the transaction)
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None and self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+        self.connection.close()
+
+
+def describe_finished_jobs(jobs):
+    """A note for the AI about background jobs that finished since the user's last message."""
+    lines = []
+    for job in jobs:
+        if job["status"] == SUCCEEDED:
+            lines.append(f"- {job['description']} (job {job['id']}): done.")
+        else:
+            lines.append(f"- {job['description']} (job {job['id']}): FAILED after {job['attempts']} attempt(s): {job['error']}")
+    return "Background jobs finished since the last message:\n" + "\n".join(lines)
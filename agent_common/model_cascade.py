@@ -0,0 +1,126 @@
+import re
+import threading
+from collections import Counter, defaultdict
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ Model Cascade ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Sends simple tool-selection turns to a small, fast model and escalates to the
+# large model when the turn looks multi-step, or when the fast model's answer has
+# malformed tool calls or looks unsure of itself. A streamed fast answer is held
+# back until its opening shows it isn't unsure, then streamed as it comes; only
+# its tool calls can still escalate it after that.
+
+FAST = "fast"
+STRONG = "strong"
+
+_MULTI_STEP = re.compile(
+    r"\b(and then|then|after that|afterwards|followed by|compare|summari[sz]e|plan|why|explain)\b|;",
+    re.IGNORECASE,
+)
+_UNSURE = re.compile(
+    r"\b(i'?m not sure|i am not sure|i don'?t know|i cannot determine|i can'?t determine|unclear)\b",
+    re.IGNORECASE,
+)
+
+
+class ModelCascade:
+    """
+    Example call:
+
+    cascade = ModelCascade("command-r7b-12-2024", "command-r-plus")
+    tier = cascade.initial_tier("What's due today?")  # -> "fast"
+    """
+
+    def __init__(self, fast_model, strong_model, enabled=True, max_fast_length=300, stream_after_characters=200):
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.enabled = enabled
+        self.max_fast_length = max_fast_length
+        self.stream_after_characters = stream_after_characters
+        self.turns = Counter()
+        self.escalations = Counter()
+        self.latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def model(self, tier):
+        return self.models[tier]
+
+    def initial_tier(self, text, step=0):
+        """
+        Picks the tier for a call before it is made.
+
+        Args:
+            text (str): The latest user message.
+            step (int): How many tool rounds already happened in this turn.
+        """
+        if not self.enabled:
+            return STRONG
+        if step >= 2 or len(text) > self.max_fast_length or text.count("?") > 1 or _MULTI_STEP.search(text):
+            return STRONG
+        return FAST
+
+    def can_stream(self, text):
+        """
+        Returns:
+            bool: True once the opening of a fast-tier answer is long enough, and sure enough
+                of itself, to be shown before the whole answer has been checked.
+        """
+        return len(text) >= self.stream_after_characters and not _UNSURE.search(text)
+
+    def escalation_reason(self, text, tool_calls, tool_parameters, check_text=True):
+        """
+        Checks a fast-tier response.
+
+        Args:
+            text (str): The text of the response.
+            tool_calls (list): (name, arguments) pairs of the tool calls in the response.
+            tool_parameters (dict): Maps each tool name to the set of its required parameters.
+            check_text (bool): False once the text has been streamed to the user, so only
+                the tool calls are checked.
+
+        Returns:
+            str: Why the turn should be escalated to the strong model, or None if the response is fine.
+        """
+        for name, arguments in tool_calls:
+            if name not in tool_parameters:
+                return "unknown_tool"
+            if not isinstance(arguments, dict) or not tool_parameters[name].issubset(arguments):
+                return "malformed_arguments"
+        if not check_text or tool_calls:
+            return None
+        if not text.strip():
+            return "empty_response"
+        if _UNSURE.search(text):
+            return "low_confidence"
+        return None
+
+    def record(self, tier, seconds, escalation_reason=None):
+        with self._lock:
+            self.turns[tier] += 1
+            self.latencies[tier].append(seconds)
+            # Keep a bounded window of recent latencies per tier
+            del self.latencies[tier][:-1000]
+            if escalation_reason:
+                self.escalations[escalation_reason] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Calls and median latency per tier, and the escalation rate and reasons.
+        """
+        with self._lock:
+            tiers = {}
+            for tier, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                tiers[tier] = {
+                    "model": self.models[tier],
+                    "calls": self.turns[tier],
+                    "median_seconds": round(ordered[len(ordered) // 2], 3),
+                }
+            fast_calls = self.turns[FAST]
+            escalated = sum(self.escalations.values())
+            return {
+                "enabled": self.enabled,
+                "tiers": tiers,
+                "escalation_rate": escalated / fast_calls if fast_calls else 0.0,
+                "escalations": dict(self.escalations),
+            }
@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+import threading
+import time
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Task Digests ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# "What's due today / overdue / this week" is answered from a digest of each
+# user's open tasks, kept in the user's tenant cache and rebuilt in a background
+# thread: every `interval_seconds`, and right after the user writes a task.
+# Reads never fetch the task list themselves, except for a tenant's first read,
+# the first read of a new day, or a read right after a write that the background
+# refresh has not caught up with yet (so users always see their own writes).
+
+DIGEST = "digest"
+DIRTY = "digest_dirty"
+LOCK = "digest_lock"
+
+
+def build_digest(tasks, today=None, horizon_days=7):
+    """
+    Builds the digest of a list of open tasks.
+
+    Example call:
+
+    build_digest([{"id": "1", "content": "Send invoice", "due_date": "2024-07-20", "project_id": "42"}])
+
+    Args:
+        tasks (list): Open tasks as dictionaries, each with at least a `due_date`
+            (YYYY-MM-DD or None) and a `project_id`.
+        today (date, optional): Defaults to the current date.
+        horizon_days (int): How many days after today count as upcoming.
+
+    Returns:
+        dict: The tasks due today, overdue and upcoming, all dated tasks by due date,
+            and per project counts.
+    """
+    today = today or datetime.now().date()
+    today_string = today.isoformat()
+    horizon = (today + timedelta(days=horizon_days)).isoformat()
+
+    digest = {
+        "date": today_string,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "due_today": [],
+        "overdue": [],
+        "upcoming": [],
+        "by_due_date": {},
+        "counts_by_project": {},
+    }
+    for task in tasks:
+        counts = digest["counts_by_project"].setdefault(
+            task["project_id"], {"open": 0, "due_today": 0, "overdue": 0, "upcoming": 0}
+        )
+        counts["open"] += 1
+        due_date = (task.get("due_date") or "")[:10]
+        if not due_date:
+            continue
+        digest["by_due_date"].setdefault(due_date, []).append(task)
+        if due_date == today_string:
+            view = "due_today"
+        elif due_date < today_string:
+            view = "overdue"
+        elif due_date <= horizon:
+            view = "upcoming"
+        else:
+            continue
+        digest[view].append(task)
+        counts[view] += 1
+
+    digest["overdue"].sort(key=lambda task: task["due_date"])
+    digest["upcoming"].sort(key=lambda task: task["due_date"])
+    return digest
+
+
+class DigestScheduler:
+    """
+    Example call:
+
+    task_digests = DigestScheduler(client_pool, fetch_open_tasks, interval_seconds=300)
+    task_digests.get(tenant)["due_today"]
+    task_digests.invalidate(tenant)  # after creating, updating or completing a task
+
+    Args:
+        pool (TenantClientPool): The pool whose tenants' digests are kept up to date.
+        fetch_tasks (callable): Returns the open tasks of a tenant, as `build_digest` expects them.
+        interval_seconds (float): How often every digest is rebuilt in the background.
+        horizon_days (int): How many days after today count as upcoming.
+    """
+
+    def __init__(self, pool, fetch_tasks, interval_seconds=300.0, horizon_days=7):
+        self.pool = pool
+        self.fetch_tasks = fetch_tasks
+        self.interval_seconds = interval_seconds
+        self.horizon_days = horizon_days
+        self.refreshes = {"background": 0, "on_read": 0}
+        self.errors = 0
+        self.refresh_seconds = 0.0
+        self.last_error = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the background refresh thread. Only the first call starts it."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="digest-refresh", daemon=True)
+            self._thread.start()
+
+    def refresh(self, tenant, reason="background"):
+        # One refresh at a time per tenant: a read waiting on the lock gets the result of the one running
+        with tenant.cache.setdefault(LOCK, threading.Lock()):
+            entry = tenant.cache.get(DIGEST)
+            if reason == "on_read" and entry is not None and not self._stale(tenant, entry):
+                return entry["digest"]
+            start = time.perf_counter()
+            # Cleared before fetching, so a write made meanwhile marks it dirty again
+            tenant.cache[DIRTY] = False
+            try:
+                tasks = self.fetch_tasks(tenant)
+            except Exception:
+                tenant.cache[DIRTY] = entry is not None
+                raise
+            digest = build_digest(tasks, horizon_days=self.horizon_days)
+            tenant.cache[DIGEST] = {"digest": digest, "refreshed_at": time.monotonic()}
+        with self._lock:
+            self.refreshes[reason] += 1
+            self.refresh_seconds += time.perf_counter() - start
+        return digest
+
+    def _stale(self, tenant, entry):
+        return tenant.cache.get(DIRTY) or entry["digest"]["date"] != datetime.now().date().isoformat()
+
+    def get(self, tenant):
+        """
+        Returns the tenant's digest, building it on the spot only if there is none yet,
+        it is from another day, or the tenant wrote a task since it was built.
+        """
+        self.start()
+        entry = tenant.cache.get(DIGEST)
+        if entry is None or self._stale(tenant, entry):
+            return self.refresh(tenant, "on_read")
+        return entry["digest"]
+
+    def invalidate(self, tenant):
+        """Marks the tenant's digest as out of date and wakes the background thread to rebuild it."""
+        if DIGEST in tenant.cache:
+            tenant.cache[DIRTY] = True
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            now = time.monotonic()
+            # Only tenants that asked for a digest are kept up to date
+            for tenant in self.pool.tenants():
+                entry = tenant.cache.get(DIGEST)
+                if entry is None:
+                    continue
+                if tenant.cache.get(DIRTY) or now - entry["refreshed_at"] >= self.interval_seconds:
+                    try:
+                        self.refresh(tenant)
+                    except Exception as e:
+                        # Keep serving the last digest, the next round tries again
+                        with self._lock:
+                            self.errors += 1
+                            self.last_error = str(e)
+
+    def stats(self):
+        with self._lock:
+            refreshes = sum(self.refreshes.values())
+            return {
+                "refreshes": dict(self.refreshes),
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "average_refresh_seconds": round(self.refresh_seconds / (refreshes or 1), 3),
+                "interval_seconds": self.interval_seconds,
+            }
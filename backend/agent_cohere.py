@@ -1,22 +1,195 @@
-import cohere
-import asana
-from asana.rest import ApiException
 from dotenv import load_dotenv
 from datetime import datetime
-import json
+import contextvars
+import threading
+import logging
+from functools import lru_cache
+import math
+import time
 import os
 
+from agent_common.intent_router import IntentRouter, Route
+from agent_common.model_cascade import ModelCascade, FAST, STRONG
+from llm_scheduler import LLMScheduler, SchedulerSaturated, current_user
+from agent_common.agent_loop import TurnBudget, PARTIAL_ANSWER, current_budget
+from agent_common.client_pool import TenantClientPool, RateLimitExceeded, current_tenant_token, tenant_key
+from agent_common.task_digest import DigestScheduler
+from agent_common.job_queue import JobQueue, describe_finished_jobs
+from agent_common import fast_json
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 api_token = os.getenv('COHERE_API_KEY')
-client = cohere.Client(api_token)
 
+# Caps concurrent Cohere calls and queues the rest fairly across users
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '4')),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', '64')),
+    max_queue_per_user=int(os.getenv('LLM_MAX_QUEUE_PER_USER', '8')),
+    max_wait_seconds=float(os.getenv('LLM_MAX_WAIT_SECONDS', '30')),
+    batch_aging_seconds=float(os.getenv('LLM_BATCH_AGING_SECONDS', '10')),
+)
+
+# A user's Asana client and task digest are prefetched while their first LLM call runs
+workspace_prefetch = os.getenv('WORKSPACE_PREFETCH', '1') == '1'
+
+# Writes can be queued in a local SQLite database and run by background workers, with retries
+job_queue_enabled = os.getenv('JOB_QUEUE', '0') == '1'
+
+# Every turn is bounded by a wall-clock deadline and a number of AI steps
+turn_deadline_seconds = float(os.getenv('AGENT_TURN_DEADLINE_SECONDS', '60'))
+max_agent_steps = int(os.getenv('AGENT_MAX_STEPS', '6'))
+
+# Simple turns go to the fast model first, hard or failed ones to the strong model
+model_cascade = ModelCascade(
+    os.getenv('COHERE_FAST_MODEL') or 'command-r7b-12-2024',
+    os.getenv('COHERE_STRONG_MODEL') or 'command-r-08-2024',
+    enabled=os.getenv('MODEL_CASCADE', '0') == '1',
+)
+
+# The Cohere and Asana SDKs are slow to import, so the clients are built on first use
+@lru_cache(maxsize=None)
+def get_client():
+    import cohere
+
+    return cohere.Client(api_token)
+
+
+def chat(shed=True, queue_timeout=None, **kwargs):
+    # Every Cohere chat call waits for a slot from the scheduler. Calls made after a tool
+    # ran are never shed, they wait for up to queue_timeout seconds
+    with llm_scheduler.slot(shed=shed, timeout=queue_timeout):
+        return get_client().chat(**kwargs)
+
+
+def create_tasks_api(access_token, rate_limiter):
+    import asana
+
+    # Each tenant's ApiClient keeps its own pool of keep-alive connections
+    configuration = asana.Configuration()
+    configuration.access_token = access_token
+    api_client = asana.ApiClient(configuration)
+
+    return asana.TasksApi(api_client)
+
+
+def close_tasks_api(tasks_api):
+    # The asana SDK's ApiClient has no close() (it only closes its thread pool when it is
+    # collected), so release its keep-alive connections from the urllib3 pool manager
+    api_client = tasks_api.api_client
+    close = getattr(api_client, "close", None)
+    if close is not None:
+        close()
+    else:
+        api_client.rest_client.pool_manager.clear()
+
+
+# One Asana client per user access token, with its own connections, rate limit and caches
+asana_client_pool = TenantClientPool(
+    create_tasks_api,
+    close=close_tasks_api,
+    max_tenants=int(os.getenv('TENANT_POOL_SIZE', '1000')),
+    idle_seconds=float(os.getenv('TENANT_IDLE_SECONDS', '900')),
+    rate=float(os.getenv('TENANT_RATE_LIMIT', '5')),
+    burst=int(os.getenv('TENANT_RATE_BURST', '10')),
+)
+
+
+def get_tenant():
+    # The user's own access token when the request carried one, the token from the environment otherwise
+    return asana_client_pool.get(current_tenant_token.get() or os.getenv('ASANA_ACCESS_TOKEN', ''))
 
-configuration = asana.Configuration()
-configuration.access_token = os.getenv('ASANA_ACCESS_TOKEN', '')
-api_client = asana.ApiClient(configuration)
 
-tasks_api_instance = asana.TasksApi(api_client)
+def get_tasks_api():
+    return get_tenant().client
+
+asana_project_id = os.getenv("ASANA_PROJECT_ID", "")
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Task Digests ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def fetch_open_tasks(tenant):
+    # Runs in the digest thread too, so it uses the tenant's client rather than the current one
+    tenant.rate_limiter.acquire(30)
+    tasks = tenant.client.get_tasks_for_project(
+        asana_project_id,
+        {"opt_fields": "name,due_on,completed", "completed_since": "now"},
+    )
+    return [
+        {"id": task["gid"], "content": task["name"], "due_date": task.get("due_on"), "project_id": asana_project_id}
+        for task in tasks
+        if not task.get("completed")
+    ]
+
+# Due today, overdue and upcoming tasks per user, rebuilt in the background
+task_digests = DigestScheduler(
+    asana_client_pool,
+    fetch_open_tasks,
+    interval_seconds=float(os.getenv('DIGEST_REFRESH_SECONDS', '300')),
+    horizon_days=int(os.getenv('DIGEST_HORIZON_DAYS', '7')),
+)
+
+def get_task_digest():
+    """
+    Returns the digest of the current user's open Asana tasks: due today, overdue,
+    upcoming and the counts per project.
+    """
+    return task_digests.get(get_tenant())
+
+def write_asana_task(task_name, due_on, request_timeout=30):
+    # The Asana call itself, run inline by create_asana_task or by a job queue worker
+    task_body = {
+        "data": {
+            "name": task_name,
+            "due_on": due_on,
+            "projects": [asana_project_id]
+        }
+    }
+    tenant = get_tenant()
+    tenant.rate_limiter.acquire(request_timeout)
+    api_response = tenant.client.create_task(task_body, {}, _request_timeout=request_timeout)
+    task_digests.invalidate(tenant)
+    return api_response
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ Background Writes ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# With JOB_QUEUE=1, create_asana_task enqueues the Asana call and answers with the job's
+# ID straight away. Jobs run with the requesting user's token, can be polled at /jobs/{id},
+# and are reported to the AI in the user's next turn. Creating a task is not idempotent,
+# so it is only retried when the request provably never reached Asana.
+job_queue = JobQueue(
+    os.getenv('JOB_QUEUE_PATH', './jobs.sqlite3'),
+    {"create_asana_task": write_asana_task},
+    workers=int(os.getenv('JOB_QUEUE_WORKERS', '2')),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+    retry_seconds=float(os.getenv('JOB_RETRY_SECONDS', '2')),
+) if job_queue_enabled else None
+
+def job_owner():
+    # A user ID can be shared by several tokens ("anonymous"), so jobs are reported per user and token
+    return f"{current_user.get()}:{tenant_key(current_tenant_token.get() or '')}"
+
+def take_job_report():
+    """Returns a note on the current user's jobs that finished since their last turn, or None."""
+    if job_queue is None:
+        return None
+    finished_jobs = job_queue.take_finished(job_owner())
+    return describe_finished_jobs(finished_jobs) if finished_jobs else None
+
+def get_job(job_id):
+    """
+    Returns the job if it belongs to the current user: it was enqueued with the same Asana
+    token, or by the same user ID with the same (or the server's) token. Other users' jobs
+    are reported as missing.
+    """
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None:
+        return None
+    token = current_tenant_token.get()
+    if not ((token and job["tenant"] == tenant_key(token)) or job["owner"] == job_owner()):
+        return None
+    return {key: value for key, value in job.items() if key not in ("owner", "tenant")}
 
 def create_asana_task(task_name, due_on="today"):
     """
@@ -29,25 +202,36 @@ def create_asana_task(task_name, due_on="today"):
         task_name (str): The name of the task in Asana
         due_on (str): The date the task is due in the format YYYY-MM-DD. If not given, the current day is used
     Returns:
-        str: The API response of adding the task to Asana or an error message if the API call threw an error
+        str: The API response of adding the task to Asana, the ID of the job that will add it
+            when the job queue is on, or an error message if the API call threw an error
     """
     if due_on == "today":
         due_on = str(datetime.now().date())
 
-    task_body = {
-        "data": {
-            "name": task_name,
-            "due_on": due_on,
-            "projects": [os.getenv("ASANA_PROJECT_ID", "")]
-        }
-    }
+    if job_queue is not None:
+        job_id = job_queue.enqueue(
+            "create_asana_task",
+            {"task_name": task_name, "due_on": due_on},
+            f"Create Asana task '{task_name}' due {due_on}",
+            owner=job_owner(),
+        )
+        return f"Queued as job {job_id}: the task '{task_name}' will be created in Asana in the background (status at /jobs/{job_id})."
+
+    from asana.rest import ApiException
+
+    # Don't let the Asana call outlive the agent turn that made it
+    budget = current_budget.get()
+    if budget is not None and budget.expired():
+        return "Exception when calling TasksApi->create_task: the agent turn ran out of time"
+    request_timeout = budget.timeout(30) if budget is not None else 30
 
     try:
-        api_response = tasks_api_instance.create_task(task_body, {})
-        return json.dumps(api_response, indent=2)
-    except ApiException as e:
+        return fast_json.dumps_str(write_asana_task(task_name, due_on, request_timeout))
+    except (ApiException, RateLimitExceeded) as e:
         return f"Exception when calling TasksApi->create_task: {e}"
 
+# The tool schemas never change, so they are built once and shared by every call
+@lru_cache(maxsize=None)
 def get_tools():
     tools = [
         {
@@ -71,21 +255,116 @@ def get_tools():
     return tools
 
 
-def prompt_ai(messages):
+@lru_cache(maxsize=None)
+def get_tool_parameters():
+    # Required parameters of each tool, used to spot malformed tool calls from the fast model
+    return {
+        tool["name"]: {name for name, definition in tool["parameter_definitions"].items() if definition["required"]}
+        for tool in get_tools()
+    }
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Workspace Prefetch ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def prefetch_workspace():
+    # Builds the user's Asana client (importing the SDK on the first one) and their task digest
+    tenant = get_tenant()
+    if tenant.cache.get("prefetched"):
+        return
+    tenant.cache["prefetched"] = True
+    try:
+        task_digests.get(tenant)
+    except Exception as e:
+        # The tools fetch what they need themselves
+        logger.warning("Workspace prefetch failed", exc_info=True)
+        tenant.cache["prefetch_error"] = str(e)
+
+def start_workspace_prefetch():
     """
-    Function to send a chat request to Cohere and return the generated response
+    Starts prefetching a user's workspace in the background, the first time they are
+    seen, so it runs while the LLM call that might need it is in flight.
+    """
+    token = current_tenant_token.get() or os.getenv('ASANA_ACCESS_TOKEN', '')
+    tenant = asana_client_pool.peek(token)
+    if tenant is not None and tenant.cache.get("prefetched"):
+        return
+    # Runs in the request's context, so the prefetch is for the request's own token
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(prefetch_workspace,), name="workspace-prefetch", daemon=True).start()
+
+
+# ~~~~~~~~~~~~~~~~~~~~ Fast Path for Common Requests ~~~~~~~~~~~~~~~~~~~~~
+
+def answer_task_digest(view):
+    try:
+        digest = get_task_digest()
+    except Exception:
+        # Let the AI explain API errors
+        return None
+    view = view.lower()
+    if view == "overdue":
+        tasks, label = digest["overdue"], "overdue"
+    elif view == "today":
+        tasks, label = digest["due_today"], "due today"
+    else:
+        tasks, label = digest["due_today"] + digest["upcoming"], "due this week"
+    if not tasks:
+        return f"You have no tasks {label}."
+    lines = "\n".join(f"- {task['content']} (due {task['due_date']})" for task in tasks)
+    return f"You have {len(tasks)} task(s) {label}:\n{lines}"
+
+# Only reads are routed: a write parsed wrong by a pattern would be applied without the
+# AI ever seeing it, so creating tasks is always left to the AI
+intent_router = IntentRouter([
+    Route(
+        "get_task_digest",
+        answer_task_digest,
+        patterns=[
+            r"(?:what(?:'s| is)?|which|what are|show(?: me)?|list|any)(?: my| the)?(?: tasks?)?(?: that are| are| is)? (?P<view>overdue)(?: tasks?)?",
+            r"(?:what(?:'s| is)?|which|what are|show(?: me)?|list|any)(?: my| the)?(?: tasks?)?(?: that are| are| is)? due (?P<view>today|this week)",
+        ],
+    ),
+])
+
+
+available_functions = {
+    "create_asana_task": create_asana_task
+}
+
+def new_turn_budget():
+    return TurnBudget(turn_deadline_seconds, max_agent_steps)
+
+def prompt_ai(messages, budget=None):
+    """
+    Function to send a chat request to Cohere and return the generated response.
+    Tools are called for as many rounds as the AI asks for, within the turn's deadline
+    and step budget; when those run out, a partial answer is returned.
     Args:
         messages (list): List of dictionaries containing role and message content
+        budget (TurnBudget): The turn's budget, for callers that may cancel the turn
+            (e.g. when the client disconnects). A new one is used by default.
     Returns:
         str: The generated response from Cohere
     """
+    # Writes queued in earlier turns are reported before anything else
+    job_report = take_job_report()
+
+    # Formulaic requests are answered straight from the tools, the rest goes to the AI
+    routed_response = intent_router.route(messages[-1].get("content") or "")
+    if routed_response is not None:
+        return f"{job_report}\n\n{routed_response}" if job_report else routed_response
+
+    if workspace_prefetch:
+        start_workspace_prefetch()
+
+    start = time.perf_counter()
     chat_history = [
         {
             "role": "System",
             "message": f"You are a personal assistant who helps manage tasks in Asana. The current date is: {datetime.now().date()}"
         }
     ]
-    for message in messages:
+    for message in messages[:-1]:
         if message.get("role") not in ["user", "assistant"]:
             continue
         role_mapping = {
@@ -97,48 +376,88 @@ def prompt_ai(messages):
             "role": role_mapping.get(message.get("role")),
             "message": message.get("content")
         })
+    if job_report:
+        chat_history.append({"role": "System", "message": job_report})
 
-    model = 'command-r-08-2024'
     temperature = 0.3
+    user_message = messages[-1].get("content") or ""
+    budget = budget or new_turn_budget()
+    current_budget.set(budget)
+    response = None
+    tool_results = None
     try:
-        response = client.chat(
-            model=model,
-            message=messages[-1].get("content"),
-            temperature=temperature,
-            chat_history=chat_history,
-            prompt_truncation='AUTO',
-            tools=get_tools()
-        )
-
-        response_message = response.text
-        if hasattr(response, 'tools') or hasattr(response, 'tool_calls'):
-            tool_calls = getattr(response, 'tools', getattr(response, 'tool_calls', None))
-            if tool_calls:
-                available_functions = {
-                    "create_asana_task": create_asana_task
-                }
-                messages.append(response_message)
-                for tool_call in tool_calls:
-                    function_name = tool_call.name
-                    function_to_call = available_functions[function_name]
-                    function_args = tool_call.parameters
-                    function_response = function_to_call(**function_args)
-                    messages.append({
-                        "role": "tool",
-                        "name": function_name,
-                        "content": function_response
-                    })
-                second_response = client.chat(
-                    model=model,
-                    message=messages[-1].get("content"),
+        while budget.take_step():
+            tier = model_cascade.initial_tier(user_message, budget.steps - 1)
+            while True:
+                call_start = time.perf_counter()
+                step_response = chat(
+                    model=model_cascade.model(tier),
+                    # Follow-up steps send the tool results instead of a new message
+                    message="" if tool_results else user_message,
                     temperature=temperature,
-                    chat_history=chat_history
+                    chat_history=chat_history,
+                    prompt_truncation='AUTO',
+                    tools=get_tools(),
+                    tool_results=tool_results,
+                    force_single_step=False,
+                    request_options={"timeout_in_seconds": math.ceil(budget.timeout(300))},
+                    shed=tool_results is None,
+                    queue_timeout=budget.remaining(),
                 )
-                return second_response.text
-        return response.text
+                tool_calls = getattr(step_response, 'tools', getattr(step_response, 'tool_calls', None)) or []
+
+                reason = None
+                if tier == FAST:
+                    reason = model_cascade.escalation_reason(
+                        step_response.text or "",
+                        [(tool_call.name, tool_call.parameters) for tool_call in tool_calls],
+                        get_tool_parameters(),
+                    )
+                model_cascade.record(tier, time.perf_counter() - call_start, reason)
+                if reason is None:
+                    break
+                if budget.expired():
+                    # No time left to escalate, and the fast answer's tool calls aren't safe to run
+                    step_response = None
+                    break
+                tier = STRONG
+            if step_response is None:
+                break
+
+            response = step_response
+            if not tool_calls:
+                intent_router.record_llm_latency(time.perf_counter() - start)
+                return response.text
+
+            # Call the tools and hand their results to the next step.
+            # Calls left once the turn is out of time are answered as cancelled.
+            chat_history = response.chat_history
+            tool_results = []
+            for tool_call in tool_calls:
+                if budget.expired():
+                    function_response = "Cancelled: the turn ran out of time before this tool was called."
+                else:
+                    function_to_call = available_functions[tool_call.name]
+                    function_response = function_to_call(**tool_call.parameters)
+                tool_results.append({
+                    "call": tool_call,
+                    "outputs": [{"result": function_response}]
+                })
+
+        # Out of time or steps: answer with what we have instead of hanging the worker
+        partial_text = response.text if response is not None and response.text else ""
+        return f"{partial_text}\n\n{PARTIAL_ANSWER}".strip()
+    except SchedulerSaturated:
+        if tool_results is None:
+            raise
+        # The turn's tools already ran but it ran out of time in the queue: report what we have
+        partial_text = response.text if response is not None and response.text else ""
+        return f"{partial_text}\n\n{PARTIAL_ANSWER}".strip()
     except Exception as e:
         print(f"Cohere API Error: {e}")
         return None 
+    finally:
+        current_budget.set(None)
 
 def main():
   messages = [
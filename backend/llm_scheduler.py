@@ -0,0 +1,231 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ LLM Call Scheduler ~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Every Cohere call goes through the scheduler, which caps how many run at once.
+# Waiting calls are queued per priority class (interactive before batch) and,
+# within a class, served round-robin across users so one busy user cannot starve
+# the others. When the queue is full or the expected wait is too long, calls are
+# rejected straight away with a retry estimate instead of piling up.
+#
+# Only a turn's first calls may be rejected. Once one of its tools has run, the
+# turn has changed something for the user and must be able to report it, so its
+# later calls wait in the queue, however long it is, for as long as the turn allows.
+# Batch calls that have waited longer than batch_aging_seconds are served before
+# interactive ones, so a steady interactive load cannot starve a batch.
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Who the current request is for, set by the API before calling the agent
+current_user = contextvars.ContextVar("current_user", default="anonymous")
+current_priority = contextvars.ContextVar("current_priority", default=INTERACTIVE)
+
+
+class SchedulerSaturated(Exception):
+    """
+    Raised when a call is rejected. `status_code` is 429 when the user has too many
+    calls queued, 503 when the service as a whole is saturated.
+    """
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, user_id, priority):
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        self.event = threading.Event()
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=4, max_queue=64, max_queue_per_user=8, max_wait_seconds=30.0,
+                 batch_aging_seconds=10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self.batch_aging_seconds = batch_aging_seconds
+        self.active = 0
+        self.rejected = {429: 0, 503: 0}
+        self.completed = 0
+        self.aged_batch_grants = 0
+        # Moving averages used for the queue time estimates and the metrics
+        self.average_service_seconds = 1.0
+        self.average_wait_seconds = 0.0
+        self.max_observed_wait_seconds = 0.0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Admission ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _queued_ahead(self, priority):
+        ahead = 0
+        for other in PRIORITIES:
+            ahead += sum(len(waiters) for waiters in self._queues[other].values())
+            if other == priority:
+                break
+        return ahead
+
+    def _estimated_wait(self, priority):
+        if self.active < self.max_concurrency and self._queued == 0:
+            return 0.0
+        return (self._queued_ahead(priority) + 1) * self.average_service_seconds / self.max_concurrency
+
+    def _check_admission(self, user_id, priority):
+        user_queued = sum(
+            len(self._queues[other].get(user_id, ())) for other in PRIORITIES
+        )
+        estimated_wait = self._estimated_wait(priority)
+        if user_queued >= self.max_queue_per_user:
+            self.rejected[429] += 1
+            raise SchedulerSaturated(
+                f"Too many requests queued for this user. Estimated queue time: {estimated_wait:.1f}s.",
+                429,
+                estimated_wait,
+            )
+        if self._queued >= self.max_queue or estimated_wait > self.max_wait_seconds:
+            self.rejected[503] += 1
+            raise SchedulerSaturated(
+                f"The assistant is busy. Estimated queue time: {estimated_wait:.1f}s.",
+                503,
+                estimated_wait,
+            )
+
+    def check_admission(self, user_id, priority=INTERACTIVE):
+        """
+        Raises SchedulerSaturated if a call for this user would be rejected right now.
+        Lets the API fail fast before doing any other work for the request.
+        """
+        with self._lock:
+            self._check_admission(user_id, priority)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Scheduling ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _next_priority(self):
+        batch = self._queues[BATCH]
+        if batch and self._queues[INTERACTIVE]:
+            # Aging: the longest waiting batch call goes first once it has waited long enough
+            oldest = min(waiters[0].enqueued_at for waiters in batch.values())
+            if time.perf_counter() - oldest >= self.batch_aging_seconds:
+                self.aged_batch_grants += 1
+                return BATCH
+        return next(priority for priority in PRIORITIES if self._queues[priority])
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self._queued:
+            queue = self._queues[self._next_priority()]
+            # Round-robin: serve the user at the head, then move them to the back
+            user_id, waiters = next(iter(queue.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                queue.move_to_end(user_id)
+            else:
+                del queue[user_id]
+            self._queued -= 1
+            self._grant(waiter)
+
+    def _grant(self, waiter):
+        self.active += 1
+        waiter.granted = True
+        wait = time.perf_counter() - waiter.enqueued_at
+        self.average_wait_seconds = 0.9 * self.average_wait_seconds + 0.1 * wait
+        self.max_observed_wait_seconds = max(self.max_observed_wait_seconds, wait)
+        waiter.event.set()
+
+    def acquire(self, user_id, priority=INTERACTIVE, shed=True, timeout=None):
+        """
+        Blocks until the call may run. Raises SchedulerSaturated if it is rejected on
+        admission or has not started within max_wait_seconds.
+
+        Args:
+            shed (bool): False for calls that must not be rejected (those made after a tool
+                ran in the turn). They skip admission and wait for up to `timeout` seconds
+                (no limit when None) before SchedulerSaturated is raised.
+        """
+        waiter = _Waiter(user_id, priority)
+        with self._lock:
+            if self.active < self.max_concurrency and self._queued == 0:
+                self._grant(waiter)
+                return
+            if shed:
+                self._check_admission(user_id, priority)
+            self._queues[priority].setdefault(user_id, deque()).append(waiter)
+            self._queued += 1
+
+        if waiter.event.wait(self.max_wait_seconds if shed else timeout):
+            return
+
+        with self._lock:
+            if waiter.granted:
+                return
+            waiters = self._queues[priority].get(user_id)
+            waiters.remove(waiter)
+            if not waiters:
+                del self._queues[priority][user_id]
+            self._queued -= 1
+            self.rejected[503] += 1
+            estimated_wait = self._estimated_wait(priority)
+        raise SchedulerSaturated(
+            f"Timed out waiting for the assistant. Estimated queue time: {estimated_wait:.1f}s.",
+            503,
+            estimated_wait,
+        )
+
+    def release(self, service_seconds):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            self.average_service_seconds = 0.9 * self.average_service_seconds + 0.1 * service_seconds
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, user_id=None, priority=None, shed=True, timeout=None):
+        """
+        Runs the body as one scheduled LLM call. Defaults to the user and priority of
+        the current request. See acquire for `shed` and `timeout`.
+
+        Example call:
+
+        with llm_scheduler.slot():
+            response = client.chat(...)
+        """
+        self.acquire(user_id or current_user.get(), priority or current_priority.get(), shed, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Active calls, queue depth per priority, wait/service times and rejections.
+        """
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": {
+                    priority: sum(len(waiters) for waiters in self._queues[priority].values())
+                    for priority in PRIORITIES
+                },
+                "queued_users": len({user for queue in self._queues.values() for user in queue}),
+                "completed": self.completed,
+                "rejected": dict(self.rejected),
+                "aged_batch_grants": self.aged_batch_grants,
+                "average_wait_seconds": round(self.average_wait_seconds, 3),
+                "max_wait_seconds": round(self.max_observed_wait_seconds, 3),
+                "average_service_seconds": round(self.average_service_seconds, 3),
+            }
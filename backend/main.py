@@ -1,11 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, ValidationError
+from contextlib import asynccontextmanager
+from typing import Optional
+import threading
+import asyncio
 import uvicorn
-from agent_cohere import prompt_ai
+import hmac
+import math
+import time
+import os
+from agent_cohere import prompt_ai, new_turn_budget, get_client, get_tasks_api, get_task_digest, get_job, intent_router, model_cascade, llm_scheduler, asana_client_pool, task_digests, job_queue
+from llm_scheduler import SchedulerSaturated, INTERACTIVE, BATCH, current_user, current_priority
+from agent_common.client_pool import current_tenant_token
+from agent_common import fast_json
 
-app = FastAPI()
+class FastJSONResponse(JSONResponse):
+    # Compact JSON from the fast serializer instead of the standard library's
+    def render(self, content):
+        return fast_json.dumps(content)
+
+def warm_up_clients():
+    get_client()
+    get_tasks_api()
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Optionally builds the Cohere and Asana clients in the background at startup so the
+    first /chat request does not pay for importing the SDKs. Enabled with WARMUP_CLIENTS=1.
+    """
+    if os.getenv("WARMUP_CLIENTS", "0") == "1":
+        threading.Thread(target=warm_up_clients, name="client-warmup", daemon=True).start()
+    yield
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+
+# Upper bounds for /chat/batch, whatever the request asks for
+batch_max_conversations = int(os.getenv("BATCH_MAX_CONVERSATIONS", "100"))
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# How often a running turn checks whether its client is still connected
+disconnect_poll_seconds = 0.5
+# Admin token for /metrics, which is disabled when none is set
+metrics_token = os.getenv("METRICS_TOKEN", "")
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +60,12 @@ class Message(BaseModel):
 
 class RequestBody(BaseModel):
     messages: list[Message]
+    user_id: str = "anonymous"
+
+class BatchRequestBody(BaseModel):
+    conversations: list[RequestBody]
+    max_concurrency: int = 4
+    user_id: str = "anonymous"
     
 def process_messages(messages):
     processed_messages = []
@@ -32,21 +77,170 @@ def process_messages(messages):
         processed_messages.append(processed_message)
     return processed_messages
 
+def run_prompt(messages, user_id, priority, asana_token=None, budget=None):
+    # Runs in the thread pool, so the scheduler and tenant context is set on the worker thread
+    current_user.set(user_id)
+    current_priority.set(priority)
+    current_tenant_token.set(asana_token)
+    return prompt_ai(messages, budget)
+
+async def cancel_on_disconnect(request, budgets):
+    # Runs next to the turns and cancels them once the client has gone, so they stop
+    # calling the AI and Asana for a response nobody will read
+    while not await request.is_disconnected():
+        await asyncio.sleep(disconnect_poll_seconds)
+    for budget in budgets:
+        budget.cancel()
+
+def saturated_error(error):
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+    )
+
 @app.post("/chat")
-async def chat(body: RequestBody):
+async def chat(body: RequestBody, request: Request, x_asana_token: Optional[str] = Header(default=None)):
     """
     Endpoint to interact with the AI agent.
     Accepts a list of messages in the format required by the AI model.
+    Tasks are created with the user's own Asana access token when it is sent in the
+    X-Asana-Token header, and with the server's token otherwise.
+    The turn is cancelled if the client disconnects before it is answered.
     """
     try:
+        # Fail fast with 429/503 when the LLM scheduler is saturated
+        llm_scheduler.check_admission(body.user_id, INTERACTIVE)
         messages = body.messages
         processed_messages = process_messages(messages)
-        response = prompt_ai(processed_messages)
-        return JSONResponse({"message": response})
+        budget = new_turn_budget()
+        watcher = asyncio.create_task(cancel_on_disconnect(request, [budget]))
+        try:
+            response = await run_in_threadpool(run_prompt, processed_messages, body.user_id, INTERACTIVE, x_asana_token, budget)
+        finally:
+            watcher.cancel()
+        return FastJSONResponse({"message": response})
+    except SchedulerSaturated as se:
+        raise saturated_error(se)
     except ValidationError as ve:
         raise HTTPException(status_code=422, detail=ve.errors())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
+@app.post("/chat/batch")
+async def chat_batch(body: BatchRequestBody, request: Request, x_asana_token: Optional[str] = Header(default=None)):
+    """
+    Endpoint to run many independent conversations in one request.
+    Conversations run concurrently (up to max_concurrency at a time) and share the
+    same Cohere/Asana clients. Each result carries its own message or error and timing,
+    in the same order as the conversations were sent. All of them are cancelled if the
+    client disconnects.
+    """
+    if len(body.conversations) > batch_max_conversations:
+        raise HTTPException(
+            status_code=422,
+            detail=f"A batch can hold at most {batch_max_conversations} conversations."
+        )
+
+    try:
+        llm_scheduler.check_admission(body.user_id, BATCH)
+    except SchedulerSaturated as se:
+        raise saturated_error(se)
+
+    semaphore = asyncio.Semaphore(max(1, min(body.max_concurrency, batch_max_concurrency)))
+    budgets = []
+
+    async def run_conversation(index, conversation):
+        async with semaphore:
+            start = time.perf_counter()
+            result = {"index": index, "message": None, "error": None}
+            try:
+                # Batch conversations run at batch priority under the batch's user
+                budget = new_turn_budget()
+                budgets.append(budget)
+                if watcher.done():
+                    # The client left while this conversation waited for its turn
+                    budget.cancel()
+                response = await run_in_threadpool(
+                    run_prompt, process_messages(conversation.messages), body.user_id, BATCH, x_asana_token, budget
+                )
+                if response is None:
+                    result["error"] = "The AI agent did not return a response."
+                result["message"] = response
+            except Exception as e:
+                result["error"] = f"Internal Server Error: {str(e)}"
+            result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            return result
+
+    start = time.perf_counter()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, budgets))
+    try:
+        results = await asyncio.gather(
+            *(run_conversation(index, conversation) for index, conversation in enumerate(body.conversations))
+        )
+    finally:
+        watcher.cancel()
+    return FastJSONResponse({
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
+
+def run_get_digest(asana_token=None):
+    current_tenant_token.set(asana_token)
+    return get_task_digest()
+
+@app.get("/digest")
+async def digest(x_asana_token: Optional[str] = Header(default=None)):
+    """
+    Endpoint returning the user's task digest: tasks due today, overdue and in the next
+    7 days, and the open task counts per project. Digests are kept up to date in the
+    background, so this does not call Asana unless it is the user's first request.
+    """
+    try:
+        return FastJSONResponse(await run_in_threadpool(run_get_digest, x_asana_token))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+def run_get_job(job_id, user_id, asana_token=None):
+    current_user.set(user_id)
+    current_tenant_token.set(asana_token)
+    return get_job(job_id)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, user_id: str = "anonymous", x_asana_token: Optional[str] = Header(default=None)):
+    """
+    Endpoint returning the status of a queued write (queued, running, succeeded or failed),
+    its attempts and its result or last error. Only available with JOB_QUEUE=1.
+    Jobs are only returned to the user who queued them: the request must carry the same
+    X-Asana-Token header, or the same user_id when the job used the server's token.
+    """
+    job = await run_in_threadpool(run_get_job, job_id, user_id, x_asana_token)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return FastJSONResponse(job)
+
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(default=None)):
+    """
+    Endpoint exposing the agent's runtime metrics, such as the fast path routing hit rate,
+    the model cascade's escalation rate and per-tier latency, and the LLM scheduler's
+    queue depth and wait times.
+    Requires the METRICS_TOKEN admin token in an "Authorization: Bearer <token>" header,
+    and is disabled when METRICS_TOKEN is not set.
+    """
+    if not metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), metrics_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin token.", headers={"WWW-Authenticate": "Bearer"})
+    return FastJSONResponse({
+        "intent_router": intent_router.stats(),
+        "model_cascade": model_cascade.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "tenant_pool": asana_client_pool.stats(),
+        "task_digests": task_digests.stats(),
+        "job_queue": job_queue.stats() if job_queue is not None else None,
+    })
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
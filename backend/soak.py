@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from array import array
+import statistics
+import tracemalloc
+import argparse
+import time
+import sys
+import os
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Soak Test ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Drives thousands of scripted agent turns through `agent_cohere.prompt_ai`, with
+# the Cohere and Asana clients replaced by local stubs, and watches for the slow
+# growth that only shows up in long-running processes: resident memory, the
+# allocations still alive according to tracemalloc, and latency drift. Exits
+# non-zero when growth per turn is over the thresholds.
+#
+# Example calls:
+#
+#   python soak.py                                  # 5000 turns, default thresholds
+#   python soak.py --turns 20000 --concurrency 8    # longer, with concurrent users
+#   python soak.py --llm-latency-ms 20 --tenants 50 # slower stub, more Asana tenants
+
+# The scripted user messages, cycled through by every simulated user. The first is
+# answered by the fast path, the second and third by the AI with a tool call, the
+# last by the AI alone.
+SCRIPT = [
+    "Which tasks are overdue?",
+    "Add the notes from today's standup to Asana as a task and remind me about it",
+    "Please put 'Send the invoice to Acme' in Asana for 2030-01-31, then tell me what else I should do",
+    "What's a good way to prioritise my week?",
+]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Stubs ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class StubCohereClient:
+    """
+    Answers like the Cohere chat API: a tool call for messages that mention Asana,
+    then a final answer once the tool results come back.
+    """
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+
+    def chat(self, message, chat_history, tool_results=None, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        history = chat_history + [{"role": "User", "message": message}]
+        if tool_results:
+            return SimpleNamespace(text="Done, the task is in Asana.", tool_calls=None, chat_history=history)
+        if "asana" in message.lower():
+            tool_call = SimpleNamespace(name="create_asana_task", parameters={"task_name": message[:40], "due_on": "2030-01-31"})
+            return SimpleNamespace(text="", tool_calls=[tool_call], chat_history=history)
+        return SimpleNamespace(text="Start with what is due soonest.", tool_calls=None, chat_history=history)
+
+
+class StubTasksApi:
+    def __init__(self):
+        self.created = 0
+
+    def create_task(self, body, opts, _request_timeout=None):
+        self.created += 1
+        return {"data": {"gid": str(self.created), "name": body["data"]["name"], "due_on": body["data"]["due_on"]}}
+
+    def get_tasks_for_project(self, project_gid, opts):
+        return [{"gid": str(i), "name": f"Task {i}", "due_on": "2030-01-31", "completed": False} for i in range(20)]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ Measurements ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def rss_bytes():
+    """Current resident set size of this process, or None where it can't be read."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def slope(samples):
+    """Least-squares growth per turn of (turn, value) samples."""
+    if len(samples) < 2:
+        return 0.0
+    # statistics.linear_regression would need Python 3.10
+    turns, values = zip(*samples)
+    mean_turn = statistics.fmean(turns)
+    mean_value = statistics.fmean(values)
+    spread = sum((turn - mean_turn) ** 2 for turn in turns)
+    if spread == 0:
+        return 0.0
+    return sum((turn - mean_turn) * (value - mean_value) for turn, value in samples) / spread
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Driver ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_turn(agent, conversations, user_index, turn, tenants, history):
+    """
+    Runs one turn for a simulated user, the way the API does, and keeps the user's
+    history bounded the way a client would. Returns (seconds, error).
+    """
+    from llm_scheduler import current_user
+    from agent_common.client_pool import current_tenant_token
+
+    current_user.set(f"soak-user-{user_index}")
+    current_tenant_token.set(f"soak-token-{user_index % tenants}")
+
+    messages = conversations[user_index]
+    messages.append({"role": "user", "content": SCRIPT[turn % len(SCRIPT)]})
+    sent = len(messages)
+
+    start = time.perf_counter()
+    response = agent.prompt_ai(messages)
+    seconds = time.perf_counter() - start
+
+    error = None
+    if response is None:
+        error = "no response"
+    elif len(messages) != sent:
+        # prompt_ai must never add to the caller's history
+        error = "prompt_ai modified the messages it was given"
+    messages.append({"role": "assistant", "content": response or ""})
+    del messages[:-history]
+    return seconds, error
+
+
+def soak(args):
+    import agent_cohere
+
+    # Route every Cohere and Asana call to the stubs
+    stub_client = StubCohereClient(args.llm_latency_ms / 1000)
+    agent_cohere.get_client = lambda: stub_client
+    agent_cohere.asana_client_pool.factory = lambda token, rate_limiter: StubTasksApi()
+    agent_cohere.asana_client_pool.close = None
+    # The soak measures the agent, not the per-tenant rate limits
+    agent_cohere.asana_client_pool.rate = agent_cohere.asana_client_pool.burst = 1_000_000
+
+    conversations = [[] for _ in range(args.users)]
+    errors = {}
+
+    def run_user_turns(turns):
+        return [run_turn(agent_cohere, conversations, turn % args.users, turn, args.tenants, args.history) for turn in turns]
+
+    def run_batch(first_turn, count):
+        turns = range(first_turn, first_turn + count)
+        if args.concurrency == 1:
+            return run_user_turns(turns)
+        # Each user's turns stay in order, different users run concurrently
+        turns_by_user = {}
+        for turn in turns:
+            turns_by_user.setdefault(turn % args.users, []).append(turn)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            return [result for results in pool.map(run_user_turns, turns_by_user.values()) for result in results]
+
+    def record(results, latencies):
+        for seconds, error in results:
+            latencies.append(seconds)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    # Warm-up: fill the caches, pools and lazily built objects before measuring
+    record(run_batch(0, args.warmup), [])
+
+    tracemalloc.start(args.traceback_depth)
+    baseline = tracemalloc.take_snapshot()
+    rss_samples = []
+    traced_samples = []
+    # A flat array of doubles keeps the harness's own footprint out of the growth figures
+    latencies = array("d")
+    turn = args.warmup
+    end = args.warmup + args.turns
+    print(f"Running {args.turns} turns for {args.users} users ({args.concurrency} at a time)...")
+    while turn < end:
+        count = min(args.sample_every, end - turn)
+        record(run_batch(turn, count), latencies)
+        turn += count
+        measured = turn - args.warmup
+        traced_samples.append((measured, tracemalloc.get_traced_memory()[0]))
+        rss = rss_bytes()
+        if rss is not None:
+            rss_samples.append((measured, rss))
+        if args.verbose:
+            print(f"  turn {measured}: traced {traced_samples[-1][1] / 1024:.0f} KiB, rss {(rss or 0) / 1048576:.1f} MiB")
+
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # Growth per turn, from the trend over all samples rather than the two end points
+    traced_growth = slope(traced_samples)
+    rss_growth = slope(rss_samples)
+    window = max(1, len(latencies) // 10)
+    early = statistics.median(latencies[:window])
+    late = statistics.median(latencies[-window:])
+    drift = late / early if early else 1.0
+
+    print(f"\nTraced memory growth: {traced_growth:.1f} B/turn (limit {args.max_traced_growth})")
+    if rss_samples:
+        print(f"RSS growth:           {rss_growth:.1f} B/turn (limit {args.max_rss_growth})")
+    print(f"Latency:              median {early * 1000:.3f} ms first 10% -> {late * 1000:.3f} ms last 10% (x{drift:.2f}, limit x{args.max_latency_drift})")
+    print(f"\nTop {args.top} allocators still alive since the warm-up:")
+    harness_filter = [tracemalloc.Filter(False, __file__)]
+    snapshot, baseline = snapshot.filter_traces(harness_filter), baseline.filter_traces(harness_filter)
+    for stat in snapshot.compare_to(baseline, "traceback" if args.traceback_depth > 1 else "lineno")[:args.top]:
+        print(f"  {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7d} blocks  {stat.traceback.format()[-1].strip()}")
+
+    failures = []
+    if errors:
+        failures.append(f"turn errors: {errors}")
+    if traced_growth > args.max_traced_growth:
+        failures.append(f"traced memory grows {traced_growth:.1f} B/turn")
+    if rss_samples and rss_growth > args.max_rss_growth:
+        failures.append(f"RSS grows {rss_growth:.1f} B/turn")
+    if drift > args.max_latency_drift:
+        failures.append(f"latency drifted x{drift:.2f}")
+    return failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Soak the backend agent against local stubs and check for growth.")
+    arg_parser.add_argument("--turns", type=int, default=5000)
+    arg_parser.add_argument("--warmup", type=int, default=200)
+    arg_parser.add_argument("--users", type=int, default=20)
+    arg_parser.add_argument("--tenants", type=int, default=5, help="Distinct Asana tokens the users are spread over")
+    arg_parser.add_argument("--concurrency", type=int, default=1)
+    arg_parser.add_argument("--history", type=int, default=20, help="Messages each simulated client keeps")
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--sample-every", type=int, default=250)
+    arg_parser.add_argument("--top", type=int, default=10)
+    arg_parser.add_argument("--traceback-depth", type=int, default=1)
+    arg_parser.add_argument("--max-traced-growth", type=float, default=256.0, help="Bytes per turn")
+    arg_parser.add_argument("--max-rss-growth", type=float, default=2048.0, help="Bytes per turn")
+    arg_parser.add_argument("--max-latency-drift", type=float, default=1.5, help="Late/early median latency ratio")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    failures = soak(args)
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nPASSED")
+
+
+if __name__ == "__main__":
+    main()
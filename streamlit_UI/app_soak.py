@@ -0,0 +1,225 @@
+from types import SimpleNamespace
+import statistics
+import threading
+import argparse
+import time
+import sys
+import os
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~ Streamlit Soak Test ~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Drives hundreds of chat turns through the real Streamlit script with
+# streamlit.testing's AppTest, each one a full rerun as in the browser, with
+# Todoist and Cohere replaced by local stubs. Watches what only shows up in a
+# long-running Streamlit process: threads started per rerun (pools, schedulers,
+# queues built outside st.cache_resource), resident memory and latency drift.
+# Exits non-zero when growth is over the thresholds.
+#
+# Example calls:
+#
+#   python app_soak.py                      # 500 turns, default thresholds
+#   python app_soak.py --turns 2000 --verbose
+#   JOB_QUEUE=1 python app_soak.py          # with the background write queue
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_management_agent.py")
+
+# The scripted user messages, cycled through: the fast path, the AI with a read and a
+# write tool call, the AI alone, and the fast path from the task digest
+SCRIPT = [
+    "List my projects",
+    "What tasks are due on 2030-01-31?",
+    "Add Review soak results to Project 1 for tomorrow",
+    "What's a good way to prioritise my week?",
+    "Which tasks are overdue?",
+]
+
+# The tool the stubbed AI calls for the messages containing each phrase
+TOOL_CALLS = {
+    "due on": ("get_tasks_by_due_date", '{"due_date": "2030-01-31"}'),
+    "Add ": ("create_new_task", '{"project_name": "Project 1", "task_content": "Review soak results", "due_string": "tomorrow"}'),
+}
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Stubs ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class StubTodoistAPI:
+    def __init__(self, token, session=None):
+        self.token = token
+
+    def get_projects(self):
+        return [SimpleNamespace(id=str(i), name=f"Project {i}") for i in range(5)]
+
+    def get_tasks(self, **kwargs):
+        return [StubTask(str(i), f"Task {i}", "0") for i in range(10)]
+
+    def add_task(self, content, project_id, due_string=None):
+        return StubTask("new", content, project_id)
+
+
+class StubDue(SimpleNamespace):
+    def to_dict(self):
+        return {"date": self.date}
+
+
+class StubTask(SimpleNamespace):
+    def __init__(self, task_id, content, project_id):
+        super().__init__(
+            id=task_id, content=content, description="", project_id=project_id, priority=1,
+            url=f"https://todoist.com/showTask?id={task_id}", is_completed=False, due=StubDue(date="2030-01-31"),
+        )
+
+    def to_dict(self):
+        return {"id": self.id, "content": self.content, "project_id": self.project_id, "due": self.due.to_dict()}
+
+
+class StubChatCohere:
+    """
+    Streams like ChatCohere: a tool call for the messages in TOOL_CALLS, then a final
+    answer once the tool results come back.
+    """
+
+    def __init__(self, model=None, timeout_seconds=None, **kwargs):
+        self.tool_names = set()
+
+    def bind_tools(self, tools):
+        self.tool_names = {tool.name for tool in tools}
+        return self
+
+    def stream(self, messages):
+        from langchain_core.messages import AIMessageChunk, HumanMessage
+
+        last = messages[-1]
+        if isinstance(last, HumanMessage):
+            for phrase, (name, arguments) in TOOL_CALLS.items():
+                if phrase in last.content and name in self.tool_names:
+                    yield AIMessageChunk(content="", tool_call_chunks=[{"name": name, "args": arguments, "id": "call-1", "index": 0}])
+                    return
+        for word in "Start with what is due soonest.".split(" "):
+            yield AIMessageChunk(content=word + " ")
+
+
+def install_stubs():
+    import todoist_api_python.api
+    import langchain_cohere
+
+    todoist_api_python.api.TodoistAPI = StubTodoistAPI
+    langchain_cohere.ChatCohere = StubChatCohere
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ Measurements ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def rss_bytes():
+    """Current resident set size of this process, or None where it can't be read."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def slope(samples):
+    """Least-squares growth per turn of (turn, value) samples."""
+    if len(samples) < 2:
+        return 0.0
+    # statistics.linear_regression would need Python 3.10
+    turns, values = zip(*samples)
+    mean_turn = statistics.fmean(turns)
+    mean_value = statistics.fmean(values)
+    spread = sum((turn - mean_turn) ** 2 for turn in turns)
+    if spread == 0:
+        return 0.0
+    return sum((turn - mean_turn) * (value - mean_value) for turn, value in samples) / spread
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Driver ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def soak(args):
+    from streamlit.testing.v1 import AppTest
+
+    install_stubs()
+    app = AppTest.from_file(APP_FILE, default_timeout=args.timeout)
+    app.run()
+    errors = {}
+
+    def run_turns(first_turn, count, latencies):
+        for turn in range(first_turn, first_turn + count):
+            start = time.perf_counter()
+            app.chat_input[0].set_value(SCRIPT[turn % len(SCRIPT)]).run()
+            latencies.append(time.perf_counter() - start)
+            for exception in app.exception:
+                errors[exception.message] = errors.get(exception.message, 0) + 1
+
+    # Warm-up: build the cached resources and start their threads before measuring
+    run_turns(0, args.warmup, [])
+    baseline_threads = threading.active_count()
+    thread_samples = []
+    rss_samples = []
+    latencies = []
+    turn = args.warmup
+    end = args.warmup + args.turns
+    print(f"Running {args.turns} reruns of {os.path.basename(APP_FILE)}...")
+    while turn < end:
+        count = min(args.sample_every, end - turn)
+        run_turns(turn, count, latencies)
+        turn += count
+        measured = turn - args.warmup
+        thread_samples.append((measured, threading.active_count()))
+        rss = rss_bytes()
+        if rss is not None:
+            rss_samples.append((measured, rss))
+        if args.verbose:
+            print(f"  turn {measured}: {thread_samples[-1][1]} threads, rss {(rss or 0) / 1048576:.1f} MiB")
+
+    thread_growth = max(threads for _, threads in thread_samples) - baseline_threads
+    rss_growth = slope(rss_samples)
+    window = max(1, len(latencies) // 10)
+    early = statistics.median(latencies[:window])
+    late = statistics.median(latencies[-window:])
+    drift = late / early if early else 1.0
+
+    print(f"\nThreads:    {baseline_threads} after the warm-up, +{thread_growth} at most since (limit +{args.max_thread_growth})")
+    if rss_samples:
+        print(f"RSS growth: {rss_growth:.1f} B/turn (limit {args.max_rss_growth})")
+    print(f"Latency:    median {early * 1000:.1f} ms first 10% -> {late * 1000:.1f} ms last 10% (x{drift:.2f}, limit x{args.max_latency_drift})")
+
+    failures = []
+    if errors:
+        failures.append(f"script errors: {errors}")
+    if thread_growth > args.max_thread_growth:
+        failures.append(f"{thread_growth} threads started and still alive since the warm-up")
+    if rss_samples and rss_growth > args.max_rss_growth:
+        failures.append(f"RSS grows {rss_growth:.1f} B/turn")
+    if drift > args.max_latency_drift:
+        failures.append(f"latency drifted x{drift:.2f}")
+    return failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Soak the Streamlit app against local stubs and check for growth.")
+    arg_parser.add_argument("--turns", type=int, default=500)
+    arg_parser.add_argument("--warmup", type=int, default=40)
+    arg_parser.add_argument("--sample-every", type=int, default=50)
+    arg_parser.add_argument("--timeout", type=float, default=30.0, help="Seconds one rerun may take")
+    arg_parser.add_argument("--max-thread-growth", type=int, default=0)
+    arg_parser.add_argument("--max-rss-growth", type=float, default=16384.0, help="Bytes per turn")
+    arg_parser.add_argument("--max-latency-drift", type=float, default=1.5, help="Late/early median latency ratio")
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    # Embedding tool descriptions would load the sentence-transformers model, which the soak doesn't measure
+    os.environ.setdefault("TOOL_SELECTION_EMBEDDINGS", "0")
+    failures = soak(args)
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nPASSED")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from filelock import FileLock
+import numpy as np
+import threading
+import hashlib
+import atexit
+import time
+import os
+import re
+
+from agent_common import fast_json
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~ Embedding Cache ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Persistent cache of embedding vectors keyed by the hash of (model name, text).
+# Each model gets its own subdirectory, so models with different dimensions never
+# share a file. Vectors live in a fixed-size memory-mapped float32 array (vectors.npy)
+# and the key -> slot mapping, kept in LRU order, lives next to it in index.json.
+#
+# The loader and the agent may run at the same time on the same cache. New vectors are
+# kept in memory until a flush, which takes an inter-process lock, merges the index
+# on disk with this process's, allocates slots for the new vectors and writes both.
+# Lookups take the same lock and reload the index if another process changed it, so
+# a slot is never read after another process reused it.
+
+VECTORS_FILE = "vectors.npy"
+INDEX_FILE = "index.json"
+LOCK_FILE = "cache.lock"
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def model_directory(cache_directory, model_name):
+    return os.path.join(cache_directory, re.sub(r"[^A-Za-z0-9._-]+", "_", model_name))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding function so each distinct text is only embedded once,
+    across runs of both rag-document-loader.py and the agent.
+
+    Example call:
+
+    embedding_function = CachedEmbeddings(SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2"),
+                                          "all-MiniLM-L6-v2", "./embedding_cache")
+
+    Args:
+        max_entries (int): Capacity of a new cache. An existing cache keeps its capacity.
+        flush_entries (int): Query vectors kept in memory before they are written to disk.
+        flush_seconds (float): Longest time a query vector is kept in memory before it is written.
+    """
+
+    def __init__(self, embeddings, model_name, cache_directory, max_entries=100000,
+                 flush_entries=64, flush_seconds=30.0):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_directory = model_directory(cache_directory, model_name)
+        self.max_entries = max_entries
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._slots = OrderedDict()
+        # Vectors not yet written to disk, and keys looked up since the last flush
+        self._pending = OrderedDict()
+        self._touched = OrderedDict()
+        self._vectors = None
+        self._index_version = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(self.cache_directory, LOCK_FILE))
+        with self._lock, self._file_lock:
+            self._load()
+        atexit.register(self.flush)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~ Persistence ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _path(self, name):
+        return os.path.join(self.cache_directory, name)
+
+    def _disk_version(self):
+        try:
+            stat = os.stat(self._path(INDEX_FILE))
+        except FileNotFoundError:
+            return None
+        # os.replace gives every write a new inode, even within the timestamp resolution
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        # Called with both locks held. Reloads the index if another process wrote it.
+        version = self._disk_version()
+        if version is None or version == self._index_version or not os.path.exists(self._path(VECTORS_FILE)):
+            return
+        with open(self._path(INDEX_FILE), "rb") as index_file:
+            index = fast_json.loads(index_file.read())
+        if self._vectors is None:
+            # The capacity of an existing cache is kept, even if max_entries changed since
+            self._vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r+")
+            self.max_entries = self._vectors.shape[0]
+        self._slots = OrderedDict((key, slot) for key, slot in index["slots"])
+        self._index_version = version
+
+    def _open_vectors(self, dimensions):
+        # Called with both locks held, once no other process has created the file
+        self._vectors = np.lib.format.open_memmap(
+            self._path(VECTORS_FILE), mode="w+", dtype=np.float32, shape=(self.max_entries, dimensions)
+        )
+
+    def _allocate(self, key):
+        if key in self._slots:
+            self._slots.move_to_end(key)
+            return self._slots[key]
+        if len(self._slots) < self.max_entries:
+            # Slots are only ever reused by eviction, so the used ones are 0..len - 1
+            slot = len(self._slots)
+        else:
+            # Reuse the slot of the least recently used entry
+            _, slot = self._slots.popitem(last=False)
+            self.evictions += 1
+        self._slots[key] = slot
+        return slot
+
+    def flush(self):
+        """Merges the pending vectors into the cache on disk."""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._file_lock:
+                self._load()
+                if self._vectors is None:
+                    self._open_vectors(len(next(iter(self._pending.values()))))
+                # Entries this process used recently stay in the cache ahead of the others
+                for key in self._touched:
+                    if key in self._slots:
+                        self._slots.move_to_end(key)
+                for key, vector in self._pending.items():
+                    self._vectors[self._allocate(key)] = vector
+                self._vectors.flush()
+                with open(self._path(INDEX_FILE) + ".tmp", "wb") as index_file:
+                    index_file.write(fast_json.dumps({"slots": list(self._slots.items())}))
+                os.replace(self._path(INDEX_FILE) + ".tmp", self._path(INDEX_FILE))
+                self._index_version = self._disk_version()
+            self._pending.clear()
+            self._touched.clear()
+            self._last_flush = time.monotonic()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Lookup ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _lookup(self, keys):
+        """Returns the cached vector, or None, for each key. Called with the thread lock held."""
+        vectors = [self._pending.get(key) for key in keys]
+        if all(vector is not None for vector in vectors):
+            return vectors
+        with self._file_lock:
+            self._load()
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if vectors[i] is None and slot is not None:
+                    vectors[i] = self._vectors[slot].tolist()
+                    self._touched[key] = None
+        return vectors
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        with self._lock:
+            vectors = self._lookup(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # Repeated texts within one batch are only embedded once
+            unique = list({keys[i]: i for i in missing}.values())
+            computed = self.embeddings.embed_documents([texts[i] for i in unique])
+            computed_by_key = {keys[i]: list(vector) for i, vector in zip(unique, computed)}
+            with self._lock:
+                self._pending.update(computed_by_key)
+            for i in missing:
+                vectors[i] = computed_by_key[keys[i]]
+            self.flush()
+        return vectors
+
+    def embed_query(self, text):
+        key = cache_key(self.model_name, f"query\0{text}")
+        with self._lock:
+            vector = self._lookup([key])[0]
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = list(self.embeddings.embed_query(text))
+        with self._lock:
+            self._pending[key] = vector
+            due = len(self._pending) >= self.flush_entries or time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+        return vector
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, hit_rate, entries, capacity and evictions since startup.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._slots) + len(self._pending),
+            "capacity": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+
+def get_embedding_function(model_name="all-MiniLM-L6-v2"):
+    """
+    Builds the SentenceTransformer embedding function used for both ingestion and
+    querying, wrapped in the persistent cache unless EMBEDDING_CACHE=0.
+    """
+    from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+
+    embeddings = SentenceTransformerEmbeddings(model_name=model_name)
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        model_name,
+        os.getenv("EMBEDDING_CACHE_DIRECTORY", "./embedding_cache"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "100000")),
+    )
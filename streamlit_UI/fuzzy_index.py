@@ -0,0 +1,184 @@
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
+
+# ~~~~~~~~~~~~~~~~~~~~~ Fuzzy Lookup Index ~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Small in-memory trigram/token index used by the agent tools to resolve the
+# project names and task contents the model gives us, even when it paraphrases
+# them slightly ("buy milk" vs "Buy milk!"). Lookups only touch the postings of
+# the query's grams, so they stay well under a millisecond for a workspace.
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+_DIGIT = re.compile(r"\d")
+
+
+def normalize(text):
+    """
+    Lowercases the text and strips punctuation and repeated whitespace.
+
+    Example call:
+
+    normalize("  Buy Milk! ")  # -> "buy milk"
+    """
+    text = _NON_WORD.sub(" ", str(text).lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def grams(text):
+    """
+    Returns the set of character trigrams and whole-word tokens for the text.
+    Words are padded so that short words still produce a trigram.
+    """
+    normalized = normalize(text)
+    result = set()
+    for word in normalized.split(" "):
+        if not word:
+            continue
+        result.add(f"w:{word}")
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+def numbered_tokens(text):
+    """The words of the text that contain a digit ("2024", "q4", "2"), which tell similar names apart."""
+    return {word for word in normalize(text).split(" ") if _DIGIT.search(word)}
+
+
+class FuzzyIndex:
+    """
+    Maps keys (e.g. Todoist IDs) to their display text and answers ranked fuzzy
+    queries over that text using the Dice coefficient of their gram sets.
+
+    Example call:
+
+    index = FuzzyIndex()
+    index.add("123", "Buy Milk")
+    index.resolve("buy milk please")  # -> ("123", [(0.73, "123", "Buy Milk")])
+    """
+
+    def __init__(self, min_score=0.45, ambiguity_margin=0.1):
+        self.min_score = min_score
+        self.ambiguity_margin = ambiguity_margin
+        self._texts = {}
+        self._normalized = {}
+        self._grams = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, key):
+        return key in self._texts
+
+    def add(self, key, text):
+        """Adds a key to the index, replacing any text it was indexed under before."""
+        with self._lock:
+            self._remove(key)
+            key_grams = grams(text)
+            self._texts[key] = text
+            self._normalized[key] = normalize(text)
+            self._grams[key] = key_grams
+            for gram in key_grams:
+                self._postings[gram].add(key)
+
+    def remove(self, key):
+        """Removes a key from the index. Unknown keys are ignored."""
+        with self._lock:
+            self._remove(key)
+
+    def rebuild(self, items):
+        """Replaces the whole index with the given (key, text) pairs."""
+        # Built aside and swapped in at once, so a concurrent search never sees a partial index
+        texts, normalized, key_grams, postings = {}, {}, {}, defaultdict(set)
+        for key, text in items:
+            texts[key] = text
+            normalized[key] = normalize(text)
+            key_grams[key] = grams(text)
+            for gram in key_grams[key]:
+                postings[gram].add(key)
+        with self._lock:
+            self._texts, self._normalized, self._grams, self._postings = texts, normalized, key_grams, postings
+
+    def get(self, key):
+        return self._texts.get(key)
+
+    def _remove(self, key):
+        old_grams = self._grams.pop(key, None)
+        self._texts.pop(key, None)
+        self._normalized.pop(key, None)
+        if not old_grams:
+            return
+        for gram in old_grams:
+            keys = self._postings.get(gram)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._postings[gram]
+
+    def search(self, query, limit=5):
+        """
+        Returns up to `limit` (score, key, text) tuples ordered by descending score.
+        An exact match after normalization always scores 1.0.
+        """
+        query_grams = grams(query)
+        if not query_grams:
+            return []
+        normalized_query = normalize(query)
+
+        with self._lock:
+            overlaps = Counter()
+            for gram in query_grams:
+                overlaps.update(self._postings.get(gram, ()))
+
+            results = []
+            for key, overlap in overlaps.items():
+                if self._normalized[key] == normalized_query:
+                    score = 1.0
+                else:
+                    score = 2.0 * overlap / (len(query_grams) + len(self._grams[key]))
+                results.append((score, key, self._texts[key]))
+
+        return heapq.nsmallest(limit, results, key=lambda result: (-result[0], result[2]))
+
+    def resolve(self, query, limit=5, exact=False):
+        """
+        Resolves a query to a single key when the best match is confident enough.
+        A near match never resolves when it differs from the query in a numbered word
+        ("Work 2024" vs "Work 2023", "Groceries 2" vs "Groceries").
+
+        Example call:
+
+        index.resolve("buy milk please")              # -> ("123", [(0.73, "123", "Buy Milk")])
+        index.resolve("buy milk please", exact=True)  # -> (None, [(0.73, "123", "Buy Milk")])
+
+        Args:
+            exact (bool): Only resolve exact matches (after normalization), as the tools that
+                write or delete do; near matches are returned as candidates to confirm.
+
+        Returns:
+            tuple: (key, candidates). `key` is None when nothing matched or when the
+                match needs confirming, in which case `candidates` holds the options
+                the user should confirm.
+        """
+        candidates = [result for result in self.search(query, limit) if result[0] >= self.min_score]
+        if not candidates:
+            return None, []
+
+        best_score, best_key, best_text = candidates[0]
+        exact_matches = [result for result in candidates if result[0] == 1.0]
+        if len(exact_matches) == 1:
+            return best_key, exact_matches
+        if len(exact_matches) > 1:
+            return None, exact_matches
+        if exact or numbered_tokens(query) != numbered_tokens(best_text):
+            return None, candidates
+        if len(candidates) == 1 or best_score - candidates[1][0] >= self.ambiguity_margin:
+            return best_key, candidates[:1]
+        return None, candidates
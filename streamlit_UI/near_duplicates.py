@@ -0,0 +1,307 @@
+from collections import defaultdict
+import numpy as np
+import argparse
+import hashlib
+import re
+import os
+
+from partitioned_index import note_date
+
+# ~~~~~~~~~~~~~~~~~~~~~~~ Near-Duplicate Chunks ~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Meeting notes repeat themselves (attendee lists, agenda boilerplate, action
+# items carried over from one meeting to the next), so the same chunk is embedded
+# and returned many times over. At ingestion, chunks are MinHashed over their word
+# shingles and grouped with locality-sensitive hashing. Chunks whose estimated
+# Jaccard similarity with an earlier chunk is at least the threshold are folded
+# into one canonical chunk: the newest of them (by note date, then ingestion order),
+# so the index holds the latest wording of a carried-over item and it lands in the
+# latest partition of a partitioned index. Its metadata gets the number of chunks it
+# stands for, the sources of all of them and the date range they span.
+#
+# Chunks of the notes in meeting_notes/ are never this similar: none of the 19 is
+# folded at any threshold, and the closest two distinct chunks, which only share the
+# attendee list, score 0.34. A copy of a chunk with one line reworded is folded into
+# it 16 times out of 19 at 0.6 and 9 out of 19 at 0.8, so the default is 0.6, still
+# six standard errors of the estimate above 0.34. `python near_duplicates.py --sweep`
+# measures both on other notes.
+# At query time, maximal marginal relevance keeps near-identical chunks that were
+# indexed anyway from filling all the results.
+
+NUM_PERMUTATIONS = 128
+BANDS = 16
+SHINGLE_WORDS = 3
+
+# Shingles hash to 32 bits and the multipliers stay below 2^31, so a * x + b fits in 64 bits
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text):
+    """
+    Returns:
+        numpy.ndarray: The MinHash signature of the text's shingles, NUM_PERMUTATIONS values.
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little") for shingle in shingles(text)),
+        dtype=np.uint64,
+    )
+    if len(hashes) == 0:
+        return np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    # One universal hash (a * x + b) mod p per permutation
+    return ((hashes[:, None] * _A[None, :] + _B[None, :]) % _PRIME).min(axis=0)
+
+
+def estimated_jaccard(signature, other):
+    return float(np.mean(signature == other))
+
+
+def deduplicate(documents, threshold=0.6):
+    """
+    Folds near-duplicate chunks into the newest chunk they duplicate.
+
+    Example call:
+
+    canonical, stats = deduplicate(docs, threshold=0.6)
+
+    Args:
+        documents (list): LangChain documents, in ingestion order.
+        threshold (float): Estimated Jaccard similarity of word shingles from which two chunks count as duplicates.
+
+    Returns:
+        tuple: (canonical documents, stats). Each canonical document's metadata gets
+            `ref_count`, the number of chunks it stands for, `sources`, the sources
+            of all of them joined by "; " (vector stores only take scalar metadata),
+            and `first_date` / `last_date`, the range of their note dates, when any is dated.
+    """
+    rows_per_band = NUM_PERMUTATIONS // BANDS
+    buckets = defaultdict(list)
+    # One entry per group of duplicates: the chunk standing for them and its signature
+    canonical = []
+    signatures = []
+    groups = []
+
+    for document in documents:
+        signature = minhash(document.page_content)
+        day = note_date(document.metadata)
+        candidates = set()
+        band_keys = []
+        for band in range(BANDS):
+            key = (band, signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+            band_keys.append(key)
+            candidates.update(buckets.get(key, ()))
+
+        match = max(
+            ((estimated_jaccard(signature, signatures[index]), index) for index in candidates),
+            default=(0.0, None),
+        )
+        if match[1] is not None and match[0] >= threshold:
+            index = match[1]
+            group = groups[index]
+            group["count"] += 1
+            source = document.metadata.get("source")
+            if source and source not in group["sources"]:
+                group["sources"].append(source)
+            if day is not None:
+                group["days"].append(day)
+            # Later chunks replace earlier ones unless they come from an older note
+            newest = note_date(canonical[index].metadata)
+            if day is None or newest is None or day >= newest:
+                canonical[index] = document
+                signatures[index] = signature
+                for key in band_keys:
+                    buckets[key].append(index)
+            continue
+
+        index = len(canonical)
+        canonical.append(document)
+        signatures.append(signature)
+        groups.append({
+            "count": 1,
+            "sources": [document.metadata["source"]] if document.metadata.get("source") else [],
+            "days": [day] if day is not None else [],
+        })
+        for key in band_keys:
+            buckets[key].append(index)
+
+    for document, group in zip(canonical, groups):
+        document.metadata["ref_count"] = group["count"]
+        document.metadata["sources"] = "; ".join(group["sources"])
+        if group["days"]:
+            document.metadata["first_date"] = min(group["days"]).isoformat()
+            document.metadata["last_date"] = max(group["days"]).isoformat()
+            # Every day the content appeared on, so the partitioned index can file it under each of them
+            document.metadata["dates"] = "; ".join(sorted({day.isoformat() for day in group["days"]}))
+
+    stats = {
+        "chunks": len(documents),
+        "canonical": len(canonical),
+        "duplicates_removed": len(documents) - len(canonical),
+    }
+    return canonical, stats
+
+
+# ~~~~~~~~~~~~~~~~~~~~~ Maximal Marginal Relevance ~~~~~~~~~~~~~~~~~~~~~
+
+def maximal_marginal_relevance(query_vector, vectors, k=3, lambda_mult=0.5):
+    """
+    Picks k of the candidate vectors, trading relevance to the query against
+    similarity to the ones already picked (lambda_mult=1 is plain relevance).
+
+    Returns:
+        list: The indexes of the picked candidates, in order of selection.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    selected = [int(np.argmax(relevance))]
+    redundancy = vectors @ vectors[selected[0]]
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        choice = int(np.argmax(scores))
+        selected.append(choice)
+        redundancy = np.maximum(redundancy, vectors @ vectors[choice])
+    return selected
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Benchmark ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+BENCHMARK_QUESTIONS = [
+    "Who attended the meetings?",
+    "What are the action items?",
+    "What was decided about the Space Rangers beta?",
+    "What is the marketing budget?",
+    "When is the next stress test?",
+]
+
+
+def benchmark(directory, threshold, lambda_mult, fetch_k):
+    """
+    Builds a compact index of the notes with and without deduplication and compares
+    their size, query latency and how often the top 3 results are near-duplicates of each other.
+    """
+    from compact_index import CompactIndex, write_compact_index
+    from embedding_cache import get_embedding_function
+    import tempfile
+    import shutil
+    import time
+
+    chunks = load_chunks(directory)
+    embedding_function = get_embedding_function(model_name="all-MiniLM-L6-v2")
+    query_vectors = [embedding_function.embed_query(question) for question in BENCHMARK_QUESTIONS]
+
+    start = time.perf_counter()
+    canonical, stats = deduplicate([chunk.model_copy(deep=True) for chunk in chunks], threshold)
+    dedup_seconds = time.perf_counter() - start
+
+    def duplicate_pairs(texts):
+        signatures = [minhash(text) for text in texts]
+        return sum(
+            estimated_jaccard(signatures[i], signatures[j]) >= threshold
+            for i in range(len(signatures)) for j in range(i + 1, len(signatures))
+        )
+
+    print(f"deduplication: {stats} in {dedup_seconds * 1000:.1f} ms")
+    for label, indexed in [("before", chunks), ("after", canonical)]:
+        index_directory = tempfile.mkdtemp()
+        try:
+            write_compact_index(
+                index_directory,
+                embedding_function.embed_documents([chunk.page_content for chunk in indexed]),
+                [chunk.page_content for chunk in indexed],
+                [chunk.metadata for chunk in indexed],
+            )
+            size = sum(os.path.getsize(os.path.join(index_directory, name)) for name in os.listdir(index_directory))
+            index = CompactIndex(index_directory, embedding_function)
+
+            start = time.perf_counter()
+            results = [[row for row, _ in index.search_vector(vector, 3)] for vector in query_vectors]
+            latency = (time.perf_counter() - start) / len(query_vectors)
+            start = time.perf_counter()
+            mmr_results = [index.search_vector_mmr(vector, 3, fetch_k, lambda_mult) for vector in query_vectors]
+            mmr_latency = (time.perf_counter() - start) / len(query_vectors)
+
+            redundant = sum(duplicate_pairs([indexed[row].page_content for row in rows]) for rows in results)
+            mmr_redundant = sum(duplicate_pairs([indexed[row].page_content for row in rows]) for rows in mmr_results)
+            print(
+                f"{label:>6}: {len(indexed)} chunks, {size / 1024:.1f} KiB on disk, "
+                f"{latency * 1000:.3f} ms/query ({redundant} duplicate pairs in top 3), "
+                f"with MMR {mmr_latency * 1000:.3f} ms/query ({mmr_redundant} duplicate pairs)"
+            )
+        finally:
+            shutil.rmtree(index_directory, ignore_errors=True)
+
+
+def load_chunks(directory):
+    from langchain_text_splitters import CharacterTextSplitter
+    from document_extraction import extract_documents
+
+    documents, _ = extract_documents(directory)
+    return CharacterTextSplitter(chunk_size=1000, chunk_overlap=0).split_documents(documents)
+
+
+def sweep(directory, thresholds=(0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9)):
+    """
+    Measures, without embedding anything, how many chunks of the notes each threshold
+    folds, and how many of their copies with one line reworded (an action item carried
+    over to the next meeting) it folds into the original, to pick DEDUP_THRESHOLD from.
+    """
+    chunks = load_chunks(directory)
+    edited = []
+    for chunk in chunks:
+        lines = chunk.page_content.split("\n")
+        if len(lines) > 2:
+            lines[len(lines) // 2] = "This line was reworded when the item was carried over to the next meeting"
+            edited.append(chunk.model_copy(update={"page_content": "\n".join(lines)}, deep=True))
+
+    print(f"{len(chunks)} chunks, {len(edited)} copies with one line reworded")
+    for threshold in thresholds:
+        _, stats = deduplicate([chunk.model_copy(deep=True) for chunk in chunks], threshold)
+        _, with_copies = deduplicate([chunk.model_copy(deep=True) for chunk in chunks + edited], threshold)
+        copies_folded = with_copies["duplicates_removed"] - stats["duplicates_removed"]
+        print(
+            f"threshold {threshold:.2f}: {stats['duplicates_removed']} chunks folded "
+            f"({stats['duplicates_removed'] / max(len(chunks), 1):.0%}), "
+            f"{copies_folded} of {len(edited)} reworded copies folded"
+        )
+
+    signatures = [minhash(chunk.page_content) for chunk in chunks]
+    pairs = sorted(
+        ((estimated_jaccard(signatures[i], signatures[j]), i, j)
+         for i in range(len(chunks)) for j in range(i + 1, len(chunks))),
+        reverse=True,
+    )
+    print("closest distinct chunks:")
+    for similarity, i, j in pairs[:5]:
+        print(f"  {similarity:.2f}  {chunks[i].metadata.get('source')}  {chunks[j].metadata.get('source')}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Measure near-duplicate removal and MMR on the notes.")
+    arg_parser.add_argument("directory", nargs="?", default=os.getenv("DIRECTORY", "meeting_notes"))
+    arg_parser.add_argument("--threshold", type=float, default=float(os.getenv("DEDUP_THRESHOLD", "0.6")))
+    arg_parser.add_argument("--lambda-mult", type=float, default=float(os.getenv("RAG_MMR_LAMBDA", "0.5")))
+    arg_parser.add_argument("--fetch-k", type=int, default=int(os.getenv("RAG_MMR_FETCH_K", "20")))
+    arg_parser.add_argument("--sweep", action="store_true", help="only measure the fold rate per threshold, without embeddings")
+    args = arg_parser.parse_args()
+    if args.sweep:
+        sweep(args.directory)
+    else:
+        benchmark(args.directory, args.threshold, args.lambda_mult, args.fetch_k)
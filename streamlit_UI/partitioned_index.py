@@ -0,0 +1,444 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import argparse
+import calendar
+import hashlib
+import threading
+import shutil
+import heapq
+import json
+import re
+import os
+
+from agent_common import fast_json
+
+# ~~~~~~~~~~~~~~~~~~~~ Time-Partitioned Vector Index ~~~~~~~~~~~~~~~~~~~~
+#
+# Splits the note chunks into one vector store per period (month by default) of
+# the note's date, so a question about recent meetings only searches the recent
+# partitions instead of the whole archive. Partitions are opened on first use and
+# at most `max_open` are kept open; the partitions a query needs are searched in
+# parallel and their top-k merged by cosine similarity. Old partitions can be
+# compacted into the read-only int8 index of compact_index.py.
+#
+# Layout of the index directory:
+#   partitions.json      manifest: key -> format, first/last note date, chunk count, content hash
+#   <key>/chroma/        a Chroma store, for partitions still being written
+#   <key>/compact/       a CompactIndex, for compacted partitions
+
+MANIFEST_FILE = "partitions.json"
+UNDATED = "undated"
+PERIODS = ("week", "month", "quarter", "year")
+
+_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+_MONTH = re.compile(r"\b(\d{4})-(\d{2})\b")
+_MONTH_NAME = re.compile(
+    r"\b(" + "|".join(calendar.month_name[1:]) + r")\b(?:,? (\d{4}))?",
+    re.IGNORECASE,
+)
+# "May I ..." and "march" are only read as months next to a year or after one of these
+AMBIGUOUS_MONTHS = {"may", "march"}
+MONTH_PREPOSITIONS = {"in", "during", "from", "since", "of", "for", "last", "this", "early", "late"}
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Dates ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def note_date(metadata):
+    """
+    The date of the note a chunk comes from: its `date` metadata, or else the
+    YYYY-MM-DD in its source file name (notes are named after the meeting day).
+    """
+    for value in (metadata.get("date"), os.path.basename(metadata.get("source", ""))):
+        match = _DATE.search(value or "")
+        if match:
+            try:
+                return date(*map(int, match.groups()))
+            except ValueError:
+                pass
+    return None
+
+
+def note_dates(metadata):
+    """
+    Every date a chunk's content appeared on: the `dates` near_duplicates.deduplicate
+    records for a folded group, or else the chunk's own note_date.
+    """
+    days = []
+    for value in (metadata.get("dates") or "").split("; "):
+        try:
+            days.append(date.fromisoformat(value))
+        except ValueError:
+            pass
+    return days or [note_date(metadata)]
+
+
+def partition_key(day, period="month"):
+    if day is None:
+        return UNDATED
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "quarter":
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    if period == "year":
+        return str(day.year)
+    return f"{day.year}-{day.month:02d}"
+
+
+def question_date_range(question, today=None):
+    """
+    Guesses which dates a question is about from explicit dates, months and a few
+    relative phrases.
+
+    Example call:
+
+    question_date_range("What did we decide in July 2024?")  # -> (date(2024, 7, 1), date(2024, 7, 31))
+
+    Returns:
+        tuple: (since, until) dates, or (None, None) when the question names no period.
+    """
+    today = today or datetime.now().date()
+    text = question.lower()
+
+    days = [date(*map(int, match.groups())) for match in _DATE.finditer(text) if _valid_date(*match.groups())]
+    if days:
+        return min(days), max(days)
+
+    months = [(int(year), int(month)) for year, month in _MONTH.findall(text) if 1 <= int(month) <= 12]
+    named = [match.groups() for match in _MONTH_NAME.finditer(question) if _is_month(question, match)]
+    named_years = [int(year) for _, year in named if year]
+    for name, year in named:
+        month = list(calendar.month_name).index(name.capitalize())
+        if year:
+            months.append((int(year), month))
+        elif named_years:
+            # "March and April 2025": a bare month shares the year named with the others
+            months.append((max(named_years), month))
+        else:
+            # A bare month name means its latest occurrence
+            months.append((today.year if month <= today.month else today.year - 1, month))
+    if months:
+        first, last = min(months), max(months)
+        return date(*first, 1), date(*last, calendar.monthrange(*last)[1])
+
+    if "today" in text:
+        return today, today
+    if "yesterday" in text:
+        return today - timedelta(days=1), today - timedelta(days=1)
+    if "this week" in text:
+        return today - timedelta(days=today.weekday()), today
+    if "last week" in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6)
+    if "this month" in text:
+        return today.replace(day=1), today
+    if "last month" in text:
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end
+    return None, None
+
+
+def _is_month(question, match):
+    name, year = match.groups()
+    if name.lower() not in AMBIGUOUS_MONTHS or year:
+        return True
+    preceding = question[:match.start()].lower().split()
+    return bool(preceding) and preceding[-1] in MONTH_PREPOSITIONS
+
+
+def _valid_date(year, month, day):
+    try:
+        date(int(year), int(month), int(day))
+        return True
+    except ValueError:
+        return False
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Building ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def content_hash(documents):
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(document.page_content.encode("utf-8"))
+        # The standard library's output, with sorted keys, is the same whichever JSON_BACKEND is set
+        digest.update(json.dumps(document.metadata, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_manifest(index_directory):
+    manifest_path = os.path.join(index_directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"period": None, "partitions": {}}
+    with open(manifest_path, "rb") as manifest_file:
+        return fast_json.loads(manifest_file.read())
+
+
+def save_manifest(index_directory, manifest):
+    manifest_path = os.path.join(index_directory, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "wb") as manifest_file:
+        manifest_file.write(fast_json.dumps(manifest, pretty=True))
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def open_chroma(partition_directory, embedding_function):
+    from langchain_chroma import Chroma
+
+    # Cosine distances, so scores from Chroma and compacted partitions can be merged
+    return Chroma(
+        persist_directory=os.path.join(partition_directory, "chroma"),
+        embedding_function=embedding_function,
+        collection_metadata={"hnsw:space": "cosine"},
+    )
+
+
+def build_partitioned_index(documents, embedding_function, index_directory, period="month"):
+    """
+    Writes the chunks into one vector store per period. Partitions whose chunks are
+    unchanged since the last build are left as they are, compacted or not.
+
+    Example call:
+
+    build_partitioned_index(docs, embedding_function, "./partitioned_index", period="month")
+
+    Returns:
+        dict: Counts of partitions written, unchanged and removed.
+    """
+    os.makedirs(index_directory, exist_ok=True)
+    manifest = load_manifest(index_directory)
+    if manifest["period"] not in (None, period):
+        # A new period changes every key, so the partitions are built again from scratch
+        for key in manifest["partitions"]:
+            shutil.rmtree(os.path.join(index_directory, key), ignore_errors=True)
+        manifest["partitions"] = {}
+    manifest["period"] = period
+
+    grouped = {}
+    for document in documents:
+        day = note_date(document.metadata)
+        if day is not None:
+            document.metadata["date"] = day.isoformat()
+        grouped.setdefault(partition_key(day, period), []).append((day, document))
+
+        # A chunk folded from several notes is also filed under the periods of the older
+        # ones, dated there by its latest appearance, so a question about those periods finds it
+        latest = {}
+        for seen in note_dates(document.metadata):
+            key = partition_key(seen, period)
+            if key != partition_key(day, period) and (key not in latest or seen > latest[key]):
+                latest[key] = seen
+        for key, seen in latest.items():
+            copy = document.model_copy(update={"metadata": {**document.metadata, "date": seen.isoformat()}})
+            grouped.setdefault(key, []).append((seen, copy))
+
+    stats = {"written": 0, "unchanged": 0, "removed": 0}
+    for key in set(manifest["partitions"]) - set(grouped):
+        shutil.rmtree(os.path.join(index_directory, key), ignore_errors=True)
+        del manifest["partitions"][key]
+        stats["removed"] += 1
+
+    for key, entries in sorted(grouped.items()):
+        chunks = [document for _, document in entries]
+        digest = content_hash(chunks)
+        if manifest["partitions"].get(key, {}).get("hash") == digest:
+            stats["unchanged"] += 1
+            continue
+
+        partition_directory = os.path.join(index_directory, key)
+        shutil.rmtree(partition_directory, ignore_errors=True)
+        open_chroma(partition_directory, embedding_function).add_documents(chunks)
+        days = [day.isoformat() for day, _ in entries if day is not None]
+        manifest["partitions"][key] = {
+            "format": "chroma",
+            "first_date": min(days) if days else None,
+            "last_date": max(days) if days else None,
+            "chunks": len(chunks),
+            "hash": digest,
+        }
+        stats["written"] += 1
+        save_manifest(index_directory, manifest)
+
+    save_manifest(index_directory, manifest)
+    return stats
+
+
+def compact_partitions(index_directory, keep_recent=6, embedding_function=None):
+    """
+    Converts every dated partition but the `keep_recent` most recent ones from Chroma
+    into a read-only CompactIndex, which is smaller on disk and faster to open.
+
+    Returns:
+        list: The keys of the partitions that were compacted.
+    """
+    from compact_index import build_compact_index
+
+    manifest = load_manifest(index_directory)
+    dated = sorted(key for key in manifest["partitions"] if key != UNDATED)
+    old = dated[:max(0, len(dated) - keep_recent)]
+
+    compacted = []
+    for key in old:
+        entry = manifest["partitions"][key]
+        if entry["format"] != "chroma":
+            continue
+        partition_directory = os.path.join(index_directory, key)
+        build_compact_index(open_chroma(partition_directory, embedding_function), os.path.join(partition_directory, "compact"))
+        shutil.rmtree(os.path.join(partition_directory, "chroma"), ignore_errors=True)
+        entry["format"] = "compact"
+        compacted.append(key)
+        save_manifest(index_directory, manifest)
+    return compacted
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Querying ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class PartitionedIndex:
+    """
+    Example call:
+
+    index = PartitionedIndex("./partitioned_index", embedding_function)
+    index.similarity_search("What are the action items from July?", k=3)
+
+    Exposes the same `similarity_search` call as the Chroma vector store.
+    """
+
+    def __init__(self, index_directory, embedding_function, max_open=24, workers=4):
+        self.index_directory = index_directory
+        self.embedding_function = embedding_function
+        self.max_open = max_open
+        self.manifest = load_manifest(index_directory)
+        self.opened = 0
+        self.queries = 0
+        self.partitions_searched = 0
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="partition-search")
+
+    def partitions_for(self, since=None, until=None):
+        """The partitions holding notes between the two dates (all of them when no dates are given)."""
+        keys = []
+        for key, entry in self.manifest["partitions"].items():
+            if entry["first_date"] is not None:
+                if since is not None and entry["last_date"] < since.isoformat():
+                    continue
+                if until is not None and entry["first_date"] > until.isoformat():
+                    continue
+            keys.append(key)
+        return sorted(keys, reverse=True)
+
+    def partition(self, key):
+        # Opened lazily, with the least recently used partition closed once too many are open
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                return self._open[key]
+
+        partition_directory = os.path.join(self.index_directory, key)
+        if self.manifest["partitions"][key]["format"] == "compact":
+            from compact_index import CompactIndex
+
+            store = CompactIndex(os.path.join(partition_directory, "compact"), self.embedding_function)
+        else:
+            store = open_chroma(partition_directory, self.embedding_function)
+
+        with self._lock:
+            store = self._open.setdefault(key, store)
+            self._open.move_to_end(key)
+            self.opened += 1
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return store
+
+    def search_partition(self, key, query_vector, k):
+        """Returns (cosine similarity, document) pairs of the top k chunks in one partition."""
+        store = self.partition(key)
+        if self.manifest["partitions"][key]["format"] == "compact":
+            return [(score, store.get_document(row)) for row, score in store.search_vector(query_vector, k)]
+        return [
+            (1.0 - distance, document)
+            for document, distance in store.similarity_search_by_vector_with_relevance_scores(query_vector, k)
+        ]
+
+    def search(self, query, k=3, since=None, until=None):
+        """
+        Searches the partitions covering the question's period (guessed from the question
+        when no dates are given) in parallel.
+
+        Returns:
+            tuple: (query vector, the overall top k (cosine similarity, document) pairs).
+        """
+        if since is None and until is None:
+            since, until = question_date_range(query)
+        keys = self.partitions_for(since, until)
+        if (since is not None or until is not None) and all(key == UNDATED for key in keys):
+            # Nothing from that period: better an answer from other notes than none
+            keys = self.partitions_for()
+        query_vector = self.embedding_function.embed_query(query)
+        if not keys:
+            return query_vector, []
+
+        results = self._pool.map(lambda key: self.search_partition(key, query_vector, k), keys)
+        with self._lock:
+            self.queries += 1
+            self.partitions_searched += len(keys)
+        ranked = heapq.nlargest(
+            len(keys) * k, (result for partition_results in results for result in partition_results), key=lambda result: result[0]
+        )
+
+        # A folded chunk is filed in each period it appeared in: keep one copy, the newest partition's on a tie
+        top = []
+        seen = set()
+        for score, document in ranked:
+            if document.page_content not in seen:
+                seen.add(document.page_content)
+                top.append((score, document))
+        return query_vector, top[:k]
+
+    def similarity_search(self, query, k=3, since=None, until=None):
+        _, top = self.search(query, k, since, until)
+        return [document for _, document in top]
+
+    def max_marginal_relevance_search(self, query, k=3, fetch_k=20, lambda_mult=0.5, since=None, until=None):
+        """
+        Picks k diverse chunks among the fetch_k nearest across partitions. The candidates'
+        vectors come from the embedding function, whose cache already holds every indexed chunk.
+        """
+        from near_duplicates import maximal_marginal_relevance
+
+        query_vector, top = self.search(query, max(k, fetch_k), since, until)
+        if not top:
+            return []
+        documents = [document for _, document in top]
+        vectors = self.embedding_function.embed_documents([document.page_content for document in documents])
+        return [documents[i] for i in maximal_marginal_relevance(query_vector, vectors, k, lambda_mult)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "partitions": len(self.manifest["partitions"]),
+                "compacted": sum(entry["format"] == "compact" for entry in self.manifest["partitions"].values()),
+                "open": len(self._open),
+                "opened": self.opened,
+                "average_partitions_searched": round(self.partitions_searched / (self.queries or 1), 2),
+            }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Inspect or compact the time-partitioned index.")
+    arg_parser.add_argument("--index", default=os.getenv("PARTITIONED_INDEX_DIRECTORY", "./partitioned_index"))
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the partitions")
+    compact_parser = subparsers.add_parser("compact", help="Compact all but the most recent partitions")
+    compact_parser.add_argument("--keep-recent", type=int, default=int(os.getenv("PARTITION_KEEP_RECENT", "6")))
+    args = arg_parser.parse_args()
+
+    if args.command == "list":
+        manifest = load_manifest(args.index)
+        print(f"period: {manifest['period']}")
+        for key, entry in sorted(manifest["partitions"].items()):
+            print(f"{key:>10}  {entry['format']:<8} {entry['chunks']:>7} chunks  {entry['first_date']} .. {entry['last_date']}")
+    else:
+        from embedding_cache import get_embedding_function
+
+        embedding_function = get_embedding_function(model_name="all-MiniLM-L6-v2")
+        print(f"Compacted: {compact_partitions(args.index, args.keep_recent, embedding_function) or 'nothing'}")
@@ -1,35 +1,68 @@
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_community.document_loaders import DirectoryLoader
 from langchain_text_splitters import CharacterTextSplitter
 from langchain_chroma import Chroma
 from dotenv import load_dotenv
 import os
 
+from compact_index import build_compact_index
+from partitioned_index import build_partitioned_index, compact_partitions
+from document_extraction import extract_documents
+from near_duplicates import deduplicate
+from embedding_cache import CachedEmbeddings, get_embedding_function
+
 load_dotenv()
 
 rag_directory = os.getenv('DIRECTORY', 'meeting_notes')
+rag_index_mode = os.getenv('RAG_INDEX_MODE', 'chroma')
+compact_index_directory = os.getenv('COMPACT_INDEX_DIRECTORY', './compact_index')
+extraction_cache_directory = os.getenv('EXTRACTION_CACHE_DIRECTORY', './extraction_cache')
+# Chunks at least this similar (estimated Jaccard of word shingles) to an earlier one are folded into it (0 disables)
+dedup_threshold = float(os.getenv('DEDUP_THRESHOLD', '0.6'))
+partitioned_index_directory = os.getenv('PARTITIONED_INDEX_DIRECTORY', './partitioned_index')
+partition_period = os.getenv('PARTITION_PERIOD', 'month')
+# Partitions older than this many periods are compacted into read-only int8 indexes (0 never compacts)
+partition_keep_recent = int(os.getenv('PARTITION_KEEP_RECENT', '0'))
 
 # To load document & create the ChromaDB locally so the task_management_agent can work with it.
 def load_documents(directory):
-    # Load the PDF or txt documents from the directory
-    loader = DirectoryLoader(directory)
-    documents = loader.load()
+    # Load the PDF or txt documents from the directory. Files unchanged since the last run come from the cache
+    documents, stats = extract_documents(directory, extraction_cache_directory)
+    print(f"Extracted {stats['files']} files ({stats['pages']} pages, {stats['cached_files']} files from cache)")
 
     # Split the documents into chunks
     text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
     docs = text_splitter.split_documents(documents)
 
+    # Store repeated boilerplate and carried-over action items once
+    if dedup_threshold > 0:
+        docs, stats = deduplicate(docs, dedup_threshold)
+        print(f"Deduplicated chunks: {stats}")
+
     return docs
 
 def main():
     # Get the documents split into chunks
     docs = load_documents(rag_directory)
 
-    # Create the open-source embedding function
-    embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    # Create the open-source embedding function. Chunks embedded on a previous run come from the cache
+    embedding_function = get_embedding_function(model_name="all-MiniLM-L6-v2")
+
+    # Or, for large archives, into one vector store per month (or other period) of the notes' dates
+    if rag_index_mode == "partitioned":
+        stats = build_partitioned_index(docs, embedding_function, partitioned_index_directory, partition_period)
+        print(f"Partitions: {stats}")
+        if partition_keep_recent:
+            print(f"Compacted partitions: {compact_partitions(partitioned_index_directory, partition_keep_recent, embedding_function)}")
+        return
 
     # Load the documents into Chroma and save it to the disk
-    Chroma.from_documents(docs, embedding_function, persist_directory="./chroma_db")
+    db = Chroma.from_documents(docs, embedding_function, persist_directory="./chroma_db")
+
+    # Optionally export the vectors into the compact int8 index used by RAG_INDEX_MODE=compact
+    if rag_index_mode == "compact":
+        build_compact_index(db, compact_index_directory)
+
+    if isinstance(embedding_function, CachedEmbeddings):
+        print(f"Embedding cache: {embedding_function.stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Startup Benchmark ~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Measures how long a fresh interpreter takes before the app can serve its first
+# request, and which imports that time goes to (via `python -X importtime`).
+#
+# Example calls:
+#
+#   python startup_benchmark.py                                   # Streamlit agent
+#   python startup_benchmark.py --path ../backend --module main   # FastAPI backend
+#   python startup_benchmark.py --first-query "action items?"     # include the first RAG query
+
+READY_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+ready = time.perf_counter()
+print(f"import_seconds={{ready - start}}")
+question = {first_query!r}
+if question:
+    {module}.query_documents.invoke({{"question": question}})
+    print(f"first_query_seconds={{time.perf_counter() - ready}}")
+"""
+
+
+def run_ready_script(path, module, first_query):
+    script = READY_SCRIPT.format(module=module, first_query=first_query)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stdout.splitlines():
+        if "=" in line:
+            name, value = line.split("=", 1)
+            timings[name] = float(value)
+    return timings
+
+
+def import_profile(path, module, top):
+    """
+    Returns the `top` slowest imports as (cumulative seconds, module name) pairs.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative) / 1_000_000, name.strip()))
+    imports.sort(reverse=True)
+    return imports[:top]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark cold start of the agent apps.")
+    arg_parser.add_argument("--path", default=os.path.dirname(os.path.abspath(__file__)))
+    arg_parser.add_argument("--module", default="task_management_agent")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--top", type=int, default=15)
+    arg_parser.add_argument("--first-query", default="")
+    args = arg_parser.parse_args()
+
+    runs = [run_ready_script(args.path, args.module, args.first_query) for _ in range(args.runs)]
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        print(f"{name}: median {statistics.median(values):.3f}s, min {min(values):.3f}s, max {max(values):.3f}s")
+
+    print(f"\nSlowest imports (cumulative) for '{args.module}':")
+    for seconds, name in import_profile(args.path, args.module, args.top):
+        print(f"{seconds:8.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
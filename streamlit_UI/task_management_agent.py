@@ -2,40 +2,394 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from dateutil import parser
 import streamlit as st
-import json
+import contextvars
+import threading
+import logging
+import inspect
+import time
+import uuid
 import os
 
-from todoist_api_python.api import TodoistAPI
-
 from langchain_core.tools import tool
-from langchain_cohere import ChatCohere
 from langchain_core.messages import SystemMessage, AIMessage, HumanMessage, ToolMessage
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
+
+from fuzzy_index import FuzzyIndex
+from agent_common.intent_router import IntentRouter, Route
+from agent_common.model_cascade import ModelCascade, FAST, STRONG
+from tool_selector import ToolSelector
+from agent_common.agent_loop import TurnBudget, PARTIAL_ANSWER, current_budget, stream_with_budget, timeout_session
+from agent_common.client_pool import TenantClientPool, current_tenant_token
+from agent_common import fast_json
+from agent_common.task_digest import DigestScheduler
+from agent_common.job_queue import JobQueue, describe_finished_jobs
+
+# NB: The Todoist client, ChatCohere, the embedding model and Chroma are imported and
+# built lazily on first use so that a session which never touches RAG starts quickly.
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Loading the model
 cohere_api_token = os.getenv('COHERE_API_KEY', '')
 rag_directory = os.getenv('DIRECTORY', 'meeting_notes')
+# "chroma" (default), "compact" to search the int8 memory-mapped index built by compact_index.py,
+# or "partitioned" to search the per-period indexes built by rag-document-loader.py
+rag_index_mode = os.getenv('RAG_INDEX_MODE', 'chroma')
+compact_index_directory = os.getenv('COMPACT_INDEX_DIRECTORY', './compact_index')
+partitioned_index_directory = os.getenv('PARTITIONED_INDEX_DIRECTORY', './partitioned_index')
+max_open_partitions = int(os.getenv('MAX_OPEN_PARTITIONS', '24'))
+partition_query_workers = int(os.getenv('PARTITION_QUERY_WORKERS', '4'))
+# Diversity of the RAG results: 1 ranks by relevance only, lower values favour chunks unlike those already picked
+rag_mmr_lambda = float(os.getenv('RAG_MMR_LAMBDA', '0.5'))
+rag_mmr_fetch_k = int(os.getenv('RAG_MMR_FETCH_K', '20'))
+# Set to "1" to load the embedding model and vector store in a background thread at startup
+rag_warmup = os.getenv('RAG_WARMUP', '0') == '1'
+
+# Simple turns go to the fast model first, hard or failed ones to the strong model.
+# NB: Streamlit re-runs this script on every message, so every object that keeps state
+# across turns (pools, caches, schedulers, stats) is built once per process in a
+# st.cache_resource factory.
+@st.cache_resource
+def get_model_cascade():
+    return ModelCascade(
+        os.getenv('COHERE_FAST_MODEL') or 'command-r7b-12-2024',
+        os.getenv('COHERE_STRONG_MODEL') or 'command-r-plus',
+        enabled=os.getenv('MODEL_CASCADE', '0') == '1',
+    )
+
+model_cascade = get_model_cascade()
+
+# Only the most relevant tools are bound to each call (TOOL_SELECTION_TOP_K=0 binds them all).
+# TOOL_DESCRIPTIONS=compact binds one-line descriptions instead of the full docstrings.
+tool_selection_top_k = int(os.getenv('TOOL_SELECTION_TOP_K', '5'))
+tool_selection_embeddings = os.getenv('TOOL_SELECTION_EMBEDDINGS', '0') == '1'
+tool_descriptions = os.getenv('TOOL_DESCRIPTIONS', 'full')
+# Number of chat messages shown per page of history; older pages are only rendered on request
+history_page_size = int(os.getenv('HISTORY_PAGE_SIZE', '50'))
+# Most messages kept in a session: the model's context and the shown chat drop their oldest beyond these
+max_context_messages = int(os.getenv('MAX_CONTEXT_MESSAGES', '40'))
+max_rendered_messages = int(os.getenv('MAX_RENDERED_MESSAGES', '500'))
+
+# The project list is reused for this long; a session's projects and digest are prefetched when it starts
+projects_cache_seconds = float(os.getenv('PROJECTS_CACHE_SECONDS', '120'))
+workspace_prefetch = os.getenv('WORKSPACE_PREFETCH', '1') == '1'
+
+# Writes can be queued in a local SQLite database and run by background workers, with retries
+job_queue_enabled = os.getenv('JOB_QUEUE', '0') == '1'
+
+# Every turn is bounded by a wall-clock deadline and a number of AI steps
+turn_deadline_seconds = float(os.getenv('AGENT_TURN_DEADLINE_SECONDS', '60'))
+max_agent_steps = int(os.getenv('AGENT_MAX_STEPS', '6'))
 
 # Initializing Todoist API
 todoist_api_key = os.getenv('TODOIST_API_KEY', '')
-todoist_api_instance = TodoistAPI(todoist_api_key)
+
+
+def create_todoist_api(token, rate_limiter):
+    from todoist_api_python.api import TodoistAPI
+
+    # The session keeps the tenant's connections alive, rate limits its calls and
+    # caps each one by the time left in the current turn
+    return TodoistAPI(token, session=timeout_session(rate_limiter=rate_limiter))
+
+# One Todoist client per user token, with its own connections, rate limit and caches
+@st.cache_resource
+def get_todoist_client_pool():
+    return TenantClientPool(
+        create_todoist_api,
+        max_tenants=int(os.getenv('TENANT_POOL_SIZE', '1000')),
+        idle_seconds=float(os.getenv('TENANT_IDLE_SECONDS', '900')),
+        rate=float(os.getenv('TENANT_RATE_LIMIT', '5')),
+        burst=int(os.getenv('TENANT_RATE_BURST', '10')),
+    )
+
+todoist_client_pool = get_todoist_client_pool()
+
+def get_tenant():
+    # The user's own token when they entered one, the token from the environment otherwise
+    return todoist_client_pool.get(current_tenant_token.get() or todoist_api_key)
+
+def get_todoist_api():
+    return get_tenant().client
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Task Digests ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def fetch_open_tasks(tenant):
+    # Runs in the digest thread too, so it uses the tenant's client rather than the current one
+    return [
+        dict(task.to_dict(), due_date=task.due.date if task.due else None)
+        for task in tenant.client.get_tasks()
+        if not task.is_completed
+    ]
+
+# Due today, overdue and upcoming tasks per user, rebuilt in the background.
+# One scheduler (and refresh thread) per process, not one per rerun.
+@st.cache_resource
+def get_task_digests():
+    return DigestScheduler(
+        todoist_client_pool,
+        fetch_open_tasks,
+        interval_seconds=float(os.getenv('DIGEST_REFRESH_SECONDS', '300')),
+        horizon_days=int(os.getenv('DIGEST_HORIZON_DAYS', '7')),
+    )
+
+task_digests = get_task_digests()
 
 # ~~~~~~~~~~~~~~~ Function to get the Vector DB for RAG ~~~~~~~~~~~~~~~~
 
 @st.cache_resource
-def get_chroma_instance():
+def get_embedding_function():
+    from embedding_cache import CachedEmbeddings, get_embedding_function as get_cached_embedding_function
+
     # Create the open-source embedding function. NB: Use same funtion used for embedding docs to ChromaDB
-    embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    # Repeated questions are served from the persistent embedding cache
+    embedding_function = get_cached_embedding_function(model_name="all-MiniLM-L6-v2")
 
+    # Tool selection only switches to embeddings once RAG has loaded the model. It skips
+    # the disk cache: every user message would otherwise take its file lock and be stored
+    if tool_selection_embeddings:
+        model = embedding_function.embeddings if isinstance(embedding_function, CachedEmbeddings) else embedding_function
+        tool_selector.warm_up(lambda: model)
+    return embedding_function
+
+@st.cache_resource
+def get_chroma_instance():
     # Get the Chroma instance from what is saved to the disk
-    return Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+    if rag_index_mode == "compact":
+        from compact_index import CompactIndex
+
+        return CompactIndex(compact_index_directory, embedding_function=get_embedding_function())
+    if rag_index_mode == "partitioned":
+        from partitioned_index import PartitionedIndex
+
+        return PartitionedIndex(
+            partitioned_index_directory,
+            get_embedding_function(),
+            max_open=max_open_partitions,
+            workers=partition_query_workers,
+        )
+
+    from langchain_chroma import Chroma
+
+    return Chroma(persist_directory="./chroma_db", embedding_function=get_embedding_function())
+
+@st.cache_resource
+def start_rag_warmup():
+    """
+    Loads the embedding model and vector store in a daemon thread so the first
+    query_documents call does not pay for it. Only the first call of the process starts a thread.
+    """
+    thread = threading.Thread(target=get_chroma_instance, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+
+# ~~~~~~~~~~~~~~~~ Fuzzy Lookup of Projects and Tasks ~~~~~~~~~~~~~~~~~~
+
+# Project names and per-project task contents are indexed in memory so the tools
+# can resolve slightly paraphrased names without another API round trip.
+# The indexes are refreshed from the API on a miss and updated on every write.
+# Each user (tenant) has their own indexes.
+def get_project_index():
+    return get_tenant().cache.setdefault("project_index", FuzzyIndex())
+
+
+def get_task_indexes():
+    return get_tenant().cache.setdefault("task_indexes", {})
+
+
+def get_projects(max_age=None):
+    """
+    Returns the user's projects, from the tenant cache if they were fetched less than
+    `max_age` seconds ago (PROJECTS_CACHE_SECONDS by default), and rebuilds the project
+    index whenever they are fetched.
+    """
+    tenant = get_tenant()
+    max_age = projects_cache_seconds if max_age is None else max_age
+    # A tool call made while the prefetch is fetching waits for it instead of fetching again
+    with tenant.cache.setdefault("projects_lock", threading.Lock()):
+        cached = tenant.cache.get("projects")
+        if cached is None or time.monotonic() - cached[0] > max_age:
+            cached = (time.monotonic(), tenant.client.get_projects())
+            tenant.cache["projects"] = cached
+            get_project_index().rebuild((project.id, project.name) for project in cached[1])
+    return cached[1]
+
 
-db = get_chroma_instance()
+def refresh_project_index(projects=None):
+    if projects is None:
+        get_projects(max_age=0)
+        return
+    get_project_index().rebuild((project.id, project.name) for project in projects)
 
 
+def refresh_task_index(project_id, tasks=None):
+    if tasks is None:
+        tasks = get_todoist_api().get_tasks(project_id=project_id)
+    index = get_task_indexes().setdefault(project_id, FuzzyIndex())
+    index.rebuild((task.id, task.content) for task in tasks if not task.is_completed)
+    return index
+
+
+def format_candidates(candidates):
+    return ", ".join(f"'{text}'" for _, _, text in candidates)
+
+
+def is_exact_match(key, candidates):
+    return key is not None and candidates[0][0] == 1.0
+
+
+def confirmation_message(kind, name, candidates, container=""):
+    # Tells the AI which entity to confirm with the user; it then calls the tool again with the exact name
+    if len(candidates) == 1 and candidates[0][0] < 1.0:
+        return (
+            f"{kind} '{name}' was not found{container}, but '{candidates[0][2]}' is close. Ask the user to "
+            f"confirm they meant '{candidates[0][2]}' and, if so, call the tool again with that exact name."
+        )
+    return f"{kind} '{name}' is ambiguous{container}. Ask the user to confirm which one they meant: {format_candidates(candidates)}."
+
+
+def find_project(project_name, exact=False):
+    """
+    Resolves a (possibly paraphrased) project name to a Todoist project ID.
+
+    Args:
+        exact (bool): For tools that write or delete: only an exact name (after normalization)
+            resolves, a near match is returned for the user to confirm.
+
+    Returns:
+        tuple: (project_id, error). `error` is None when the project was found, otherwise it
+            is a message telling the AI the project is missing or asking it to confirm
+            which of several close matches the user meant.
+    """
+    project_id, candidates = get_project_index().resolve(project_name, exact=exact)
+    if not is_exact_match(project_id, candidates):
+        # A project created since the index was built may match exactly, so refresh before settling
+        refresh_project_index()
+        project_id, candidates = get_project_index().resolve(project_name, exact=exact)
+
+    if project_id is not None:
+        return project_id, None
+    if candidates:
+        return None, confirmation_message("Project", project_name, candidates)
+    return None, f"Project '{project_name}' not found."
+
+
+def find_task(project_id, project_name, task_content, exact=False):
+    """
+    Resolves a (possibly paraphrased) task content to an active task within a project.
+
+    Args:
+        exact (bool): For tools that write: only an exact match resolves, as in `find_project`.
+
+    Returns:
+        tuple: (task_id, matched_content, error). `error` is None when the task was found.
+    """
+    index = get_task_indexes().get(project_id)
+    refreshed = index is None
+    if index is None:
+        index = refresh_task_index(project_id)
+    task_id, candidates = index.resolve(task_content, exact=exact)
+    if not is_exact_match(task_id, candidates) and not refreshed:
+        index = refresh_task_index(project_id)
+        task_id, candidates = index.resolve(task_content, exact=exact)
+
+    if task_id is not None:
+        return task_id, index.get(task_id), None
+    if candidates:
+        return None, None, confirmation_message("Task", task_content, candidates, f" in project '{project_name}'")
+    return None, None, f"Task '{task_content}' not found in project '{project_name}'."
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Background Writes ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# The Todoist write calls and the cache updates that follow them. The tools resolve
+# names to IDs first (so a missing or ambiguous name is reported in the turn) and then
+# run these inline, or enqueue them when JOB_QUEUE=1. Queued writes run with the
+# session's token, are retried when that cannot duplicate them, and their results are
+# reported to the AI at the start of the session's next turn.
+def write_add_task(content, project_id, due_string):
+    new_task = get_todoist_api().add_task(content=content, project_id=project_id, due_string=due_string)
+    if project_id in get_task_indexes():
+        get_task_indexes()[project_id].add(new_task.id, new_task.content)
+    task_digests.invalidate(get_tenant())
+    return {
+        "id": new_task.id,
+        "content": new_task.content,
+        "description": new_task.description,
+        "is_completed": new_task.is_completed,
+        "due": new_task.due.to_dict() if new_task.due else '',
+        "priority": new_task.priority,
+        "project_id": new_task.project_id,
+        "url": new_task.url,
+    }
+
+
+def write_update_task(task_id, due_string):
+    update_data = {}
+    if due_string:
+        update_data["due_string"] = due_string
+    updated_task = get_todoist_api().update_task(task_id, **update_data)
+    task_digests.invalidate(get_tenant())
+    return {"task_id": task_id, "updated": bool(updated_task)}
+
+
+def write_close_task(project_id, task_id):
+    get_todoist_api().close_task(task_id)
+    if project_id in get_task_indexes():
+        get_task_indexes()[project_id].remove(task_id)
+    task_digests.invalidate(get_tenant())
+    return {"task_id": task_id, "completed_at": datetime.now().isoformat()}
+
+
+def write_delete_project(project_id):
+    get_todoist_api().delete_project(project_id)
+    get_project_index().remove(project_id)
+    get_tenant().cache.pop("projects", None)
+    get_task_indexes().pop(project_id, None)
+    task_digests.invalidate(get_tenant())
+    return {"project_id": project_id}
+
+
+# One queue (and set of workers) per process: a queue built on every rerun would start
+# new workers each time and lose the tokens of the jobs already queued
+@st.cache_resource
+def get_job_queue():
+    if not job_queue_enabled:
+        return None
+    return JobQueue(
+        os.getenv('JOB_QUEUE_PATH', './jobs.sqlite3'),
+        {
+            "add_task": write_add_task,
+            "update_task": write_update_task,
+            "close_task": write_close_task,
+            "delete_project": write_delete_project,
+        },
+        workers=int(os.getenv('JOB_QUEUE_WORKERS', '2')),
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+        retry_seconds=float(os.getenv('JOB_RETRY_SECONDS', '2')),
+        # Setting a due date, closing a task or deleting a project twice does no harm; adding a task does
+        idempotent={"update_task", "close_task", "delete_project"},
+    )
+
+job_queue = get_job_queue()
+
+
+def job_owner():
+    # Finished jobs are reported back to the session that enqueued them
+    return st.session_state.setdefault("job_owner", uuid.uuid4().hex)
+
+
+def enqueue_write(name, args, description):
+    job_id = job_queue.enqueue(name, args, description, owner=job_owner())
+    return {
+        "status": "queued",
+        "job_id": job_id,
+        "message": f"{description}: queued, it will be done in the background and its result reported in the next turn.",
+    }
+
 
 # ~~~~~~~~~~~~~~~~~~~~~ AI Agent Tool Functions ~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -57,7 +411,7 @@ def get_user_projects():
         str: An error message if the API call fails.
     """   
     try:
-        all_projects = todoist_api_instance.get_projects()
+        all_projects = get_projects()
         # Convert each Project object to a dictionary manually
         return [
             {
@@ -97,7 +451,9 @@ def create_new_project(project_name: str):
 
   try:
     # Create a project using the Todoist API with the provided name
-    new_project = todoist_api_instance.add_project(name=project_name)
+    new_project = get_todoist_api().add_project(name=project_name)
+    get_project_index().add(new_project.id, new_project.name)
+    get_tenant().cache.pop("projects", None)
     
     # Convert the Project object to a dictionary manually
     return {
@@ -134,11 +490,10 @@ def get_project(project_name: str):
         str: The JSON response of the API call, including the ID of the project, or an error message.
     """
     try:
-        all_projects = todoist_api_instance.get_projects()
-        project_id = next((project.id for project in all_projects if project.name == project_name), '')
-        if not project_id:
-            return f"Project '{project_name}' not found."
-        project = todoist_api_instance.get_project(project_id=project_id)
+        project_id, error = find_project(project_name)
+        if error:
+            return error
+        project = get_todoist_api().get_project(project_id=project_id)
         return {
             "id": project.id,
             "name": project.name,
@@ -174,20 +529,14 @@ def update_project(project_name: str, name: str):
     """
 
     try:
-        # Get all projects
-        all_projects = todoist_api_instance.get_projects()
-
         # Find the project ID by name
-        project_id = ''
-        for project in all_projects:
-            if project.name == project_name:
-                project_id = project.id
-                break
-
-        if project_id == '':
-            return f"Project '{project_name}' not found."
+        project_id, error = find_project(project_name, exact=True)
+        if error:
+            return error
         # Update a project using the Todoist API with the provided name
-        project = todoist_api_instance.update_project(project_id=project_id, name=name)
+        project = get_todoist_api().update_project(project_id=project_id, name=name)
+        get_project_index().add(project_id, name)
+        get_tenant().cache.pop("projects", None)
         return True, f"Project '{project_name}' updated successfully."
     except Exception as e:
         return False, f"Sorry I encoutered some errors while updating the project: {e}"
@@ -210,11 +559,12 @@ def delete_project(project_name: str):
     """
 
     try:
-        all_projects = todoist_api_instance.get_projects()
-        project_id = next((project.id for project in all_projects if project.name == project_name), '')
-        if not project_id:
-            return False, f"Project '{project_name}' not found."
-        todoist_api_instance.delete_project(project_id)
+        project_id, error = find_project(project_name, exact=True)
+        if error:
+            return False, error
+        if job_queue is not None:
+            return True, enqueue_write("delete_project", {"project_id": project_id}, f"Delete project '{project_name}'")["message"]
+        write_delete_project(project_id)
         return True, f"Project '{project_name}' deleted successfully."
     except Exception as e:
         return False, f"Error deleting project: {e}"
@@ -237,21 +587,14 @@ def get_active_tasks(project_name: str):
   """
 
   try:
-      # Get all projects
-      all_projects = todoist_api_instance.get_projects()
-
       # Find the project ID by name
-      project_id = ''
-      for project in all_projects:
-          if project.name == project_name:
-              project_id = project.id
-              break
-
-      if project_id == '':
-          return [], f"Project '{project_name}' not found."
+      project_id, error = find_project(project_name)
+      if error:
+          return [], error
 
       # Get all active tasks in the project
-      active_tasks = todoist_api_instance.get_tasks()
+      active_tasks = get_todoist_api().get_tasks()
+      refresh_task_index(project_id, [task for task in active_tasks if task.project_id == project_id])
 
       # Convert tasks to dictionaries & get only active tasks
       return [task.to_dict() for task in active_tasks if task.project_id == project_id and not task.is_completed]
@@ -277,19 +620,13 @@ def get_tasks_by_due_date(due_date: str):
     """
     today = f"The current date is: {datetime.now().date()}"
     try:
-        # Get all tasks
-        all_tasks = todoist_api_instance.get_tasks()
-        
         if due_date == "today":
             due_date_str = today
             due_date_split = parser.parse(due_date_str.split(": ")[1])
             due_date = due_date_split.strftime("%Y-%m-%d")
 
-        # Filter tasks by the specified due date
-        filtered_tasks = [
-            task.to_dict() for task in all_tasks 
-            if task.due and task.due.date == due_date
-        ]
+        # Tasks by due date come from the user's digest, kept up to date in the background
+        filtered_tasks = task_digests.get(get_tenant())["by_due_date"].get(due_date, [])
 
         if not filtered_tasks:
             return [], f"No tasks found for the due date '{due_date}'."
@@ -299,6 +636,36 @@ def get_tasks_by_due_date(due_date: str):
     except Exception as e:
         return [], f"Error retrieving tasks by due date: {e}"
 
+@tool
+def get_task_digest():
+    """
+    Gets an overview of the user's open tasks: those due today, overdue and due in the
+    next 7 days, and the number of open tasks per project.
+
+    Example call:
+
+    get_task_digest()
+    Returns:
+        dict: The tasks due today, overdue and upcoming and the counts per project name,
+              or an error message if the tasks could not be retrieved.
+    """
+    try:
+        digest = task_digests.get(get_tenant())
+        get_projects()
+        project_index = get_project_index()
+        return {
+            "date": digest["date"],
+            "due_today": [task["content"] for task in digest["due_today"]],
+            "overdue": [f"{task['content']} (due {task['due_date']})" for task in digest["overdue"]],
+            "upcoming": [f"{task['content']} (due {task['due_date']})" for task in digest["upcoming"]],
+            "counts_by_project": {
+                project_index.get(project_id) or project_id: counts
+                for project_id, counts in digest["counts_by_project"].items()
+            },
+        }
+    except Exception as e:
+        return {"error": f"Error getting the task digest: {e}"}
+
 @tool
 def create_new_task(project_name: str, task_content: str, due_string: str):
     """
@@ -313,28 +680,17 @@ def create_new_task(project_name: str, task_content: str, due_string: str):
         due_string (str, optional): A natural language string for the task's due date (e.g., "tomorrow at 12:00").
 
     Returns:
-        dict: The details of the created task, or an error message if the operation fails.
+        dict: The details of the created task (or, with the job queue on, the ID of the job
+            creating it), or an error message if the operation fails.
     """
     try:
-        all_projects = todoist_api_instance.get_projects()
-        project_id = next((project.id for project in all_projects if project.name == project_name), '')
-        if not project_id:
-            return {"error": f"Project '{project_name}' not found."}
-        new_task = todoist_api_instance.add_task(
-            content=task_content,
-            project_id=project_id,
-            due_string=due_string
-        )
-        return {
-            "id": new_task.id,
-            "content": new_task.content,
-            "description": new_task.description,
-            "is_completed": new_task.is_completed,
-            "due": new_task.due.to_dict() if new_task.due else '',
-            "priority": new_task.priority,
-            "project_id": new_task.project_id,
-            "url": new_task.url,
-        }
+        project_id, error = find_project(project_name, exact=True)
+        if error:
+            return {"error": error}
+        args = {"content": task_content, "project_id": project_id, "due_string": due_string}
+        if job_queue is not None:
+            return enqueue_write("add_task", args, f"Create task '{task_content}' in project '{project_name}'")
+        return write_add_task(**args)
     except Exception as e:
         return {"error": f"Error adding task: {e}"}
   
@@ -355,41 +711,23 @@ def update_task(project_name: str, task_content: str, due_string: str):
         dict: The updated task details or an error message if the operation fails.
     """
     try:
-        # Get all projects
-        all_projects = todoist_api_instance.get_projects()
-
         # Find the project ID by name
-        project_id = ''
-        for project in all_projects:
-            if project.name == project_name:
-                project_id = project.id
-                break
-
-        if project_id == '':
-            return {"error": f"Project '{project_name}' not found."}
-
-        # Get all tasks in the project
-        all_tasks = todoist_api_instance.get_tasks(project_id=project_id)
+        project_id, error = find_project(project_name, exact=True)
+        if error:
+            return {"error": error}
 
         # Find the task by content
-        task_to_update = ''
-        for task in all_tasks:
-            if task.content == task_content:
-                task_to_update = task
-                break
-
-        if task_to_update == '':
-            return {"error": f"Task '{task_content}' not found in project '{project_name}'."}
+        task_id, matched_content, error = find_task(project_id, project_name, task_content, exact=True)
+        if error:
+            return {"error": error}
 
-        # Create a dictionary to hold the updated task data
-        update_data = {}
-        if due_string:
-            update_data["due_string"] = due_string
+        # Update the task using the Todoist API, in the background with the job queue on
+        if job_queue is not None:
+            args = {"task_id": task_id, "due_string": due_string}
+            return True, enqueue_write("update_task", args, f"Update task '{matched_content}'")["message"]
+        write_update_task(task_id, due_string)
 
-        # Update the task using the Todoist API
-        updated_task = todoist_api_instance.update_task(task_to_update.id, **update_data)
-
-        return True, f"Task '{task_content}' updated successfully."
+        return True, f"Task '{matched_content}' updated successfully."
     except Exception as e:
         return False, f"Sorry I encoutered some errors while updating the tsak: {e}"
   
@@ -410,43 +748,30 @@ def complete_task(project_name: str, task_content: str):
               or an error message if the operation fails.
     """
     try:
-        # Get all projects
-        all_projects = todoist_api_instance.get_projects()
-
         # Find the project ID by name
-        project_id = ''
-        for project in all_projects:
-            if project.name == project_name:
-                project_id = project.id
-                break
-
-        if project_id == '':
-            return {"error": f"Project '{project_name}' not found."}
-
-        # Get all tasks in the project
-        all_tasks = todoist_api_instance.get_tasks(project_id=project_id)
+        project_id, error = find_project(project_name, exact=True)
+        if error:
+            return {"error": error}
 
         # Find the task by content
-        task_to_complete = ''
-        for task in all_tasks:
-            if task.content == task_content:
-                task_to_complete = task
-                break
+        task_id, matched_content, error = find_task(project_id, project_name, task_content, exact=True)
+        if error:
+            return {"error": error}
 
-        if task_to_complete == '':
-            return {"error": f"Task '{task_content}' not found in project '{project_name}'."}
-
-        # Complete the task using the Todoist API
-        todoist_api_instance.close_task(task_to_complete.id)
+        # Complete the task using the Todoist API, in the background with the job queue on
+        if job_queue is not None:
+            args = {"project_id": project_id, "task_id": task_id}
+            return enqueue_write("close_task", args, f"Complete task '{matched_content}'")
+        write_close_task(project_id, task_id)
 
         # Return a success response with task details
         return {
             "status": "success",
-            "message": f"Task '{task_content}' has been marked as complete.",
-            "task_id": task_to_complete.id,
-            "content": task_to_complete.content,
-            "project_id": task_to_complete.project_id,
-            "completed_at": task_to_complete.completed_at if hasattr(task_to_complete, 'completed_at') else '',
+            "message": f"Task '{matched_content}' has been marked as complete.",
+            "task_id": task_id,
+            "content": matched_content,
+            "project_id": project_id,
+            "completed_at": datetime.now().isoformat(),
         }
 
     except Exception as e:
@@ -466,10 +791,17 @@ def query_documents(question):
     Returns:
         str: The list of texts (and their sources) that matched with the question the closest using RAG
     """
-    similar_docs = db.similarity_search(question, k=3)
-    docs_formatted = list(map(lambda doc: f"Source: {doc.metadata.get('source', 'NA')}\nContent: {doc.page_content}", similar_docs))
+    # Maximal marginal relevance keeps near-identical chunks from taking up all three results
+    if rag_mmr_lambda < 1:
+        similar_docs = get_chroma_instance().max_marginal_relevance_search(
+            question, k=3, fetch_k=rag_mmr_fetch_k, lambda_mult=rag_mmr_lambda
+        )
+    else:
+        similar_docs = get_chroma_instance().similarity_search(question, k=3)
+    # Deduplicated chunks list every note they appear in
+    docs_formatted = list(map(lambda doc: f"Source: {doc.metadata.get('sources') or doc.metadata.get('source', 'NA')}\nContent: {doc.page_content}", similar_docs))
 
-    return str(docs_formatted)
+    return fast_json.dumps_str(docs_formatted)
 
 
 # Maps the function names to the actual function object in the script
@@ -482,54 +814,267 @@ available_functions = {
     "delete_project": delete_project,
     "get_active_tasks": get_active_tasks,
     "get_tasks_by_due_date": get_tasks_by_due_date,
+    "get_task_digest": get_task_digest,
     "create_new_task": create_new_task,
     "update_task": update_task,
     "complete_task": complete_task,
     "query_documents": query_documents
 }     
 
+# One-line variants of the tool docstrings, bound instead of them when TOOL_DESCRIPTIONS=compact
+compact_tool_descriptions = {
+    "get_user_projects": "List all of the user's Todoist projects.",
+    "create_new_project": "Create a Todoist project with the given name.",
+    "get_project": "Get the details of a Todoist project by name.",
+    "update_project": "Rename a Todoist project.",
+    "delete_project": "Delete a Todoist project by name.",
+    "get_active_tasks": "List the active tasks in a Todoist project.",
+    "get_tasks_by_due_date": "List tasks due on a date ('today' or YYYY-MM-DD).",
+    "get_task_digest": "Overview of tasks due today, overdue, due this week and counts per project.",
+    "create_new_task": "Add a task with a due string to a Todoist project.",
+    "update_task": "Change the due date of a task in a Todoist project.",
+    "complete_task": "Mark a task in a Todoist project as complete.",
+    "query_documents": "Search the meeting notes for context to answer a question.",
+}
+
+if tool_descriptions == "compact":
+    bindable_tools = {
+        name: function.model_copy(update={"description": compact_tool_descriptions[name]})
+        for name, function in available_functions.items()
+    }
+else:
+    bindable_tools = available_functions
 
-# ~~~~~~~~~~~~~~~~~~~~~~ AI Prompting Function ~~~~~~~~~~~~~~~~~~~~~~~~~
+@st.cache_resource
+def get_tool_selector():
+    return ToolSelector(bindable_tools, top_k=tool_selection_top_k or len(bindable_tools))
 
-def prompt_ai(messages, nested_calls=0):
-    if nested_calls > 5:
-        raise "AI is tool calling too much!"
+tool_selector = get_tool_selector()
 
-    # First, prompt the AI with the latest user message
-    tools = [tool for _, tool in available_functions.items()]
-    todoist_chatbot = ChatCohere(model="command-r-plus")
-    todoist_chatbot_with_tools = todoist_chatbot.bind_tools(tools)
+# Required parameters of each tool, used to spot malformed tool calls from the fast model
+tool_parameters = {
+    name: {
+        parameter.name for parameter in inspect.signature(function.func).parameters.values()
+        if parameter.default is parameter.empty
+    }
+    for name, function in available_functions.items()
+}
 
-    stream = todoist_chatbot_with_tools.stream(messages)
-    first = True
-    for chunk in stream:
-        if first:
-            gathered = chunk
-            first = False
-        else:
-            gathered = gathered + chunk
 
-        yield chunk
+# ~~~~~~~~~~~~~~~~~~~~ Fast Path for Common Requests ~~~~~~~~~~~~~~~~~~~~~
 
-    has_tool_calls = len(gathered.tool_calls) > 0
+def answer_due_tasks(day="today"):
+    due_date = datetime.now().date()
+    if day.lower() == "tomorrow":
+        due_date += timedelta(days=1)
+    tasks, error = get_tasks_by_due_date.invoke({"due_date": due_date.strftime("%Y-%m-%d")})
+    if not tasks:
+        # Let the AI explain API errors, an empty day is answered directly
+        return f"You have no tasks due {day.lower()}." if error and error.startswith("No tasks") else None
+    lines = "\n".join(f"- {task['content']}" for task in tasks)
+    return f"You have {len(tasks)} task(s) due {day.lower()}:\n{lines}"
 
-    # Second, see if the AI decided it needs to invoke a tool
-    if has_tool_calls:
-        # Add the tool request to the list of messages so the AI knows later it invoked the tool
-        messages.append(gathered)
+def answer_task_digest(view):
+    try:
+        digest = task_digests.get(get_tenant())
+    except Exception:
+        # Let the AI explain API errors
+        return None
+    if view.lower() == "overdue":
+        tasks, label = digest["overdue"], "overdue"
+    else:
+        tasks, label = digest["due_today"] + digest["upcoming"], "due this week"
+    if not tasks:
+        return f"You have no tasks {label}."
+    lines = "\n".join(f"- {task['content']} (due {task['due_date']})" for task in tasks)
+    return f"You have {len(tasks)} task(s) {label}:\n{lines}"
+
+def answer_user_projects():
+    projects = get_user_projects.invoke({})
+    if isinstance(projects, str):
+        return None
+    if not projects:
+        return "You don't have any projects yet."
+    lines = "\n".join(f"- {project['name']}" for project in projects)
+    return f"Here are your projects:\n{lines}"
+
+# Only reads are routed: a write parsed wrong by a pattern ("Complete sign up in Work please")
+# would be applied without the AI ever seeing it, so writes are always left to the AI
+@st.cache_resource
+def get_intent_router():
+    return IntentRouter([
+        Route(
+            "get_tasks_by_due_date",
+            answer_due_tasks,
+            patterns=[
+                r"(?:what(?:'s| is)|what are|show(?: me)?|list|any)(?: my| the)?(?: tasks?)?(?: that are| are)? due (?P<day>today|tomorrow)",
+                r"(?:what do i have|what have i got)(?: due)? (?P<day>today|tomorrow)",
+            ],
+            examples=["what is due today", "what tasks are due today", "my tasks for today", "today's tasks", "what do I need to do today"],
+        ),
+        Route(
+            "get_task_digest",
+            answer_task_digest,
+            patterns=[
+                r"(?:what(?:'s| is)?|which|what are|show(?: me)?|list|any)(?: my| the)?(?: tasks?)?(?: that are| are| is)? (?P<view>overdue)(?: tasks?)?",
+                r"(?:what(?:'s| is)?|which|what are|show(?: me)?|list|any)(?: my| the)?(?: tasks?)?(?: that are| are| is)? due (?P<view>this week)",
+            ],
+        ),
+        Route(
+            "get_user_projects",
+            answer_user_projects,
+            patterns=[r"(?:list|show(?: me)?|what are|get)(?: all)?(?: of)?(?: my)? projects", r"what projects do i have"],
+            examples=["list my projects", "show my projects", "what projects do I have", "which projects do I have"],
+        ),
+    ])
+
+intent_router = get_intent_router()
 
-        # If the AI decided to invoke a tool, invoke it
-        # For each tool the AI wanted to call, call it and add the tool result to the list of messages
-        for tool_call in gathered.tool_calls:
-            tool_name = tool_call["name"].lower()
-            selected_tool = available_functions[tool_name]
-            tool_output = selected_tool.invoke(tool_call["args"])
-            messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))                
 
-        # Call the AI again so it can produce a response with the result of calling the tool(s)
-        additional_stream = prompt_ai(messages, nested_calls + 1)
-        for additional_chunk in additional_stream:
-            yield additional_chunk
+# ~~~~~~~~~~~~~~~~~~~~~~ AI Prompting Function ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def stream_ai(messages, model, tools, budget):
+    from langchain_cohere import ChatCohere
+
+    todoist_chatbot = ChatCohere(model=model, timeout_seconds=budget.timeout(300))
+    todoist_chatbot_with_tools = todoist_chatbot.bind_tools(tools)
+
+    return stream_with_budget(todoist_chatbot_with_tools.stream(messages), budget)
+
+def gather_chunks(chunks):
+    gathered = chunks[0]
+    for chunk in chunks[1:]:
+        gathered = gathered + chunk
+    return gathered
+
+def prompt_ai(messages, budget=None):
+    """
+    Runs one agent turn: prompts the AI, invokes the tools it asks for and prompts it again
+    with their results, until it answers without tool calls. Yields the answer's chunks as
+    they stream in. The turn stops with a partial answer once its deadline or step budget
+    is used up.
+    """
+    budget = budget or TurnBudget(turn_deadline_seconds, max_agent_steps)
+    current_budget.set(budget)
+    try:
+        user_message = next((message.content for message in reversed(messages) if isinstance(message, HumanMessage)), "")
+
+        while budget.take_step():
+            # First, prompt the AI with the latest user message
+            tier = model_cascade.initial_tier(user_message, budget.steps - 1)
+
+            # Bind the tools relevant to the message or to the AI's previous message (which may
+            # have asked a clarifying question), plus those called in this turn or the last one
+            pending_tool_names = []
+            previous_answer = ""
+            user_messages_seen = 0
+            for message in reversed(messages):
+                if isinstance(message, HumanMessage):
+                    user_messages_seen += 1
+                    if user_messages_seen == 2:
+                        break
+                elif isinstance(message, AIMessage):
+                    pending_tool_names.extend(tool_call["name"].lower() for tool_call in message.tool_calls)
+                    if user_messages_seen == 1 and not previous_answer and isinstance(message.content, str):
+                        previous_answer = message.content
+            tools = tool_selector.select(user_message, pending_tool_names, previous_answer)
+
+            gathered = None
+            if tier == FAST:
+                # The fast model's answer is held back until its opening shows it doesn't need
+                # escalating, then streamed. If its tool calls still need escalating after that,
+                # the strong model's answer follows the text already shown.
+                start = time.perf_counter()
+                chunks = []
+                text = ""
+                streamed = False
+                for chunk in stream_ai(messages, model_cascade.model(FAST), tools, budget):
+                    chunks.append(chunk)
+                    if streamed:
+                        yield chunk
+                        continue
+                    text += chunk.content if isinstance(chunk.content, str) else ""
+                    if model_cascade.can_stream(text):
+                        streamed = True
+                        yield from chunks
+                if budget.expired() or not chunks:
+                    break
+                gathered = gather_chunks(chunks)
+                text = gathered.content if isinstance(gathered.content, str) else ""
+                tool_calls = [(tool_call["name"].lower(), tool_call["args"]) for tool_call in gathered.tool_calls]
+                reason = model_cascade.escalation_reason(text, tool_calls, tool_parameters, check_text=not streamed)
+                model_cascade.record(FAST, time.perf_counter() - start, reason)
+                if reason is None:
+                    if not streamed:
+                        yield from chunks
+                elif budget.expired():
+                    # No time left to escalate, and the fast answer's tool calls aren't safe to run
+                    break
+                else:
+                    tier = STRONG
+
+            if tier == STRONG:
+                start = time.perf_counter()
+                chunks = []
+                for chunk in stream_ai(messages, model_cascade.model(STRONG), tools, budget):
+                    chunks.append(chunk)
+                    yield chunk
+                if budget.expired() or not chunks:
+                    break
+                gathered = gather_chunks(chunks)
+                model_cascade.record(STRONG, time.perf_counter() - start)
+
+            # Second, see if the AI decided it needs to invoke a tool
+            if not gathered.tool_calls:
+                return
+
+            # Add the tool request to the list of messages so the AI knows later it invoked the tool
+            messages.append(gathered)
+
+            # For each tool the AI wanted to call, call it and add the tool result to the list of messages.
+            # Once the turn runs out of time the remaining calls are answered as cancelled, so the
+            # history stays valid for the next turn.
+            for tool_call in gathered.tool_calls:
+                if budget.expired():
+                    tool_output = "Cancelled: the turn ran out of time before this tool was called."
+                else:
+                    tool_name = tool_call["name"].lower()
+                    selected_tool = available_functions[tool_name]
+                    tool_output = selected_tool.invoke(tool_call["args"])
+                # Structured outputs are sent to the model as compact JSON
+                if not isinstance(tool_output, str):
+                    tool_output = fast_json.dumps_str(tool_output)
+                messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))
+
+        # Out of time or steps: end the turn with what we have instead of hanging
+        yield f"\n\n_{PARTIAL_ANSWER}_"
+    finally:
+        current_budget.set(None)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~ Workspace Prefetch ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def prefetch_workspace():
+    """
+    Fetches the user's projects and task digest, which the first turn nearly always
+    needs, so the first tool call finds them in the tenant cache.
+    """
+    start = time.perf_counter()
+    tenant = get_tenant()
+    try:
+        get_projects()
+        task_digests.get(tenant)
+        tenant.cache.pop("prefetch_error", None)
+    except Exception as e:
+        # The tools fetch what they need themselves; the failure is kept for the sidebar
+        logger.warning("Workspace prefetch failed", exc_info=True)
+        tenant.cache["prefetch_error"] = str(e)
+    tenant.cache["prefetch_seconds"] = time.perf_counter() - start
+
+def start_workspace_prefetch():
+    # Runs in the session's context, so the prefetch is for the session's own token
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(prefetch_workspace,), name="workspace-prefetch", daemon=True).start()
 
 
 # ~~~~~~~~~~~~~~~~~~ Main Function with UI Creation ~~~~~~~~~~~~~~~~~~~~
@@ -541,36 +1086,140 @@ When a user asks to create a task and you don't know the project to add it to fo
 The current date is: {datetime.now().date()}
 """
 
+def add_message(message):
+    """
+    Appends a message to the chat history and, for the message types shown in the chat,
+    its display-ready (type, content) record, so reruns never re-serialize the history.
+    """
+    st.session_state.messages.append(message)
+    if message.type in ["human", "ai", "system"]:
+        st.session_state.rendered_messages.append((message.type, message.content))
+
+def trim_history():
+    """
+    Bounds the session's history so long-lived sessions don't grow without limit. The
+    model's context keeps the system message and the latest messages from a user
+    message onwards, so no tool result is kept without the AI call that asked for it.
+    """
+    messages = st.session_state.messages
+    if len(messages) > max_context_messages + 1:
+        cut = len(messages) - max_context_messages
+        while cut < len(messages) and not isinstance(messages[cut], HumanMessage):
+            cut += 1
+        del messages[1:cut]
+    del st.session_state.rendered_messages[:-max_rendered_messages]
+
+def render_history():
+    # Only the most recent pages are rendered, so reruns cost the same however long the chat is
+    rendered_messages = st.session_state.rendered_messages
+    visible = history_page_size * st.session_state.history_pages
+    if len(rendered_messages) > visible:
+        if st.button(f"Show earlier messages ({len(rendered_messages) - visible} hidden)"):
+            st.session_state.history_pages += 1
+            st.rerun()
+
+    for message_type, content in rendered_messages[-visible:]:
+        with st.chat_message(message_type):
+            st.markdown(content)
+
 def main():
     st.title("Todoist Chatbot")
 
+    if rag_warmup:
+        start_rag_warmup()
+
+    # Tools run against the Todoist account of the token entered for this session
+    todoist_token = st.sidebar.text_input("Todoist API token", type="password", key="todoist_token")
+    current_tenant_token.set(todoist_token or None)
+
+    # Start fetching the workspace as soon as the session starts (or its token changes),
+    # while the user is still typing the first message
+    if workspace_prefetch and st.session_state.get("prefetched_token") != todoist_token:
+        st.session_state.prefetched_token = todoist_token
+        start_workspace_prefetch()
+
     # Initialize chat history
     if "messages" not in st.session_state:
-        st.session_state.messages = [
-            SystemMessage(content=system_message)
-        ]    
+        st.session_state.messages = []
+        st.session_state.rendered_messages = []
+        st.session_state.history_pages = 1
+        add_message(SystemMessage(content=system_message))
 
     # Display chat messages from history on app rerun
-    for message in st.session_state.messages:
-        message_json = json.loads(message.model_dump_json())
-        message_type = message_json["type"]
-        if message_type in ["human", "ai", "system"]:
-            with st.chat_message(message_type):
-                st.markdown(message_json["content"])        
+    render_history()
 
     # React to user input
     if prompt := st.chat_input("What would you like to do today?"):
+        # A message sent while the previous turn is still running supersedes it. Streamlit
+        # only stops the old run at its next UI call, so its LLM and Todoist calls are
+        # cancelled through its budget
+        superseded_budget = st.session_state.get("turn_budget")
+        if superseded_budget is not None:
+            superseded_budget.cancel()
+
+        # Tell the AI (and the user) how the writes queued in earlier turns went
+        if job_queue is not None:
+            finished_jobs = job_queue.take_finished(job_owner())
+            if finished_jobs:
+                note = describe_finished_jobs(finished_jobs)
+                st.chat_message("system").markdown(note)
+                add_message(SystemMessage(content=note))
+
         # Display user message in chat message container
         st.chat_message("user").markdown(prompt)
         # Add user message to chat history
-        st.session_state.messages.append(HumanMessage(content=prompt))
+        add_message(HumanMessage(content=prompt))
 
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
-            stream = prompt_ai(st.session_state.messages)
-            response = st.write_stream(stream)
+            # Formulaic requests are answered straight from the tools, the rest goes to the AI
+            response = intent_router.route(prompt)
+            if response is not None:
+                st.markdown(response)
+            else:
+                start = time.perf_counter()
+                budget = st.session_state.turn_budget = TurnBudget(turn_deadline_seconds, max_agent_steps)
+                stream = prompt_ai(st.session_state.messages, budget)
+                response = st.write_stream(stream)
+                st.session_state.turn_budget = None
+                intent_router.record_llm_latency(time.perf_counter() - start)
         
-        st.session_state.messages.append(AIMessage(content=response))
+        add_message(AIMessage(content=response))
+        trim_history()
+
+    router_stats = intent_router.stats()
+    st.sidebar.caption(
+        f"Fast path: {router_stats['hit_rate']:.0%} of turns, "
+        f"~{router_stats['estimated_seconds_saved']:.1f}s saved"
+    )
+    cascade_stats = model_cascade.stats()
+    st.sidebar.caption(
+        f"Model cascade: {cascade_stats['escalation_rate']:.0%} escalated, "
+        + ", ".join(f"{tier['model']} {tier['median_seconds']}s median" for tier in cascade_stats["tiers"].values())
+    )
+    digest_stats = task_digests.stats()
+    st.sidebar.caption(
+        f"Task digests: {digest_stats['refreshes']['background']} background / "
+        f"{digest_stats['refreshes']['on_read']} on-read refreshes, {digest_stats['average_refresh_seconds']}s each"
+    )
+    prefetched_tenant = todoist_client_pool.peek(todoist_token or todoist_api_key)
+    if workspace_prefetch and prefetched_tenant is not None and "prefetch_seconds" in prefetched_tenant.cache:
+        prefetch_error = prefetched_tenant.cache.get("prefetch_error")
+        st.sidebar.caption(
+            f"Workspace prefetch failed: {prefetch_error}" if prefetch_error
+            else f"Workspace prefetched in {prefetched_tenant.cache['prefetch_seconds']:.2f}s"
+        )
+    if job_queue is not None:
+        job_stats = job_queue.stats()
+        st.sidebar.caption(
+            f"Background writes: {job_stats['queued'] + job_stats['running']} pending, "
+            f"{job_stats['succeeded']} done, {job_stats['failed']} failed"
+        )
+    selector_stats = tool_selector.stats()
+    st.sidebar.caption(
+        f"Tools bound: {selector_stats['average_tools_bound']}/{selector_stats['total_tools']} per call, "
+        f"~{selector_stats['average_tokens_saved']:.0f} prompt tokens saved ({selector_stats['mode']})"
+    )
 
 
 if __name__ == "__main__":
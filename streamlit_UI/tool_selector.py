@@ -0,0 +1,155 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~ Tool Selection ~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Binding every tool to every call sends all their schemas and docstrings with
+# each request. The selector binds only the top-k tools relevant to the current
+# user message, plus any tool the AI already called in this turn or the last one.
+# Replies to a clarifying question ("Yes, the one in Work") say little about the tool
+# they are for, so tools are also ranked by the AI's previous message.
+# Tools are ranked by keyword overlap, or by cosine similarity of embeddings once
+# warm_up has embedded the tool descriptions. Ranking by embeddings costs one
+# embed_query per ranked text (a few ms on CPU for a short message); the vectors of
+# the last few texts are kept in memory, since every step of a turn ranks the same
+# message and context again.
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower().replace("_", " "))
+
+
+def estimate_tokens(tool):
+    """Rough token count of a tool's schema as sent to the model (~4 characters per token)."""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    return len(json.dumps(convert_to_openai_tool(tool))) // 4
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ToolSelector:
+    """
+    Example call:
+
+    selector = ToolSelector(available_functions, top_k=5)
+    selector.select("What's due today?")  # -> [get_tasks_by_due_date, ...]
+    """
+
+    def __init__(self, tools, top_k=5, query_cache_size=32):
+        self.tools = tools
+        self.top_k = top_k
+        self.query_cache_size = query_cache_size
+        self.calls = 0
+        self.tools_bound = 0
+        self.tokens_saved = 0
+        self.select_seconds = 0.0
+        self._embedding_function = None
+        self._description_vectors = None
+        self._query_vectors = OrderedDict()
+        self._warm_up_started = False
+        self._lock = threading.Lock()
+
+        self._documents = {
+            name: Counter(tokenize(name) * 2 + tokenize(tool.description))
+            for name, tool in tools.items()
+        }
+        document_frequency = Counter(token for document in self._documents.values() for token in document)
+        self._idf = {
+            token: math.log(1 + len(tools) / frequency) for token, frequency in document_frequency.items()
+        }
+        self._tokens = {name: estimate_tokens(tool) for name, tool in tools.items()}
+
+    def warm_up(self, get_embedding_function):
+        """
+        Embeds the tool descriptions once, in a daemon thread, so it never delays a turn.
+        Only the first call starts a thread.
+        """
+        with self._lock:
+            if self._warm_up_started:
+                return
+            self._warm_up_started = True
+
+        def embed_descriptions():
+            embedding_function = get_embedding_function()
+            names = list(self.tools)
+            vectors = embedding_function.embed_documents([f"{name}: {self.tools[name].description}" for name in names])
+            with self._lock:
+                self._embedding_function = embedding_function
+                self._description_vectors = dict(zip(names, vectors))
+
+        threading.Thread(target=embed_descriptions, name="tool-selector-warmup", daemon=True).start()
+
+    def scores(self, text):
+        with self._lock:
+            embedding_function, description_vectors = self._embedding_function, self._description_vectors
+        if description_vectors is not None:
+            query_vector = self._embed_query(embedding_function, text)
+            return {name: cosine(query_vector, vector) for name, vector in description_vectors.items()}
+
+        tokens = set(tokenize(text))
+        return {
+            name: sum(self._idf[token] * count for token, count in document.items() if token in tokens)
+            for name, document in self._documents.items()
+        }
+
+    def _embed_query(self, embedding_function, text):
+        with self._lock:
+            query_vector = self._query_vectors.get(text)
+            if query_vector is not None:
+                self._query_vectors.move_to_end(text)
+                return query_vector
+        query_vector = embedding_function.embed_query(text)
+        with self._lock:
+            self._query_vectors[text] = query_vector
+            while len(self._query_vectors) > self.query_cache_size:
+                self._query_vectors.popitem(last=False)
+        return query_vector
+
+    def select(self, text, pending_tool_names=(), context=""):
+        """
+        Returns the tools to bind for this call: the top-k for the message (or for the
+        context, the AI's previous message, whichever ranks a tool higher) plus any tools
+        already called in the current or previous turn, in their original order.
+        """
+        start = time.perf_counter()
+        scores = self.scores(text)
+        if context:
+            context_scores = self.scores(context)
+            scores = {name: max(score, context_scores[name]) for name, score in scores.items()}
+        ranked = sorted(scores, key=lambda name: -scores[name])
+        selected = set(ranked[:self.top_k]) | {name for name in pending_tool_names if name in self.tools}
+        tools = [tool for name, tool in self.tools.items() if name in selected]
+
+        with self._lock:
+            self.calls += 1
+            self.tools_bound += len(tools)
+            self.tokens_saved += sum(tokens for name, tokens in self._tokens.items() if name not in selected)
+            self.select_seconds += time.perf_counter() - start
+        return tools
+
+    def stats(self):
+        """
+        Returns:
+            dict: Average tools bound and prompt tokens saved per call, and the selection overhead.
+        """
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                "calls": self.calls,
+                "mode": "embedding" if self._description_vectors is not None else "keyword",
+                "average_tools_bound": round(self.tools_bound / calls, 2),
+                "total_tools": len(self.tools),
+                "average_tokens_saved": round(self.tokens_saved / calls, 1),
+                "average_select_ms": round(self.select_seconds / calls * 1000, 3),
+            }
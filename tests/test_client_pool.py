@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from agent_common.client_pool import TenantClientPool
+
+
+@pytest.fixture
+def asana_pool():
+    # A pool of real asana SDK clients, built and closed the way the backend does it
+    agent = pytest.importorskip("agent_cohere")
+    pytest.importorskip("asana")
+
+    def make(**kwargs):
+        return TenantClientPool(agent.create_tasks_api, close=agent.close_tasks_api, **kwargs)
+
+    return make
+
+
+def test_idle_asana_tenants_are_evicted_and_closed(asana_pool):
+    pool = asana_pool(idle_seconds=0)
+    first = pool.get("token-a")
+    time.sleep(0.01)
+
+    # Getting the second tenant evicts the idle first one and closes its client
+    second = pool.get("token-b")
+    assert second is not first
+    assert pool.stats()["evicted"] == 1
+    assert len(pool.tenants()) == 1
+
+
+def test_least_recently_used_asana_tenant_is_evicted(asana_pool):
+    pool = asana_pool(max_tenants=1)
+    pool.get("token-a")
+    pool.get("token-b")
+    assert [tenant.client.api_client.configuration.access_token for tenant in pool.tenants()] == ["token-b"]
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pypdf = pytest.importorskip("pypdf")
+from document_extraction import MANIFEST_FILE, extract_documents
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def write_pdf(path, pages):
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as file:
+        writer.write(file)
+
+
+@pytest.fixture
+def notes(tmp_path):
+    directory = str(tmp_path / "notes")
+    write(os.path.join(directory, "2024-07-20.txt"), "Standup notes")
+    return directory, str(tmp_path / "cache")
+
+
+def test_single_page_pdfs_have_the_same_metadata_from_the_cache(notes):
+    directory, cache = notes
+    write_pdf(os.path.join(directory, "2024-07-18.pdf"), 1)
+    cold, cold_stats = extract_documents(directory, cache, workers=1)
+    warm, warm_stats = extract_documents(directory, cache, workers=1)
+    assert warm_stats["cached_files"] == 2 and cold_stats["cached_files"] == 0
+    assert [document.metadata for document in warm] == [document.metadata for document in cold]
+    assert cold[0].metadata == {"source": os.path.join(directory, "2024-07-18.pdf"), "page": 0}
+    assert "page" not in cold[1].metadata
+
+
+def test_hidden_files_and_directories_are_skipped(notes):
+    directory, cache = notes
+    write(os.path.join(directory, ".DS_Store"), "binary junk")
+    write(os.path.join(directory, ".git", "HEAD"), "ref: refs/heads/main")
+    write(os.path.join(directory, "archive", ".2024-07-20.txt.swp"), "swap")
+    documents, stats = extract_documents(directory, cache, workers=1)
+    assert stats["files"] == 1
+    assert [os.path.basename(document.metadata["source"]) for document in documents] == ["2024-07-20.txt"]
+
+
+def test_deleted_files_are_purged_from_the_cache(notes):
+    directory, cache = notes
+    deleted = os.path.join(directory, "2024-07-21.txt")
+    write(deleted, "Retro notes")
+    extract_documents(directory, cache, workers=1)
+    assert len(os.listdir(cache)) == 3
+
+    os.remove(deleted)
+    documents, _ = extract_documents(directory, cache, workers=1)
+    assert len(documents) == 1
+    # The manifest and the text of the remaining note
+    assert len(os.listdir(cache)) == 2
+    assert MANIFEST_FILE in os.listdir(cache)
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from embedding_cache import INDEX_FILE, CachedEmbeddings, model_directory
+
+
+class CountingEmbeddings:
+    """Embeds a text as [len(text), number of the call], so recomputed vectors differ."""
+
+    def __init__(self):
+        self.calls = 0
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts.extend(texts)
+        return [[float(len(text)), float(self.calls)] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make(directory, model="test-model", **kwargs):
+    return CachedEmbeddings(CountingEmbeddings(), model, str(directory), **kwargs)
+
+
+def test_documents_are_embedded_once_across_runs(tmp_path):
+    first = make(tmp_path)
+    vectors = first.embed_documents(["a", "bb", "a"])
+    assert first.embeddings.texts == ["a", "bb"]
+
+    second = make(tmp_path)
+    assert second.embed_documents(["bb", "a"]) == [vectors[1], vectors[0]]
+    assert second.embeddings.calls == 0
+    assert second.stats()["hits"] == 2
+
+
+def test_concurrent_writers_never_share_a_slot(tmp_path):
+    # Two processes opened the cache before either wrote to it
+    loader, agent = make(tmp_path), make(tmp_path)
+    loader_vectors = loader.embed_documents(["one", "two"])
+    agent_vectors = agent.embed_documents(["three", "four4"])
+
+    reader = make(tmp_path)
+    assert reader.embed_documents(["one", "two", "three", "four4"]) == loader_vectors + agent_vectors
+    assert reader.embeddings.calls == 0
+    assert sorted(reader._slots.values()) == [0, 1, 2, 3]
+
+
+def test_a_slot_reused_by_another_process_is_not_read(tmp_path):
+    first, second = make(tmp_path, max_entries=2), make(tmp_path, max_entries=2)
+    first.embed_documents(["a", "b"])
+    # Evicts "a", the least recently used entry, and reuses its slot
+    second.embed_documents(["ccc"])
+
+    assert first.embed_documents(["ccc"]) == [[3.0, 1.0]]
+    assert first.embeddings.calls == 1
+    first.embed_documents(["a"])
+    assert first.embeddings.calls == 2
+
+
+def test_queries_are_flushed_after_enough_entries(tmp_path):
+    cache = make(tmp_path, flush_entries=3, flush_seconds=3600)
+    cache.embed_query("q1")
+    cache.embed_query("q2")
+    assert not os.path.exists(os.path.join(cache.cache_directory, INDEX_FILE))
+    # Pending queries are still served from memory
+    assert cache.embed_query("q1") == [2.0, 1.0]
+
+    cache.embed_query("q3")
+    assert len(make(tmp_path)._slots) == 3
+
+
+def test_queries_are_flushed_after_a_while(tmp_path):
+    cache = make(tmp_path, flush_entries=100, flush_seconds=0)
+    cache.embed_query("q1")
+    assert len(make(tmp_path)._slots) == 1
+
+
+def test_each_model_has_its_own_cache(tmp_path):
+    small = make(tmp_path, model="all-MiniLM-L6-v2")
+    large = make(tmp_path, model="sentence-transformers/all-mpnet-base-v2")
+    small.embed_documents(["a"])
+    large.embed_documents(["a"])
+    assert large.embeddings.calls == 1
+    assert small.cache_directory != large.cache_directory
+    assert os.path.dirname(model_directory(str(tmp_path), "org/model")) == str(tmp_path)
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fuzzy_index import FuzzyIndex
+
+
+def index_of(*texts):
+    index = FuzzyIndex()
+    index.rebuild((str(number), text) for number, text in enumerate(texts))
+    return index
+
+
+def test_exact_match_after_normalization_resolves():
+    assert index_of("Buy Milk", "Call mom").resolve("  buy milk! ")[0] == "0"
+
+
+def test_paraphrase_resolves_for_reads_only():
+    index = index_of("Buy Milk", "Call mom")
+    assert index.resolve("buy milk please")[0] == "0"
+    key, candidates = index.resolve("buy milk please", exact=True)
+    assert key is None
+    assert [text for _, _, text in candidates] == ["Buy Milk"]
+
+
+@pytest.mark.parametrize("query, existing", [
+    ("Work 2024", "Work 2023"),
+    ("Marketing Q4", "Marketing Q3"),
+    ("Groceries 2", "Groceries"),
+])
+def test_names_differing_in_a_number_are_never_resolved(query, existing):
+    key, candidates = index_of(existing, "Personal").resolve(query)
+    assert key is None
+    assert candidates[0][2] == existing
+
+
+def test_longer_query_is_confirmed_before_a_write():
+    index = index_of("Buy milk", "Call mom")
+    assert index.resolve("Buy milk and eggs", exact=True)[0] is None
+
+
+def test_scores_below_the_threshold_are_not_candidates():
+    assert index_of("Quarterly planning").resolve("Buy milk") == (None, [])
+
+
+def test_close_candidates_are_ambiguous():
+    key, candidates = index_of("Team meeting notes", "Team meeting prep").resolve("team meeting")
+    assert key is None
+    assert len(candidates) == 2
+
+
+def test_duplicate_exact_names_are_ambiguous():
+    key, candidates = index_of("Work", "work").resolve("Work")
+    assert key is None
+    assert len(candidates) == 2
+
+
+def test_rebuild_replaces_the_index():
+    index = index_of("Old project")
+    index.rebuild([("9", "New project")])
+    assert len(index) == 1
+    assert "0" not in index
+    assert index.resolve("new project")[0] == "9"
+
+
+class StubTodoist:
+    def __init__(self, names):
+        self.names = names
+        self.fetches = 0
+
+    def get_projects(self):
+        self.fetches += 1
+        return [SimpleNamespace(id=str(number), name=name) for number, name in enumerate(self.names)]
+
+
+def test_find_project_refreshes_before_settling_for_a_near_match(monkeypatch):
+    agent = pytest.importorskip("task_management_agent")
+    stub = StubTodoist(["Work 2023"])
+    monkeypatch.setattr(agent.todoist_client_pool, "factory", lambda token, rate_limiter: stub)
+    token = agent.current_tenant_token.set("test-find-project")
+    try:
+        assert agent.find_project("Work 2023", exact=True) == ("0", None)
+        fetches = stub.fetches
+
+        # "Work 2024" was created outside the app since the index was built
+        stub.names.append("Work 2024")
+        assert agent.find_project("Work 2024", exact=True) == ("1", None)
+        assert stub.fetches == fetches + 1
+
+        project_id, error = agent.find_project("Work 2025", exact=True)
+        assert project_id is None
+        assert "Ask the user to confirm" in error
+    finally:
+        agent.current_tenant_token.reset(token)
@@ -0,0 +1,86 @@
+import pytest
+
+from agent_common.intent_router import IntentRouter, Route
+
+
+def echo_router():
+    return IntentRouter([
+        Route("due", lambda day: f"due {day}", patterns=[r"what(?:'s| is) due (?P<day>today|tomorrow)"]),
+        Route("projects", lambda: "projects", examples=["list my projects", "what projects do I have"]),
+    ])
+
+
+@pytest.mark.parametrize("text, answer", [
+    ("What's due today?", "due today"),
+    ("what is due tomorrow", "due tomorrow"),
+    ("List my projects", "projects"),
+    ("list all of my projects", "projects"),
+])
+def test_formulaic_reads_are_routed(text, answer):
+    assert echo_router().route(text) == answer
+
+
+@pytest.mark.parametrize("text", [
+    "What's due today but only in Work?",
+    "What's due tomorrow if anything",
+    "List my projects then archive the old ones",
+    "list my projects unless there are more than ten",
+    "What's due today for the marketing team",
+    "don't list my projects",
+])
+def test_qualified_messages_go_to_the_llm(text):
+    router = echo_router()
+    assert router.route(text) is None
+    assert router.stats()["fallbacks"] == 1
+
+
+@pytest.fixture(scope="module")
+def backend_router():
+    return pytest.importorskip("agent_cohere").intent_router
+
+
+@pytest.mark.parametrize("text", [
+    "Create a task called Review soak results due tomorrow",
+    "Create a task Send invoices due 2024-07-30",
+    "Add task Buy milk in project Groceries",
+    "New task: Call mom with a reminder at 5",
+    "Make a task called Pay rent if it isn't already there",
+    "Add a task Book venue but not before Friday",
+])
+def test_backend_never_routes_writes(backend_router, text):
+    assert backend_router.match(text) == (None, None)
+
+
+@pytest.mark.parametrize("text, view", [
+    ("Which tasks are overdue?", "overdue"),
+    ("What's due this week", "this week"),
+    ("What is due today", "today"),
+])
+def test_backend_routes_digest_reads(backend_router, text, view):
+    route, arguments = backend_router.match(text)
+    assert route.name == "get_task_digest"
+    assert arguments == {"view": view}
+
+
+@pytest.fixture(scope="module")
+def streamlit_router():
+    return pytest.importorskip("task_management_agent").intent_router
+
+
+@pytest.mark.parametrize("text", [
+    "Complete sign up in Work please",
+    "Mark the task Buy milk in Groceries as done",
+    "Finish report in Work but only the draft",
+    "What's due today in project Work",
+])
+def test_streamlit_never_routes_writes_or_qualified_reads(streamlit_router, text):
+    assert streamlit_router.match(text) == (None, None)
+
+
+@pytest.mark.parametrize("text, name", [
+    ("What's due tomorrow?", "get_tasks_by_due_date"),
+    ("What is overdue", "get_task_digest"),
+    ("List my projects", "get_user_projects"),
+])
+def test_streamlit_routes_reads(streamlit_router, text, name):
+    assert streamlit_router.match(text)[0].name == name
@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from agent_common.client_pool import RateLimitExceeded, current_tenant_token
+from agent_common.job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+
+class ApiError(Exception):
+    # Shaped like Asana's ApiException: the HTTP status is in `status`
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def connection_refused():
+    # A real requests error for a connection that was never established
+    try:
+        requests.get("http://127.0.0.1:9", timeout=2)
+    except requests.ConnectionError as e:
+        return e
+    pytest.skip("port 9 accepts connections")
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def failing(*errors):
+    """A handler raising the given errors on its first calls, then succeeding."""
+    calls = []
+
+    def handler(**kwargs):
+        calls.append(kwargs)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return {"ok": True}
+
+    handler.calls = calls
+    return handler
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(handlers, **kwargs):
+        kwargs.setdefault("retry_seconds", 0.01)
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), handlers, **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop(timeout=5)
+
+
+def run_job(queue, name):
+    job_id = queue.enqueue(name, {}, name, owner="session-1")
+    assert wait_for(lambda: queue.get(job_id)["status"] in (SUCCEEDED, FAILED))
+    return queue.get(job_id)
+
+
+@pytest.mark.parametrize("error", [ApiError(429), RateLimitExceeded("rate limited"), "connection refused"])
+def test_errors_raised_before_sending_are_retried(make_queue, error):
+    handler = failing(connection_refused() if error == "connection refused" else error)
+    job = run_job(make_queue({"add_task": handler}), "add_task")
+    assert job["status"] == SUCCEEDED
+    assert job["attempts"] == 2
+    assert len(handler.calls) == 2
+
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout("read timed out"), ApiError(502)])
+def test_ambiguous_errors_fail_writes_that_are_not_idempotent(make_queue, error):
+    handler = failing(error)
+    job = run_job(make_queue({"add_task": handler}), "add_task")
+    assert job["status"] == FAILED
+    assert job["error"].startswith("Unknown outcome")
+    assert len(handler.calls) == 1
+
+
+def test_ambiguous_errors_retry_idempotent_writes(make_queue):
+    handler = failing(requests.ReadTimeout("read timed out"), ApiError(503))
+    job = run_job(make_queue({"close_task": handler}, idempotent={"close_task"}), "close_task")
+    assert job["status"] == SUCCEEDED
+    assert len(handler.calls) == 3
+
+
+def test_client_errors_are_not_retried(make_queue):
+    handler = failing(ApiError(400))
+    job = run_job(make_queue({"close_task": handler}, idempotent={"close_task"}), "close_task")
+    assert job["status"] == FAILED
+    assert job["error"] == "HTTP 400"
+    assert len(handler.calls) == 1
+
+
+def test_retries_stop_after_max_attempts(make_queue):
+    handler = failing(*[ApiError(429)] * 5)
+    job = run_job(make_queue({"add_task": handler}, max_attempts=3), "add_task")
+    assert job["status"] == FAILED
+    assert job["attempts"] == 3
+
+
+def test_interrupted_jobs_rerun_only_when_idempotent(make_queue):
+    add_task, close_task = failing(), failing()
+    handlers = {"add_task": add_task, "close_task": close_task}
+
+    # A process claims both jobs and dies without finishing them
+    crashed = make_queue(handlers, workers=0, lease_seconds=0.1)
+    add_id = crashed.enqueue("add_task", {}, "add", owner="session-1")
+    close_id = crashed.enqueue("close_task", {}, "close", owner="session-1")
+    crashed._claim()
+    crashed._claim()
+    crashed.stop()
+    assert crashed.get(add_id)["status"] == RUNNING
+
+    time.sleep(0.2)
+    restarted = make_queue(handlers, idempotent={"close_task"}, lease_seconds=0.1)
+    restarted.start()
+    assert wait_for(lambda: restarted.get(close_id)["status"] == SUCCEEDED)
+    assert wait_for(lambda: restarted.get(add_id)["status"] == FAILED)
+    assert restarted.get(add_id)["error"].startswith("Unknown outcome")
+    assert len(add_task.calls) == 0
+    assert len(close_task.calls) == 1
+
+
+def test_a_second_queue_leaves_leased_jobs_alone(make_queue):
+    release = threading.Event()
+    calls = []
+
+    def add_task():
+        calls.append(1)
+        release.wait(5)
+        return {"ok": True}
+
+    first = make_queue({"add_task": add_task}, lease_seconds=0.15)
+    job_id = first.enqueue("add_task", {}, "add", owner="session-1")
+    assert wait_for(lambda: first.get(job_id)["status"] == RUNNING)
+
+    # Another instance on the same database (a Streamlit rerun, a second process)
+    second = make_queue({"add_task": add_task}, lease_seconds=0.15)
+    second.start()
+    time.sleep(0.5)
+    assert first.get(job_id)["status"] == RUNNING
+    release.set()
+    assert wait_for(lambda: first.get(job_id)["status"] == SUCCEEDED)
+    assert len(calls) == 1
+
+
+def test_tokens_are_dropped_once_their_jobs_are_done(make_queue):
+    tokens = []
+    queue = make_queue({"add_task": lambda: tokens.append(current_tenant_token.get())})
+    token = current_tenant_token.set("user-token")
+    try:
+        job = run_job(queue, "add_task")
+    finally:
+        current_tenant_token.reset(token)
+    assert job["status"] == SUCCEEDED
+    assert tokens == ["user-token"]
+    assert queue.stats()["tokens_held"] == 0
+
+
+def test_finished_jobs_are_reported_once(make_queue):
+    queue = make_queue({"add_task": failing()})
+    job = run_job(queue, "add_task")
+    assert [reported["id"] for reported in queue.take_finished("session-1")] == [job["id"]]
+    assert queue.take_finished("session-1") == []
+    assert queue.get(job["id"])["status"] != QUEUED
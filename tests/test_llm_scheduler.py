@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerSaturated
+
+
+def hold_all_slots(scheduler):
+    for _ in range(scheduler.max_concurrency):
+        scheduler.acquire("holder")
+
+
+def acquire_in_thread(scheduler, *args, **kwargs):
+    result = {}
+
+    def run():
+        try:
+            scheduler.acquire(*args, **kwargs)
+            result["granted_at"] = time.perf_counter()
+        except SchedulerSaturated as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_first_calls_are_shed_when_the_queue_is_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0)
+    hold_all_slots(scheduler)
+    with pytest.raises(SchedulerSaturated) as error:
+        scheduler.acquire("user-1")
+    assert error.value.status_code == 503
+
+
+def test_calls_after_a_tool_ran_wait_instead_of_being_shed():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0, max_wait_seconds=0.05)
+    hold_all_slots(scheduler)
+    thread, result = acquire_in_thread(scheduler, "user-1", shed=False)
+    time.sleep(0.2)
+    assert result == {}
+    scheduler.release(0.1)
+    thread.join(2)
+    assert "granted_at" in result
+
+
+def test_calls_after_a_tool_ran_give_up_at_their_timeout():
+    scheduler = LLMScheduler(max_concurrency=1)
+    hold_all_slots(scheduler)
+    with pytest.raises(SchedulerSaturated):
+        scheduler.acquire("user-1", shed=False, timeout=0.05)
+    assert scheduler.stats()["queue_depth"] == {INTERACTIVE: 0, BATCH: 0}
+
+
+def test_interactive_calls_go_first_until_a_batch_call_has_aged():
+    scheduler = LLMScheduler(max_concurrency=1, batch_aging_seconds=0.2)
+    hold_all_slots(scheduler)
+    batch, batch_result = acquire_in_thread(scheduler, "batch-user", BATCH)
+    time.sleep(0.05)
+    interactive, interactive_result = acquire_in_thread(scheduler, "user-1", INTERACTIVE)
+    time.sleep(0.05)
+
+    # Not aged yet: the interactive call is served first
+    scheduler.release(0.1)
+    interactive.join(2)
+    assert "granted_at" in interactive_result and batch_result == {}
+
+    later, later_result = acquire_in_thread(scheduler, "user-2", INTERACTIVE)
+    time.sleep(0.25)
+    scheduler.release(0.1)
+    batch.join(2)
+    assert "granted_at" in batch_result and later_result == {}
+    assert scheduler.stats()["aged_batch_grants"] == 1
+    scheduler.release(0.1)
+    later.join(2)
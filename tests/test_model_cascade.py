@@ -0,0 +1,28 @@
+from agent_common.model_cascade import FAST, STRONG, ModelCascade
+
+TOOLS = {"create_task": {"task_name"}}
+
+
+def cascade(**kwargs):
+    return ModelCascade("fast-model", "strong-model", **kwargs)
+
+
+def test_multi_step_turns_go_to_the_strong_model():
+    assert cascade().initial_tier("What's due today?") == FAST
+    assert cascade().initial_tier("Add the notes and then email them") == STRONG
+    assert cascade(enabled=False).initial_tier("What's due today?") == STRONG
+
+
+def test_answers_are_streamed_once_their_opening_is_sure_of_itself():
+    model_cascade = cascade(stream_after_characters=20)
+    assert not model_cascade.can_stream("You have three")
+    assert model_cascade.can_stream("You have three tasks due today:")
+    assert not model_cascade.can_stream("I'm not sure which project you mean, could you")
+
+
+def test_streamed_answers_are_only_escalated_for_their_tool_calls():
+    model_cascade = cascade()
+    assert model_cascade.escalation_reason("It is unclear", [], TOOLS) == "low_confidence"
+    assert model_cascade.escalation_reason("It is unclear", [], TOOLS, check_text=False) is None
+    assert model_cascade.escalation_reason("", [("create_task", {})], TOOLS, check_text=False) == "malformed_arguments"
+    assert model_cascade.escalation_reason("", [("delete_all", {})], TOOLS) == "unknown_tool"
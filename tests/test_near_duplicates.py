@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.documents import Document
+
+from near_duplicates import deduplicate
+
+ACTION_ITEMS = (
+    "Review of previous action items. Tina Nguyen reported the stress test for the Space Rangers "
+    "servers is scheduled for Monday. Sam Patel provided updates on the marketing campaign rollout, "
+    "with teaser trailers receiving positive engagement. Emily Carter confirmed the retreat is booked."
+)
+
+
+def note(source, text=ACTION_ITEMS):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_duplicates_are_folded_into_the_newest_chunk():
+    documents = [
+        note("meeting_notes/2024-07-20.txt"),
+        note("meeting_notes/2024-07-22.txt", ACTION_ITEMS.replace("Monday", "Monday at 9")),
+        note("meeting_notes/2024-07-21.txt"),
+    ]
+    canonical, stats = deduplicate(documents)
+    assert stats["duplicates_removed"] == 2
+    [kept] = canonical
+    assert "Monday at 9" in kept.page_content
+    assert kept.metadata["source"] == "meeting_notes/2024-07-22.txt"
+    assert kept.metadata["ref_count"] == 3
+    assert kept.metadata["first_date"] == "2024-07-20"
+    assert kept.metadata["last_date"] == "2024-07-22"
+    assert kept.metadata["sources"].split("; ") == [
+        "meeting_notes/2024-07-20.txt", "meeting_notes/2024-07-22.txt", "meeting_notes/2024-07-21.txt",
+    ]
+
+
+def test_undated_duplicates_keep_the_last_ingested():
+    canonical, _ = deduplicate([note("a.txt"), note("b.txt")])
+    assert [document.metadata["source"] for document in canonical] == ["b.txt"]
+    assert "first_date" not in canonical[0].metadata
+
+
+def test_distinct_chunks_are_kept():
+    other = "Art and design updates. New character models for Cyber Warriors are half complete."
+    canonical, stats = deduplicate([note("2024-07-20.txt"), note("2024-07-21.txt", other)])
+    assert stats["duplicates_removed"] == 0
+    assert [document.metadata["ref_count"] for document in canonical] == [1, 1]
+
+
+
+class HashedEmbeddings:
+    # Bag-of-words vectors, enough to tell the test notes apart without a model
+    def _vector(self, text):
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[sum(map(ord, word)) % 64] += 1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def test_folded_chunks_are_found_in_every_month_they_appeared(tmp_path):
+    pytest.importorskip("langchain_chroma")
+    from partitioned_index import PartitionedIndex, build_partitioned_index
+
+    other = "Art and design updates. New character models for Cyber Warriors are half complete."
+    canonical, _ = deduplicate([
+        note("meeting_notes/2024-07-20.txt"),
+        note("meeting_notes/2024-08-05.txt"),
+        note("meeting_notes/2024-08-06.txt", other),
+    ])
+    embeddings = HashedEmbeddings()
+    build_partitioned_index(canonical, embeddings, str(tmp_path))
+    index = PartitionedIndex(str(tmp_path), embeddings)
+
+    # The action items were folded into the August chunk, but first came up in July
+    assert index.manifest["partitions"]["2024-07"]["chunks"] == 1
+    [july] = index.similarity_search("Action items from July 2024", k=3)
+    assert july.page_content == ACTION_ITEMS
+    assert july.metadata["date"] == "2024-07-20"
+
+    # Searching both months returns the chunk once, not once per partition
+    results = index.similarity_search("stress test action items", k=3)
+    assert [document.page_content for document in results].count(ACTION_ITEMS) == 1
+    assert len(results) == 2
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.tools import tool
+
+from tool_selector import ToolSelector
+
+
+@tool
+def get_tasks_by_due_date(due_date: str):
+    """Gets the tasks due on a date, formatted as YYYY-MM-DD."""
+
+
+@tool
+def update_task(project_name: str, task_content: str, new_content: str):
+    """Renames a task in a project."""
+
+
+@tool
+def delete_project(project_name: str):
+    """Deletes a project and all of its tasks."""
+
+
+@tool
+def get_user_projects():
+    """Lists the user's projects."""
+
+
+def selector():
+    tools = [get_tasks_by_due_date, update_task, delete_project, get_user_projects]
+    return ToolSelector({function.name: function for function in tools}, top_k=1)
+
+
+def names(tools):
+    return [function.name for function in tools]
+
+
+def test_the_message_picks_the_tools():
+    assert names(selector().select("What tasks are due on 2024-07-30?")) == ["get_tasks_by_due_date"]
+
+
+def test_a_reply_to_a_clarifying_question_keeps_its_tool():
+    question = "Which task do you want me to rename, 'Buy milk' in Groceries or in Personal?"
+    assert "update_task" in names(selector().select("The Groceries one", context=question))
+
+
+def test_tools_called_earlier_stay_bound():
+    tools = selector().select("Yes, go ahead", pending_tool_names=["delete_project"])
+    assert "delete_project" in names(tools)
+
+
+class CountingEmbeddings:
+    # One dimension per tool name keyword, so the ranking is predictable
+    def __init__(self):
+        self.queries = []
+
+    def _vector(self, text):
+        return [float(word in text.lower()) for word in ("due", "rename", "delete", "projects")]
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return self._vector(text)
+
+
+def test_embedding_ranking_embeds_each_text_once():
+    tool_selector = selector()
+    embeddings = CountingEmbeddings()
+    tool_selector.warm_up(lambda: embeddings)
+    deadline = time.monotonic() + 5
+    while tool_selector.stats()["mode"] != "embedding" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Every step of a turn ranks the same message and context again
+    for _ in range(3):
+        tools = tool_selector.select("Please delete it", context="Which project should I delete?")
+    assert names(tools) == ["delete_project"]
+    assert embeddings.queries == ["Please delete it", "Which project should I delete?"]